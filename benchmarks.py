@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the simulation hot paths across population sizes.
+
+Times the normal samplers, select_employer, one_month_rule, one_year_rule
+and the main Analyzer analyses at fixed seeds, writes the median of several
+repeats as JSON and compares them with a stored baseline. The relative
+median absolute deviation of the repeats is stored too, and widens the
+regression threshold of noisy benchmarks:
+
+    python benchmarks.py --save-baseline                 # on the reference machine
+    python benchmarks.py --baseline bench_baseline.json  # fails on regressions
+
+A missing baseline is a failure too, so that a check that found nothing to
+compare does not pass.
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+# Froms
+from main import normal_int, normal_ints, Analyzer
+from ensemble import ENGINES
+
+
+SIZES = [1_000, 10_000, 100_000]
+
+# Engines with all timed hot paths (MeanFieldWorld has no select_employer)
+BENCH_ENGINES = [name for name, world in ENGINES.items()
+                 if hasattr(world, 'select_employer')]
+
+# Money per actor, as in the notebook (N = 1000, M = 100000)
+MONEY_PER_ACTOR = 100
+
+# Years of synthetic history for the analysis benchmarks
+ANALYSIS_YEARS = 20
+
+# Shortest timed run of a benchmark that can be called repeatedly
+MIN_RUN_SECONDS = 0.05
+
+# Relative deviations of a noisy benchmark that are not a regression
+NOISE_DEVIATIONS = 3
+
+
+def autorange(function):
+    '''
+    Calls per timed run so that a run takes at least MIN_RUN_SECONDS
+    '''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        if time.perf_counter() - start >= MIN_RUN_SECONDS:
+            return number
+        number *= 2
+
+
+def timing(function, repeat=5, number=None):
+    '''
+    Median mean seconds per call over repeat runs of number calls, and the
+    median absolute deviation of the runs relative to the median. Without
+    number, runs are made long enough to time reliably.
+    '''
+    if number is None:
+        number = autorange(function)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+
+    median = float(np.median(times))
+    deviation = float(np.median(np.abs(np.asarray(times) - median)))
+    return median, deviation / median if median > 0 else 0.0
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def synthetic_analyzer(N, seed):
+    '''
+    Analyzer with ANALYSIS_YEARS of log-normal wealths and incomes
+    '''
+    rng = np.random.default_rng(seed)
+    analyzer = Analyzer(N)
+    for year in range(ANALYSIS_YEARS):
+        analyzer.store_classes(rng.integers(0, 3, N))
+        analyzer.store_incomes_and_wealths(
+            rng.lognormal(6, 1, N), rng.lognormal(4, 1, N))
+        analyzer.add_yearly_revenue(int(rng.integers(10**6, 2 * 10**6)))
+        analyzer.add_yearly_wage_bill(int(rng.integers(10**5, 10**6)))
+    return analyzer
+
+
+def bench_size(N, engine, seed, years=True, repeat=5, year_repeat=3):
+    '''
+    (seconds per call, relative deviation) of every benchmark at population N.
+    Month and year rules advance the world, so their repeats time
+    consecutive months and years.
+    '''
+    results = {}
+
+    seeded(seed)
+    results['normal_int'] = timing(lambda: normal_int(0, N), repeat)
+    results['normal_ints'] = timing(lambda: normal_ints(0, N, size=N), repeat)
+
+    seeded(seed)
+    world = ENGINES[engine](N, MONEY_PER_ACTOR * N)
+    world.one_month_rule()
+
+    results['select_employer'] = timing(world.select_employer, repeat)
+    results['one_month_rule'] = timing(world.one_month_rule, repeat, 1)
+    if years:
+        results['one_year_rule'] = timing(world.one_year_rule, year_repeat, 1)
+
+    analyzer = synthetic_analyzer(N, seed)
+
+    def entropy_analysis():
+        analyzer.derived.clear()
+        analyzer.entropy_analysis(N)
+
+    def commonwealth_series():
+        analyzer.derived.clear()
+        analyzer.commonwealth_series(N, 20)
+
+    results['entropy_analysis'] = timing(entropy_analysis, repeat)
+    results['commonwealth_series'] = timing(commonwealth_series, repeat)
+    results['gdp_growth_measures'] = timing(analyzer.gdp_growth_measures, repeat)
+    results['class_rows'] = timing(
+        lambda: np.concatenate(list(analyzer.capitalist_incomes)), repeat)
+
+    return results
+
+
+def run(sizes, engine, seed, year_limit, repeat=5, year_repeat=3):
+    results = {}
+    noise = {}
+    for N in sizes:
+        print(f'N = {N}', file=sys.stderr)
+        timings = bench_size(N, engine, seed, N <= year_limit, repeat, year_repeat)
+        for name, (seconds, deviation) in timings.items():
+            results[f'{engine}/N={N}/{name}'] = seconds
+            noise[f'{engine}/N={N}/{name}'] = deviation
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'seed': seed,
+            'repeat': repeat,
+            'year_repeat': year_repeat,
+        },
+        'results': results,
+        'noise': noise,
+    }
+
+
+def compare(current, baseline, threshold):
+    '''
+    Benchmarks slower than their baseline by more than threshold, or by
+    more than NOISE_DEVIATIONS relative deviations of the noisier of both
+    measurements if that is larger. Returns [(name, ratio, limit)].
+    '''
+    regressions = []
+    for name, seconds in current['results'].items():
+        reference = baseline['results'].get(name)
+        if reference:
+            ratio = seconds / reference
+            noise = max(current.get('noise', {}).get(name, 0.0),
+                        baseline.get('noise', {}).get(name, 0.0))
+            limit = max(threshold, 1 + NOISE_DEVIATIONS * noise)
+            if ratio > limit:
+                regressions.append((name, ratio, limit))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulation benchmarks.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--engine', choices=BENCH_ENGINES, default='array')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--year-limit', type=int, default=max(SIZES),
+                        help='largest N for which one_year_rule is timed')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per benchmark, the median is kept')
+    parser.add_argument('--year-repeat', type=int, default=3,
+                        help='timed years for one_year_rule')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='slowdown ratio counted as a regression, '
+                        'widened for benchmarks noisier than that')
+    args = parser.parse_args(argv)
+
+    # Without a baseline there is nothing to check, which is an error
+    # unless one is being saved
+    if not args.save_baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f'no baseline at {args.baseline}, run with --save-baseline '
+                  'to create it', file=sys.stderr)
+            return 2
+
+    current = run(args.sizes, args.engine, args.seed, args.year_limit,
+                  args.repeat, args.year_repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+        return 0
+
+    regressions = compare(current, baseline, args.threshold)
+    for name, ratio, limit in regressions:
+        print(f'REGRESSION {name}: {ratio:.2f}x baseline (limit {limit:.2f}x)')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Binary snapshots of a running MaterialWorld, ArrayWorld or LeapingWorld.
+
+A snapshot holds actor state, the employment graph, market_value, the
+employer index, both random generator states and the Analyzer history, so a
+restored world continues with identical results. A SnapshotLibrary keeps
+equilibrated worlds to warm-start new runs without the burn-in.
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import json
+import os
+import random
+
+# Froms
+from itertools import chain
+from main import MaterialWorld, ArrayWorld, Analyzer
+from leaping import LeapingWorld, default_leap_size
+
+
+WORLDS = {
+    'MaterialWorld': MaterialWorld,
+    'ArrayWorld': ArrayWorld,
+    'LeapingWorld': LeapingWorld,
+}
+
+# Analyzer lists of numbers
+ANALYZER_SERIES = ['revenues', 'gdp_growth', 'recessions', 'wage_bills',
+                   'wage_shares', 'profit_shares', 'commonwealths',
+                   'firm_demises']
+
+# Analyzer lists of per-year or per-month lists
+ANALYZER_ROWS = ['class_measures', 'firm_size_counts']
+
+# Analyzer years x N arrays
+ANALYZER_ARRAYS = ['actor_incomes', 'actor_wealths', 'actor_classes']
+
+
+def pack_rows(arrays, name, rows):
+    '''
+    Store a list of lists as concatenated values plus row lengths
+    '''
+    arrays[name + '.values'] = np.asarray(list(chain(*rows)))
+    arrays[name + '.lengths'] = np.asarray([len(r) for r in rows], dtype=np.int64)
+
+
+def unpack_rows(arrays, name):
+    values = arrays[name + '.values'].tolist()
+    rows = []
+    start = 0
+    for length in arrays[name + '.lengths'].tolist():
+        rows.append(values[start:start + length])
+        start += length
+    return rows
+
+
+def pack_random_states(arrays):
+    version, mt, gauss_next = random.getstate()
+    arrays['random.mt'] = np.asarray(mt, dtype=np.uint64)
+    arrays['random.meta'] = np.asarray(
+        [version, np.nan if gauss_next is None else gauss_next])
+
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    arrays['numpy.keys'] = keys
+    arrays['numpy.meta'] = np.asarray([pos, has_gauss, cached_gaussian])
+
+
+def unpack_random_states(arrays):
+    version, gauss_next = arrays['random.meta'].tolist()
+    random.setstate((int(version), tuple(arrays['random.mt'].tolist()),
+                     None if np.isnan(gauss_next) else gauss_next))
+
+    pos, has_gauss, cached_gaussian = arrays['numpy.meta'].tolist()
+    np.random.set_state(('MT19937', arrays['numpy.keys'], int(pos),
+                         int(has_gauss), cached_gaussian))
+
+
+def pack_analyzer(arrays, analyzer):
+    for name in ANALYZER_SERIES:
+        arrays['analyzer.' + name] = np.asarray(getattr(analyzer, name))
+    for name in ANALYZER_ROWS:
+        pack_rows(arrays, 'analyzer.' + name, getattr(analyzer, name))
+    for name in ANALYZER_ARRAYS:
+        arrays['analyzer.' + name] = getattr(analyzer, name)
+
+
+def unpack_analyzer(arrays, N):
+    analyzer = Analyzer(N)
+    for name in ANALYZER_SERIES:
+        setattr(analyzer, name, arrays['analyzer.' + name].tolist())
+
+    analyzer.class_measures = unpack_rows(arrays, 'analyzer.class_measures')
+    analyzer.firm_size_counts = [
+        np.asarray(counts, dtype=np.int64)
+        for counts in unpack_rows(arrays, 'analyzer.firm_size_counts')]
+
+    incomes = arrays['analyzer.actor_incomes']
+    classes = arrays['analyzer.actor_classes']
+    analyzer.reserve(max(len(incomes), len(classes)))
+    analyzer.incomes[:len(incomes)] = incomes
+    analyzer.wealths[:len(incomes)] = arrays['analyzer.actor_wealths']
+    analyzer.classes[:len(classes)] = classes
+    analyzer.years = len(incomes)
+    return analyzer
+
+
+def pack_world(arrays, world):
+    '''
+    Actor state and employment graph of either engine
+    '''
+    if isinstance(world, ArrayWorld):
+        arrays['coins'] = world.coins
+        arrays['yearly_income'] = world.yearly_income
+        arrays['employer'] = world.employer
+        pack_rows(arrays, 'employees', [
+            [] if world.roster.employees(i) is None
+            else world.roster.employees(i).tolist()
+            for i in range(world.N)])
+        if isinstance(world, LeapingWorld):
+            arrays['pending'] = world.pending
+    else:
+        arrays['coins'] = np.asarray([a.coins for a in world.actors])
+        arrays['yearly_income'] = np.asarray(
+            [a.yearly_income for a in world.actors])
+        arrays['employer'] = np.asarray(
+            [a.employer for a in world.actors], dtype=np.int64)
+        pack_rows(arrays, 'employees', [a.employees.ids for a in world.actors])
+
+    index = world.employer_index
+    arrays['index.tree'] = np.asarray(index.tree, dtype=np.float64)
+    arrays['index.weights'] = np.asarray(index.weights, dtype=np.float64)
+    arrays['index.total'] = np.asarray(index.total, dtype=np.float64)
+
+
+def unpack_world(arrays, world):
+    employees = unpack_rows(arrays, 'employees')
+
+    if isinstance(world, ArrayWorld):
+        world.coins[:] = arrays['coins']
+        world.yearly_income[:] = arrays['yearly_income']
+        world.employer[:] = arrays['employer']
+        for firm, ids in enumerate(employees):
+            for id in ids:
+                world.roster.add(firm, id)
+        if isinstance(world, LeapingWorld):
+            world.pending = arrays['pending'].astype(np.int64)
+    else:
+        for actor, coins, income, employer, ids in zip(
+                world.actors, arrays['coins'].tolist(),
+                arrays['yearly_income'].tolist(),
+                arrays['employer'].tolist(), employees):
+            actor.coins = coins
+            actor.yearly_income = income
+            actor.employer = employer
+            for id in ids:
+                actor.employ_other(id)
+
+    index = world.employer_index
+    index.tree = arrays['index.tree'].tolist()
+    index.weights = arrays['index.weights'].tolist()
+    index.total = float(arrays['index.total'])
+
+
+def save(world, path):
+    '''
+    Write a compressed snapshot of the world and the random generators
+    '''
+    engine = type(world).__name__
+    if WORLDS.get(engine) is not type(world):
+        raise TypeError(f'cannot snapshot a {engine}, only one of {list(WORLDS)}')
+
+    meta = {
+        'engine': engine,
+        'N': world.N,
+        'M': world.Money,
+        'wa': world.wa,
+        'wb': world.wb,
+        'market_value': world.market_value,
+        'years': len(world.analyzer.class_measures),
+    }
+    if isinstance(world, LeapingWorld):
+        meta['leap_size'] = world.leap_size
+
+    arrays = {'meta': np.asarray(json.dumps(meta))}
+    pack_world(arrays, world)
+    pack_analyzer(arrays, world.analyzer)
+    pack_random_states(arrays)
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, path)
+
+
+def load(path, restore_random=True):
+    '''
+    Rebuild a world from a snapshot. Also restores the random generators
+    unless restore_random is False.
+    '''
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+
+    meta = json.loads(str(arrays['meta']))
+    world = WORLDS[meta['engine']](meta['N'], meta['M'], meta['wa'], meta['wb'])
+    world.market_value = meta['market_value']
+    if 'leap_size' in meta:
+        world.leap_size = meta['leap_size']
+
+    unpack_world(arrays, world)
+    world.analyzer = unpack_analyzer(arrays, meta['N'])
+
+    if restore_random:
+        unpack_random_states(arrays)
+
+    return world
+
+
+class SnapshotLibrary:
+    def __init__(self, path='snapshots'):
+        '''
+        Directory of equilibrated snapshots, one per engine and parameters
+        '''
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, N, M, engine='MaterialWorld', wa=None, wb=None,
+             burn_in=100, leap_size=None):
+        '''
+        Snapshot path of the parameters after burn_in years. LeapingWorld
+        snapshots are kept per leap size.
+        '''
+        wa = MaterialWorld.wa if wa is None else wa
+        wb = MaterialWorld.wb if wb is None else wb
+        name = f'{engine}-N{N}-M{M}-wa{wa}-wb{wb}-burn{burn_in}'
+        if engine == 'LeapingWorld':
+            name += f'-leap{leap_size or default_leap_size(N)}'
+        return os.path.join(self.path, name + '.npz')
+
+    def add(self, world, burn_in=None):
+        '''
+        Store a world as the equilibrated snapshot for its parameters after
+        burn_in years (default: the years of its history)
+        '''
+        if burn_in is None:
+            burn_in = len(world.analyzer.class_measures)
+        path = self.file(world.N, world.Money, type(world).__name__,
+                         world.wa, world.wb, burn_in,
+                         getattr(world, 'leap_size', None))
+        save(world, path)
+        return path
+
+    def warm_start(self, N, M, engine='MaterialWorld', wa=None, wb=None,
+                   burn_in=100, seed=None, leap_size=None):
+        '''
+        World in equilibrium with an empty Analyzer history. Runs and stores
+        the burn-in the first time these parameters are requested.
+        '''
+        path = self.file(N, M, engine, wa, wb, burn_in, leap_size)
+
+        if os.path.exists(path):
+            world = load(path, restore_random=False)
+        else:
+            options = {'leap_size': leap_size} if engine == 'LeapingWorld' else {}
+            world = WORLDS[engine](N, M, wa, wb, **options)
+            world.run_sim(burn_in, verbose=False)
+            self.add(world, burn_in)
+
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed % 2**32)
+
+        world.analyzer = Analyzer(N)
+        return world
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Headless command line entry point: run one configured simulation and write
+its Analyzer results to a compressed .npz file, without any plotting.
+
+    python cli.py --N 10000 --years 100 --engine array --seed 1 --output run.npz
+
+With --checkpoint, the final world is also saved as a checkpoint snapshot,
+with the full per-actor history for report.py or a warm start.
+"""
+
+# Built-int
+import argparse
+import json
+import random
+import sys
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run a social architecture of capitalism simulation.')
+    parser.add_argument('--N', type=int, default=1_000, help='number of actors')
+    parser.add_argument('--M', type=int, default=100_000, help='total money')
+    parser.add_argument('--years', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--engine',
+                        choices=['material', 'array', 'leaping', 'meanfield'],
+                        default='material')
+    parser.add_argument('--wa', type=int, default=None, help='lowest wage')
+    parser.add_argument('--wb', type=int, default=None, help='highest wage')
+    parser.add_argument('--analyzer', choices=['full', 'streaming', 'trace'],
+                        default='full',
+                        help='keep history in RAM, as sketches, or on disk')
+    parser.add_argument('--trace', default='trace',
+                        help='trace directory for --analyzer trace')
+    parser.add_argument('--converge', type=int, default=None, metavar='SAMPLES',
+                        help='stop after SAMPLES equilibrium years '
+                             '(--years is then the maximum)')
+    parser.add_argument('--audit', type=int, default=None, metavar='STEPS',
+                        help='check money conservation in a ledger, with a '
+                             'deep audit every STEPS steps (material engine)')
+    parser.add_argument('--output', default='results.npz')
+    parser.add_argument('--checkpoint', default=None, metavar='PATH',
+                        help='also save the final world as a checkpoint snapshot')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.audit is not None and args.engine != 'material':
+        parser.error('--audit needs --engine material')
+    if args.checkpoint is not None and (args.engine == 'meanfield' or
+                                        args.analyzer != 'full'):
+        parser.error('--checkpoint needs --analyzer full and an actor engine')
+    if args.engine == 'meanfield' and args.analyzer != 'full':
+        parser.error('--engine meanfield keeps densities, not actors: '
+                     'use --analyzer full')
+    return args
+
+
+def make_analyzer(args):
+    if args.analyzer == 'streaming':
+        from streaming import StreamingAnalyzer
+        return StreamingAnalyzer(args.N)
+    if args.analyzer == 'trace':
+        from traces import TraceAnalyzer
+        return TraceAnalyzer(args.trace, args.N)
+    return None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    import numpy as np
+    from ensemble import ENGINES, compact_results
+    from main import EquilibriumDetector
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed % 2**32)
+
+    world = ENGINES[args.engine](args.N, args.M, args.wa, args.wb,
+                                 analyzer=make_analyzer(args))
+
+    if args.audit is not None:
+        world.enable_ledger(audit_every=args.audit)
+
+    convergence = None
+    if args.converge is not None:
+        convergence = EquilibriumDetector(samples=args.converge)
+
+    start = time.perf_counter()
+    burn_in = world.run_sim(args.years, verbose=not args.quiet,
+                            convergence=convergence)
+    elapsed = time.perf_counter() - start
+
+    results = compact_results(world.analyzer)
+    np.savez_compressed(args.output, **results)
+
+    if args.checkpoint is not None:
+        import checkpoint
+        checkpoint.save(world, args.checkpoint)
+
+    summary = {
+        'output': args.output,
+        'checkpoint': args.checkpoint,
+        'years': len(world.analyzer.class_measures),
+        'burn_in': burn_in,
+        'seconds': round(elapsed, 3),
+        'class_measures': world.analyzer.class_measures[-1:],
+    }
+    if getattr(world, 'ledger', None) is not None:
+        summary['ledger'] = world.ledger.summary()
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
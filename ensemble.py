@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Ensembles of independent, seeded simulation replicas run across a process pool.
+
+Each replica returns its Analyzer history as a dict of compact NumPy arrays,
+which are merged into pooled distributions and per-year confidence bands.
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import random
+
+# Froms
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from main import MaterialWorld, ArrayWorld, Analyzer
+from leaping import LeapingWorld
+from meanfield import MeanFieldWorld
+
+
+ENGINES = {
+    'material': MaterialWorld,
+    'array': ArrayWorld,
+    'leaping': LeapingWorld,
+    'meanfield': MeanFieldWorld,
+}
+
+# Analyzer series stored per year (or per month for firm_demises)
+SERIES = ['revenues', 'wage_bills', 'gdp_growth', 'wage_shares',
+          'profit_shares', 'firm_demises']
+
+
+def replica_seeds(seed, replicas):
+    '''
+    Independent seeds for every replica, derived from one ensemble seed
+    '''
+    children = np.random.SeedSequence(seed).spawn(replicas)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def compact_results(analyzer):
+    '''
+    Analyzer history as a dict of NumPy arrays
+    '''
+    results = {name: np.asarray(getattr(analyzer, name), dtype=np.float64)
+               for name in SERIES}
+    results['class_measures'] = np.asarray(
+        analyzer.class_measures, dtype=np.int64).reshape(-1, 4)
+    results['recessions'] = np.asarray(analyzer.recessions, dtype=np.int64)
+    results['firm_size_counts'] = analyzer.firm_size_distribution()
+    results['final_wealths'] = np.array(
+        analyzer.actor_wealths[-1] if len(analyzer.actor_wealths) else [])
+    return results
+
+
+def results_analyzer(results):
+    '''
+    Analyzer with the yearly and monthly series of compact results. Firm
+    sizes are pooled in one row, and there is no per-actor history.
+    '''
+    class_measures = np.asarray(results['class_measures']).tolist()
+    analyzer = Analyzer(sum(class_measures[0]) if class_measures else None)
+
+    analyzer.class_measures = class_measures
+    analyzer.revenues = np.asarray(results['revenues']).tolist()
+    analyzer.wage_bills = np.asarray(results['wage_bills']).tolist()
+    analyzer.firm_demises = np.asarray(results['firm_demises']).astype(int).tolist()
+    analyzer.firm_size_counts = [np.asarray(results['firm_size_counts'],
+                                            dtype=np.int64)]
+    analyzer.gdp_growth_measures()
+    return analyzer
+
+
+def run_world(N, M, years, seed, engine='material', wa=None, wb=None):
+    '''
+    Run one seeded world for a number of years. Returns the world.
+    '''
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    world = ENGINES[engine](N, M, wa, wb)
+    world.run_sim(years, verbose=False)
+    return world
+
+
+def run_replica(N, M, years, seed, engine='material'):
+    '''
+    Run one seeded world for a number of years. Returns compact results.
+    '''
+    world = run_world(N, M, years, seed, engine)
+
+    results = compact_results(world.analyzer)
+    results['seed'] = seed
+    return results
+
+
+def run_ensemble(N, M, years, replicas, seed=0, engine='material', processes=None):
+    '''
+    Run replicas across a process pool. Yields each replica's results as it finishes.
+    '''
+    seeds = replica_seeds(seed, replicas)
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(run_replica, N, M, years, s, engine)
+                   for s in seeds]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+class Ensemble:
+    def __init__(self):
+        '''
+        Merged results of several replicas
+        '''
+        self.replicas = []
+
+    def add(self, results):
+        self.replicas.append(results)
+
+    def run(self, N, M, years, replicas, seed=0, engine='material', processes=None):
+        '''
+        Run and merge an ensemble. Returns self.
+        '''
+        for results in run_ensemble(N, M, years, replicas, seed, engine, processes):
+            self.add(results)
+        return self
+
+    def pooled(self, metric):
+        '''
+        All replica values of a metric in one array, e.g. 'firm_demises' or 'recessions'
+        '''
+        return np.concatenate([r[metric].ravel() for r in self.replicas])
+
+    def firm_size_distribution(self):
+        '''
+        Pooled firm size counts, indexed by firm size
+        '''
+        size = max(len(r['firm_size_counts']) for r in self.replicas)
+        counts = np.zeros(size, dtype=np.int64)
+        for r in self.replicas:
+            counts[:len(r['firm_size_counts'])] += r['firm_size_counts']
+        return counts
+
+    def stacked(self, metric):
+        '''
+        Replicas x time array of a series. Replicas must have run the same years.
+        '''
+        return np.stack([r[metric] for r in self.replicas])
+
+    def band(self, metric, quantiles=(0.05, 0.5, 0.95)):
+        '''
+        Per-step quantiles of a series across replicas. Returns quantiles x time.
+        '''
+        return np.quantile(self.stacked(metric), quantiles, axis=0)
+
+    def mean_interval(self, metric, z=1.96):
+        '''
+        Per-step mean of a series with a normal confidence interval. Returns (mean, low, high).
+        '''
+        data = self.stacked(metric)
+        mean = data.mean(axis=0)
+        half = z * data.std(axis=0, ddof=1) / np.sqrt(len(data))
+        return mean, mean - half, mean + half
+
+    def class_share_band(self, quantiles=(0.05, 0.5, 0.95)):
+        '''
+        Per-year quantiles of class shares [unemployed, workers, capitalists, undef].
+        Returns quantiles x years x 4.
+        '''
+        measures = self.stacked('class_measures')
+        shares = measures / measures.sum(axis=2, keepdims=True)
+        return np.quantile(shares, quantiles, axis=0)
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""
+Approximate tau-leaping mode of ArrayWorld.
+
+LeapingWorld advances a month in leaps of leap_size actor steps instead of N
+sequential simulation_rule calls. Every leap draws its acting actors at once
+and applies hiring, expenditure, market revenue, firing and wage payment to
+all of them with array operations, rule by rule as one_month_rule does.
+
+Within a leap the rules read the state left by the previous rule for the
+whole batch, not after every single actor. Conflicts are resolved as follows:
+  - an actor drawn twice acts once now and again in the next leap, so every
+    draw acts once, those of the last leap of a month in the next month;
+  - hires of actors that are themselves hired in the same leap are dropped;
+  - the coins of an actor picked to spend by several others are taken one
+    after another, each a random fraction of what is left;
+  - the market is replayed in acting order, each step's expenditure going
+    in before its revenue draw, solved for the whole leap at once.
+Random numbers are drawn a month at a time, and firm rosters are rebuilt from
+the employer array at the end of every month. Leaps smaller than
+MIN_LEAP_SIZE are refused, since their fixed cost makes them slower than the
+exact engine.
+
+Error metric (leap_error): over replicas run with both engines, the largest
+difference over years and classes of the mean class share, the difference of
+the mean wage share, and the Kolmogorov-Smirnov distance between the pooled
+final wealth distributions. Run `python leaping.py` for a table.
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import argparse
+import json
+import random
+import sys
+import time
+
+# Froms
+from main import ArrayWorld, normal_ints
+
+
+# Resolution of the random fractions drawn for pool takes
+FRACTION_STEPS = 10**6
+
+# Smallest share of the market left by a revenue draw in market_replay, so
+# that its logarithm is finite
+MIN_KEPT = 1e-300
+
+# Smallest leap size accepted: below it a leap's fixed cost makes leaping
+# slower than the exact engine
+MIN_LEAP_SIZE = 512
+
+
+def sequential_takes(pools, groups, fractions):
+    '''
+    Integer amounts taken one after another from pools[groups], each a fraction
+    of what is left in its pool. groups must be sorted.
+    '''
+    # Fraction left of each pool after every take, cumulative within groups
+    left = np.log1p(-np.minimum(fractions, 1 - 1e-12))
+    cumulative = np.cumsum(left)
+    first = np.r_[True, groups[1:] != groups[:-1]]
+    start = np.flatnonzero(first)
+    offset = np.repeat(cumulative[start] - left[start], np.diff(np.r_[start, len(groups)]))
+
+    # Whole amounts taken so far, rounded as normal_int does, differenced
+    # into each take
+    pool = pools[groups]
+    taken = np.floor(pool * -np.expm1(cumulative - offset) + 0.5)
+    previous = np.r_[0, taken[:-1]]
+    previous[first] = 0
+    return taken - previous
+
+
+def draw_fractions(size):
+    '''
+    Fractions in [0, 1] from the discretized normal of normal_int(0, n)
+    '''
+    return normal_ints(0, FRACTION_STEPS, size=size) / FRACTION_STEPS
+
+
+def market_replay(market, spent, fractions):
+    '''
+    Whole revenues of steps that each put spent into the market and then draw
+    fractions of it (0 for steps without a revenue draw), and the market
+    left. The market after step i is (1 - f_i) (m_{i-1} + s_i); it is solved
+    for all steps at once in log space, and its cumulative outflow, rounded,
+    is differenced into revenues.
+    '''
+    kept = np.log(np.maximum(1 - fractions, MIN_KEPT))
+    after = np.cumsum(kept)
+    inflows = spent.astype(np.float64)
+    inflows[0] += market
+    with np.errstate(divide='ignore'):
+        values = np.exp(after + np.logaddexp.accumulate(np.log(inflows) -
+                                                        (after - kept)))
+
+    total = market + np.cumsum(spent)
+    taken = np.floor(total - values + 0.5)
+    taken = np.minimum(np.maximum.accumulate(np.maximum(taken, 0)), total)
+    return np.diff(taken, prepend=0), total[-1] - taken[-1]
+
+
+def redrawn_wages(left):
+    '''
+    normal_ints(0, left) of the small arrays of payrolls, without its
+    overhead: draws outside the range are redrawn by normal_ints
+    '''
+    wages = np.trunc(left / 2 + np.random.standard_normal(len(left)) *
+                     (left + 1) / 6 + 0.5).astype(np.int64)
+    outside = (wages < 0) | (wages > left)
+    if outside.any():
+        wages[outside] = normal_ints(0, left[outside])
+    return wages
+
+
+def payrolls(coins, wages, groups, ranks):
+    '''
+    payroll() of several firms at once: wages paid to the employees of firm
+    groups[i], in order of ranks[i], from the coins of every firm, starting
+    from its drawn wage. Returns an int64 array.
+    '''
+    sizes = np.bincount(groups, minlength=len(coins))
+    coins = coins.astype(np.float64)
+    wages = np.asarray(wages, dtype=np.int64).copy()
+    paid = np.zeros(len(coins), dtype=np.int64)
+    amounts = np.zeros(len(groups), dtype=np.int64)
+
+    # Every round pays each firm's current wage while it can, then draws a
+    # new one from what is left, until everyone is paid or the wage is 0
+    active = np.flatnonzero((sizes > 0) & (wages > 0))
+    while len(active):
+        wage = wages[active]
+        k = np.minimum(sizes[active] - paid[active],
+                       np.maximum(coins[active] // wage, 0)).astype(np.int64)
+
+        (first, last) = (np.zeros(len(coins), dtype=np.int64),
+                         np.zeros(len(coins), dtype=np.int64))
+        first[active] = paid[active]
+        last[active] = paid[active] + k
+        now = (ranks >= first[groups]) & (ranks < last[groups])
+        amounts[now] = wages[groups[now]]
+
+        coins[active] -= k * wage
+        paid[active] += k
+        active = active[paid[active] < sizes[active]]
+        wages[active] = redrawn_wages(np.floor(coins[active]).astype(np.int64))
+        active = active[wages[active] > 0]
+
+    return amounts
+
+
+def default_leap_size(N, divisor=16):
+    '''
+    N / divisor actor steps, but at least MIN_LEAP_SIZE or N
+    '''
+    return max(N // divisor, min(MIN_LEAP_SIZE, N))
+
+
+class LeapingWorld(ArrayWorld):
+    def __init__(self, N, M, wa=None, wb=None, analyzer=None, leap_size=None):
+        '''
+        ArrayWorld advancing in leaps of leap_size actor steps (default
+        N / 16, at least MIN_LEAP_SIZE or N). Larger leaps are faster and
+        less exact.
+        '''
+        super().__init__(N, M, wa, wb, analyzer)
+        self.leap_size = leap_size or default_leap_size(N)
+        if self.leap_size < min(MIN_LEAP_SIZE, N):
+            raise ValueError(f'leap_size {self.leap_size} is below '
+                             f'{min(MIN_LEAP_SIZE, N)}, where the exact '
+                             'engine is faster')
+        self.pending = np.zeros(0, dtype=np.int64)
+        self.draws = None
+
+    @property
+    def employer_index(self):
+        '''
+        Index of potential employers, rebuilt when first read after a month.
+        Leaps pick employers from the coins directly.
+        '''
+        if self.stale_index:
+            self.stale_index = False
+            ArrayWorld.rebuild_employer_index(self)
+        return self.index
+
+    @employer_index.setter
+    def employer_index(self, index):
+        self.index = index
+        self.stale_index = False
+
+    def rebuild_employer_index(self):
+        self.stale_index = True
+
+    def take(self, kind, size):
+        '''
+        The next size random draws of a kind, out of those drawn for the month
+        '''
+        (values, used) = self.draws[kind]
+        self.draws[kind] = (values, used + size)
+        return values[used:used + size]
+
+    def select_actors(self, size):
+        '''
+        Actor ids drawn as select_actor does
+        '''
+        return normal_ints(0, self.N - 1, size=size)
+
+    def select_employers(self, size):
+        '''
+        Employer ids weighted by coins among potential employers
+        '''
+        potential = (self.employer < 0) | (self.firm_size > 0)
+        weights = np.cumsum(np.where(potential, self.coins, 0))
+        draws = self.take('employers', size) * weights[-1]
+        return np.minimum(np.searchsorted(weights, draws, side='right'),
+                          self.N - 1)
+
+    def staff(self, firms):
+        '''
+        Employees of distinct firms, grouped by firm in random order, with the
+        position in firms of every employee's firm and the employee's rank
+        within it
+        '''
+        # The employer -1 of the unemployed reads the last, unset flag
+        member = np.zeros(self.N + 1, dtype=bool)
+        member[firms] = True
+        staff = np.flatnonzero(member[self.employer])
+
+        owners = self.employer[staff]
+        order = np.lexsort((np.random.random(len(staff)), owners))
+        (staff, owners) = (staff[order], owners[order])
+
+        position = np.zeros(self.N, dtype=np.int64)
+        position[firms] = np.arange(len(firms))
+        ranks = np.arange(len(staff)) - np.searchsorted(owners, owners)
+        return staff, position[owners], ranks
+
+    def leap_hiring(self, ids):
+        unemployed = ids[(self.employer[ids] < 0) & (self.firm_size[ids] == 0)]
+        if len(unemployed) == 0:
+            return
+
+        employers = self.select_employers(len(unemployed))
+        hiring = np.zeros(self.N, dtype=bool)
+        hiring[unemployed] = True
+        hired = ((employers != unemployed) &
+                 (self.coins[employers] > self.wage_avg) &
+                 ~hiring[employers])
+
+        self.employer[unemployed[hired]] = employers[hired]
+        np.add.at(self.firm_size, employers[hired], 1)
+
+    def leap_expenditure(self, ids):
+        '''
+        Amount spent on behalf of each acting actor, in acting order
+        '''
+        # Spenders other than the acting actors
+        spenders = self.take('spenders', len(ids)).copy()
+        same = spenders == ids
+        while same.any():
+            spenders[same] = self.select_actors(int(same.sum()))
+            same = spenders == ids
+
+        order = np.argsort(spenders, kind='stable')
+        pools = np.floor(np.maximum(self.coins, 0))
+        amounts = np.empty(len(ids))
+        amounts[order] = sequential_takes(
+            pools, spenders[order], self.take('spent', len(ids)))
+
+        np.subtract.at(self.coins, spenders, amounts)
+        return amounts
+
+    def leap_revenue(self, ids, expenditures):
+        '''
+        Market revenue of each acting actor's employer. Each expenditure goes
+        in before that step's revenue draw, as in the sequential rules.
+        '''
+        employers = self.employer[ids]
+        employed = employers >= 0
+        fractions = np.where(employed, self.take('revenue', len(ids)), 0)
+
+        (revenues, self.market_value) = market_replay(
+            self.market_value, expenditures, fractions)
+        self.market_value = int(self.market_value)
+
+        np.add.at(self.coins, employers[employed], revenues[employed])
+        np.add.at(self.yearly_income, employers[employed], revenues[employed])
+        return int(revenues.sum())
+
+    def leap_firing(self, ids):
+        firms = ids[self.firm_size[ids] > 0]
+        sizes = self.firm_size[firms]
+        fire = np.minimum(np.ceil(sizes - self.coins[firms] / self.wage_avg),
+                          sizes).astype(np.int64)
+        (firms, fire) = (firms[fire > 0], fire[fire > 0])
+        if len(firms) == 0:
+            return 0
+
+        (staff, groups, ranks) = self.staff(firms)
+        self.employer[staff[ranks < fire[groups]]] = -1
+        self.firm_size[firms] -= fire
+        return int(np.count_nonzero(self.firm_size[firms] == 0))
+
+    def leap_wages(self, ids):
+        '''
+        Wage payment of the acting firms, as wage_payment_rule: firms that
+        run out of coins part way draw lower wages from what is left
+        '''
+        firms = ids[self.firm_size[ids] > 0]
+        if len(firms) == 0:
+            return 0
+
+        (staff, groups, ranks) = self.staff(firms)
+        amounts = payrolls(self.coins[firms], self.take('wages', len(firms)),
+                           groups, ranks)
+        self.coins[staff] += amounts
+        self.yearly_income[staff] += amounts
+        self.coins[firms] -= np.bincount(groups, amounts, minlength=len(firms))
+        return int(amounts.sum())
+
+    def leap(self, ids):
+        '''
+        Apply the five rules to distinct acting actors. Returns
+        [firm demises, revenue, wage bill].
+        '''
+        self.leap_hiring(ids)
+        expenditures = self.leap_expenditure(ids)
+        revenue = self.leap_revenue(ids, expenditures)
+        demises = self.leap_firing(ids)
+        wage_bill = self.leap_wages(ids)
+        return [demises, revenue, wage_bill]
+
+    def rebuild_roster(self):
+        '''
+        Firm rosters from the employers of all actors. Leaps track employment
+        in the employer array only.
+        '''
+        employed = np.flatnonzero(self.employer >= 0)
+        firms = self.employer[employed]
+        order = np.argsort(firms, kind='stable')
+        (employed, firms) = (employed[order], firms[order])
+        (owners, starts, counts) = np.unique(firms, return_index=True,
+                                             return_counts=True)
+
+        self.firm_size[:] = 0
+        self.firm_size[owners] = counts
+        bounds = np.append(starts, len(employed)).tolist()
+        self.roster.buffers = {
+            firm: employed[start:stop] for firm, start, stop in
+            zip(owners.tolist(), bounds[:-1], bounds[1:])}
+
+    def one_month_rule(self):
+        '''
+        N actor draws in leaps. Actors drawn twice in a leap act again in the
+        next, which for the last leap is the first of the next month.
+        '''
+        N = self.N
+
+        # At most N new and the pending actors act this month
+        acting = N + len(self.pending)
+        (actors, spenders) = np.split(self.select_actors(N + acting), [N])
+        (spent, revenue) = np.split(draw_fractions(2 * acting), 2)
+        self.draws = {kind: (values, 0) for kind, values in [
+            ('actors', actors), ('spenders', spenders), ('spent', spent),
+            ('revenue', revenue),
+            ('wages', normal_ints(self.wa, self.wb, size=acting)),
+            ('employers', np.random.random(acting))]}
+
+        firm_demise_counter = 0
+        revenue_counter = 0
+        total_wage_bill = 0
+
+        steps = N
+        while steps > 0:
+            new = min(steps, max(self.leap_size - len(self.pending), 1))
+            draws = np.concatenate((self.pending, self.take('actors', new)))
+            steps -= new
+
+            (ids, first) = np.unique(draws, return_index=True)
+            repeated = np.ones(len(draws), dtype=bool)
+            repeated[first] = False
+            self.pending = draws[repeated]
+
+            # Act in draw order, not id order
+            ids = draws[np.sort(first)]
+
+            [firm_demise, revenue, wage_bill] = self.leap(ids)
+            firm_demise_counter += firm_demise
+            revenue_counter += revenue
+            total_wage_bill += wage_bill
+
+        self.draws = None
+        self.rebuild_roster()
+        self.rebuild_employer_index()
+        self.analyzer.firm_size_measure_arrays(self.firm_size)
+
+        return [firm_demise_counter, revenue_counter, total_wage_bill]
+
+
+def ks_distance(a, b):
+    '''
+    Kolmogorov-Smirnov distance between two samples
+    '''
+    a = np.sort(a)
+    b = np.sort(b)
+    points = np.concatenate((a, b))
+    return float(np.max(np.abs(np.searchsorted(a, points, side='right') / len(a) -
+                               np.searchsorted(b, points, side='right') / len(b))))
+
+
+def run_seeded(world_class, N, M, years, seed, **options):
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    world = world_class(N, M, **options)
+    start = time.perf_counter()
+    world.run_sim(years, verbose=False)
+    return world, time.perf_counter() - start
+
+
+def leap_error(N, M, years, leap_size=None, replicas=4, seed=0):
+    '''
+    Error of LeapingWorld against the exact ArrayWorld, over replicas of both:
+    largest class share difference over years and classes, wage share
+    difference, KS distance of pooled final wealths, and the speedup
+    '''
+    runs = {}
+    for name, world_class, options in [
+            ('exact', ArrayWorld, {}),
+            ('leaping', LeapingWorld, {'leap_size': leap_size})]:
+        shares, wage_shares, wealths, seconds = [], [], [], 0
+        for replica in range(replicas):
+            world, elapsed = run_seeded(world_class, N, M, years,
+                                        seed + replica, **options)
+            analyzer = world.analyzer
+            shares.append(np.asarray(analyzer.class_measures)[:, :3] / N)
+            wage_shares.append(np.mean(analyzer.wage_shares))
+            wealths.append(world.coins)
+            seconds += elapsed
+        runs[name] = (np.mean(shares, axis=0), np.mean(wage_shares),
+                      np.concatenate(wealths), seconds)
+
+    (exact, leaping) = (runs['exact'], runs['leaping'])
+    return {
+        'leap_size': leap_size or default_leap_size(N),
+        'class_share_error': float(np.max(np.abs(leaping[0] - exact[0]))),
+        'wage_share_error': float(abs(leaping[1] - exact[1])),
+        'wealth_ks': ks_distance(leaping[2], exact[2]),
+        'speedup': exact[3] / leaping[3],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Error and speedup of tau-leaping against the exact engine.')
+    parser.add_argument('--N', type=int, default=1_000)
+    parser.add_argument('--M', type=int, default=None,
+                        help='total money (default 100 per actor)')
+    parser.add_argument('--years', type=int, default=20)
+    parser.add_argument('--leap-sizes', type=int, nargs='+', default=None)
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    M = 100 * args.N if args.M is None else args.M
+    leap_sizes = args.leap_sizes or sorted(
+        {default_leap_size(args.N, d) for d in (16, 4, 1)})
+    for leap_size in leap_sizes:
+        print(json.dumps(leap_error(args.N, M, args.years, leap_size,
+                                    args.replicas, args.seed)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
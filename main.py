@@ -10,35 +10,25 @@ Original file is located at
 Simulación de la evolución de un sistema aisaldo económico definido en "The social architecture of capitalism" de Ian Wright.
 """
 
-# External
+# External (plotting libraries are imported where they are used)
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import seaborn as sns
-import colour
 
 # Built-int
 import math
 import random
 
 # Froms
-from random import normalvariate, choices
-from numpy.random import seed
+from random import normalvariate
 from numpy.random import normal
-from itertools import chain
-from colour import Color
-from collections import Counter
+from collections import OrderedDict
 
 
 def entropy_sum(data):
     '''
-    Sum formula for entropy calculation
+    Sum formula for entropy calculation. Sums the last axis of data.
     '''
-    sum = 0
-    for k in data:
-        if k > 0:
-            sum += k * np.log(k)
-    return sum
+    k = np.asarray(data, dtype=np.float64)
+    return np.sum(k * np.log(np.where(k > 0, k, 1)), axis=-1)
 
 
 def entropy(N, C, data):
@@ -53,11 +43,13 @@ mc = 50
 a = 1 / mc
 
 
-def O(M):
-    return 1 - np.exp(-a * M)
+def O(M, mc=mc):
+    return 1 - np.exp(-M / mc)
 
 
-def commonwealth_function(N, C, bins, people):
+def commonwealth_function(N, C, bins, people, mc=mc):
+    # Bin counts are in wealth order, so people must be too
+    people = np.sort(people)
     acc = 0
     sum = 0
 
@@ -66,7 +58,7 @@ def commonwealth_function(N, C, bins, people):
             continue
 
         mk = np.average(people[int(acc): int(acc + k)])
-        o = O(mk)
+        o = O(mk, mc)
         sum += k * o
         acc += k
     return sum
@@ -74,25 +66,301 @@ def commonwealth_function(N, C, bins, people):
 # Random choice from normal distribution
 
 
+class SamplerStats:
+    def __init__(self):
+        '''
+        Counters of the normal samplers. Only the rejection path touches them.
+        '''
+        self.rejections = 0
+
+
+sampler_stats = SamplerStats()
+
+
 def normal_choice(lst, mean=None, stddev=None):
+    return lst[normal_int(0, len(lst) - 1, mean, stddev)]
+
+
+def normal_int(lo, hi, mean=None, stddev=None):
+    '''
+    Random integer in [lo, hi] from a discretized normal truncated to the range.
+    Same distribution as normal_choice(list(range(lo, hi + 1))), without the list.
+    '''
+    n = hi - lo + 1
+
     if mean is None:
-        # if mean is not specified, use center of list
-        mean = (len(lst) - 1) / 2
+        # if mean is not specified, use center of range
+        mean = (lo + hi) / 2
 
     if stddev is None:
-        # if stddev is not specified, let list be -3 .. +3 standard deviations
-        stddev = len(lst) / 6
+        # if stddev is not specified, let range be -3 .. +3 standard deviations
+        stddev = n / 6
 
-    counter = 0
+    offset = mean - lo
     while True:
-        index = int(normalvariate(mean, stddev) + 0.5)
-        if 0 <= index < len(lst):
-            return lst[index]
+        index = int(normalvariate(offset, stddev) + 0.5)
+        if 0 <= index < n:
+            return lo + index
+        sampler_stats.rejections += 1
+
+
+def normal_ints(lo, hi, size=None, mean=None, stddev=None):
+    '''
+    Vectorized normal_int. lo, hi, mean and stddev may be arrays; draws use the
+    numpy.random global state. Returns an int64 array.
+    '''
+    lo = np.asarray(lo, dtype=np.int64)
+    hi = np.asarray(hi, dtype=np.int64)
+    if size is None:
+        size = np.broadcast(lo, hi).shape
+
+    n = np.broadcast_to(hi - lo + 1, size)
+
+    if mean is None:
+        mean = (lo + hi) / 2
+
+    if stddev is None:
+        stddev = n / 6
+
+    offset = np.broadcast_to(mean - lo, size).astype(np.float64)
+    stddev = np.broadcast_to(stddev, size).astype(np.float64)
+
+    # Redraw only the samples that fell outside the range
+    index = np.empty(size, dtype=np.int64)
+    pending = np.ones(size, dtype=bool)
+    while pending.any():
+        draws = np.trunc(normal(offset[pending], stddev[pending]) + 0.5)
+        inside = (draws >= 0) & (draws < n[pending])
+        sampler_stats.rejections += len(inside) - int(np.count_nonzero(inside))
+
+        slots = np.flatnonzero(pending.ravel())[inside]
+        index.ravel()[slots] = draws[inside]
+        pending.ravel()[slots] = False
+
+    return np.broadcast_to(lo, size) + index
+
+# Weighted sampling index
+
+
+def pre_drawn_normal_int(size):
+    '''
+    normal_int(lo, hi) drawing from size standard normals drawn up front with
+    NumPy, and from normal_int once they run out
+    '''
+    normals = iter(np.random.standard_normal(size).tolist())
+
+    def draw(lo, hi):
+        z = next(normals, None)
+        if z is not None:
+            n = hi - lo + 1
+            i = int((hi - lo) / 2 + z * n / 6 + 0.5)
+            if 0 <= i < n:
+                return lo + i
+            sampler_stats.rejections += 1
+        return normal_int(lo, hi)
+
+    return draw
+
+
+class FenwickTree:
+    def __init__(self, weights):
+        '''
+        Binary indexed tree over non-negative weights, for O(log N) updates and
+        weighted sampling
+        '''
+        self.rebuild(weights)
+
+    def rebuild(self, weights):
+        '''
+        Build the tree in O(N). Also clears accumulated rounding error.
+        '''
+        n = len(weights)
+        tree = [0.0] * (n + 1)
+        for i in range(1, n + 1):
+            tree[i] += weights[i - 1]
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] += tree[i]
+
+        self.n = n
+        self.tree = tree
+        self.weights = list(weights)
+        self.total = sum(self.weights)
+        self.top_bit = 1 << (n.bit_length() - 1) if n > 0 else 0
+
+    def update(self, index, weight):
+        '''
+        Set weight at index
+        '''
+        delta = weight - self.weights[index]
+        if delta == 0:
+            return
+
+        self.weights[index] = weight
+        self.total += delta
+
+        tree = self.tree
+        i = index + 1
+        while i <= self.n:
+            tree[i] += delta
+            i += i & -i
+
+    def find(self, value):
+        '''
+        Smallest index whose prefix sum of weights exceeds value
+        '''
+        tree = self.tree
+        pos = 0
+        bit = self.top_bit
+        while bit:
+            nxt = pos + bit
+            if nxt <= self.n and tree[nxt] <= value:
+                value -= tree[nxt]
+                pos = nxt
+            bit >>= 1
+
+        if pos < self.n and self.weights[pos] > 0:
+            return pos
+        return self.last_positive(min(pos, self.n - 1))
+
+    def last_positive(self, index):
+        '''
+        Last index up to index with positive weight, or None. Rounding error
+        can push a value past the tree's total, or onto a zero weight.
+        '''
+        weights = self.weights
+        while index >= 0:
+            if weights[index] > 0:
+                return index
+            index -= 1
+        return None
+
+    def sample(self):
+        '''
+        Random index with probability proportional to its weight, or None
+        if all weights are zero
+        '''
+        if self.total <= 0:
+            return None
+        return self.find(random.random() * self.total)
+
+# Batched wage payments
+
+
+def payroll(coins, n, wage):
+    '''
+    Wages paid, in order, to n employees by an employer holding coins, starting
+    from the drawn wage. As in the sequential rule, when the employer cannot
+    pay the current wage a new one is drawn from what is left. Returns an int64 array.
+    '''
+    wages = np.zeros(n, dtype=np.int64)
+    paid = 0
+
+    # Once the wage drops to 0 every remaining employee gets 0
+    while paid < n and wage > 0:
+        # Employees payable at this wage: cumulative bill within coins
+        bill = wage * np.arange(1, n - paid + 1)
+        k = int(np.searchsorted(bill, coins, side='right'))
+
+        wages[paid:paid + k] = wage
+        coins -= k * wage
+        paid += k
+
+        if paid < n:
+            wage = normal_int(0, math.floor(coins)) if coins > 0 else 0
+
+    return wages
+
+# Firm employee set
+
+
+class FirmRoster:
+    def __init__(self):
+        '''
+        Employee ids of a firm with their slot positions, for O(1) hire, fire
+        and random pick. Like a list, an id may be held more than once.
+        '''
+        self.ids = []
+        self.slots = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __getitem__(self, index):
+        return self.ids[index]
+
+    def __contains__(self, id):
+        return id in self.slots
+
+    def add(self, id):
+        self.slots.setdefault(id, []).append(len(self.ids))
+        self.ids.append(id)
+
+    def remove(self, id):
+        '''
+        Swap-remove one occurrence of employee id
+        '''
+        self.remove_at(self.slots[id][-1])
+
+    def remove_at(self, slot):
+        '''
+        Swap-remove the employee at slot: last employee takes its place
+        '''
+        id = self.ids[slot]
+        last = len(self.ids) - 1
+
+        slots = self.slots[id]
+        slots.remove(slot)
+        if not slots:
+            del self.slots[id]
+
+        moved = self.ids.pop()
+        if slot != last:
+            self.ids[slot] = moved
+            moved_slots = self.slots[moved]
+            moved_slots[moved_slots.index(last)] = slot
+
+    def clear(self):
+        self.ids.clear()
+        self.slots.clear()
+
+    def pick_slot(self):
+        '''
+        Random slot, from a normal distribution over slots
+        '''
+        return normal_int(0, len(self.ids) - 1)
+
+    def pick(self):
+        '''
+        Random employee id, from a normal distribution over slots
+        '''
+        return self.ids[self.pick_slot()]
+
+    def fire(self, u, slots=None):
+        '''
+        Remove u random employees (fewer if the firm runs out). Returns removed
+        ids, and appends their slots, as removed, to slots if given.
+        '''
+        fired = []
+        for i in range(min(u, len(self.ids))):
+            slot = self.pick_slot()
+            fired.append(self.ids[slot])
+            self.remove_at(slot)
+            if slots is not None:
+                slots.append(slot)
+        return fired
 
 # Define an economic actor
 
 
 class Actor:
+    # MoneyLedger told of every change of coins, set by
+    # MaterialWorld.enable_ledger
+    ledger = None
+
     def __init__(self, id, coins):
         '''
         Create an actor
@@ -100,7 +368,7 @@ class Actor:
         self.id = id
         self.coins = coins
         self.employer = 0
-        self.employees = []
+        self.employees = FirmRoster()
         self.yearly_income = 0
 
     def is_active(self):
@@ -123,31 +391,37 @@ class Actor:
         Set employer index and update ocupation status to employed
         '''
         self.employer = employer_id
-        self.employees = []
+        self.employees.clear()
 
     def unemploy_self(self):
         '''
         Remove employer index and set occupation to unemployed
         '''
         self.employer = 0
-        self.employees = []
+        self.employees.clear()
 
     def employ_other(self, id):
         '''
         Add employee index to employee set. Update ocupation status to employer
         '''
-        self.employees.append(id)
+        self.employees.add(id)
 
     def unemploy_other(self, employee_id):
         '''
         Enemploy based on employee index. If firm loses all employees, return True
         '''
-        pos = self.employees.index(employee_id)
-        self.employees.pop(pos)
+        self.employees.remove(employee_id)
         if len(self.employees) == 0:
             return True
         return False
 
+    def unemploy_others(self, u, slots=None):
+        '''
+        Enemploy u random employees. Returns their ids and True if firm loses all employees
+        '''
+        fired = self.employees.fire(u, slots)
+        return fired, len(self.employees) == 0
+
     def random_expenditure(self):
         '''
         Select a random amount to spend
@@ -158,21 +432,122 @@ class Actor:
         if b <= 0:
             return 0
 
-        expenditure_interval = list(range(a, math.floor(b) + 1))
-        expenditure = normal_choice(expenditure_interval)
-
-        return expenditure
+        return normal_int(a, math.floor(b))
 
     def add_coins(self, amount):
         self.coins += amount
         self.yearly_income += amount
+        if self.ledger is not None:
+            self.ledger.credit(self, amount)
 
     def remove_coins(self, amount):
         self.coins -= amount
+        if self.ledger is not None:
+            self.ledger.credit(self, -amount)
 
     def reset_yearly_income(self):
         self.yearly_income = 0
 
+# Money conservation ledger
+
+
+class MoneyLedger:
+    def __init__(self, actors, market_value, money, audit_every=None,
+                 strict=True, tol=1e-6):
+        '''
+        Running totals of actor money and market value, updated on every
+        transfer, so conservation and non-negative balances are checked in
+        O(1). Every audit_every steps a deep audit compares each actor's coins
+        with the ledger. The first violation is kept in violation and raised
+        as a RuntimeError if strict.
+        '''
+        self.money = money
+        self.audit_every = audit_every
+        self.strict = strict
+        self.tol = tol * max(money, 1)
+
+        self.balances = [actor.coins for actor in actors]
+        self.actor_money = math.fsum(self.balances)
+        self.market_value = market_value
+        self.negatives = {actor.id for actor in actors if actor.coins < 0}
+
+        self.steps = 0
+        self.checks = 0
+        self.audits = 0
+        self.violation = None
+
+    def credit(self, actor, amount):
+        '''
+        Actor coins changed by amount
+        '''
+        self.actor_money += amount
+        self.balances[actor.id] += amount
+        if self.balances[actor.id] < 0:
+            self.negatives.add(actor.id)
+        else:
+            self.negatives.discard(actor.id)
+
+    def to_market(self, amount):
+        self.market_value += amount
+
+    def check(self, rule, actor, market_value):
+        '''
+        O(1) check after a rule applied for actor
+        '''
+        self.checks += 1
+        if abs(self.actor_money + self.market_value - self.money) > self.tol:
+            self.fail(rule, actor.id, 'money not conserved: actors hold '
+                      f'{self.actor_money}, market {self.market_value}, '
+                      f'expected {self.money}')
+        elif market_value != self.market_value:
+            self.fail(rule, actor.id, f'market value {market_value} changed '
+                      f'outside the ledger ({self.market_value})')
+        elif market_value < 0:
+            self.fail(rule, actor.id, f'negative market value {market_value}')
+        elif self.negatives:
+            id = min(self.negatives)
+            self.fail(rule, id, f'negative balance {self.balances[id]}')
+
+    def deep_audit(self, rule, actors):
+        '''
+        O(N) audit: every actor's coins against the ledger, and their sum
+        '''
+        self.audits += 1
+        coins = np.fromiter((actor.coins for actor in actors),
+                            dtype=np.float64, count=len(actors))
+        changed = np.flatnonzero(coins != np.asarray(self.balances))
+        if len(changed):
+            id = int(changed[0])
+            self.fail(rule, id, f'coins {coins[id]} changed outside the '
+                      f'ledger ({self.balances[id]})')
+        elif abs(math.fsum(coins) - self.actor_money) > self.tol:
+            self.fail(rule, None, f'actors hold {math.fsum(coins)}, '
+                      f'ledger {self.actor_money}')
+
+    def step(self):
+        '''
+        Count a simulation step. Returns True if it is due a deep audit.
+        '''
+        self.steps += 1
+        return (self.audit_every is not None and
+                self.steps % self.audit_every == 0)
+
+    def fail(self, rule, id, message):
+        if self.violation is None:
+            self.violation = {'step': self.steps, 'rule': rule, 'actor': id,
+                              'message': message}
+        if self.strict:
+            raise RuntimeError(f'step {self.steps}, {rule}, actor {id}: {message}')
+
+    def summary(self):
+        if self.violation is None:
+            return (f'Money conserved over {self.steps} steps '
+                    f'({self.checks} checks, {self.audits} deep audits)')
+        v = self.violation
+        return (f'First violation at step {v["step"]}, {v["rule"]}, '
+                f'actor {v["actor"]}: {v["message"]}')
+
+
 # Define simulation world
 
 
@@ -186,10 +561,23 @@ class MaterialWorld:
     # For market redistribution
     market_value = 0
 
-    def __init__(self, N, M):
+    # Firm size from which wages are paid with payroll()
+    payroll_batch_size = 64
+
+    # MoneyLedger, see enable_ledger
+    ledger = None
+
+    # EventRecorder, see enable_events
+    events = None
+
+    def __init__(self, N, M, wa=None, wb=None, analyzer=None):
         '''
         Initialize simulation with initial conditions
         '''
+        if wa is not None or wb is not None:
+            self.set_wages(self.wa if wa is None else wa,
+                           self.wb if wb is None else wb)
+
         initial_coins = M / N
         actors = []
         for i in range(N):
@@ -198,7 +586,37 @@ class MaterialWorld:
         self.actors = actors
         self.Money = M
         self.N = N
-        self.analyzer = Analyzer()
+        self.analyzer = Analyzer(N) if analyzer is None else analyzer
+        self.employer_index = FenwickTree([actor.coins for actor in actors])
+
+    def set_wages(self, wa, wb):
+        '''
+        Override the fixed wage bounds for this world
+        '''
+        self.wa = wa
+        self.wb = wb
+        self.wage_interval = list(range(wa, wb + 1))
+        self.wage_avg = (wb - wa) / 2
+
+    def enable_ledger(self, audit_every=None, strict=True):
+        '''
+        Track money in a MoneyLedger from now on: O(1) checks after every
+        rule, and a deep audit of all actors every audit_every steps
+        '''
+        self.ledger = MoneyLedger(self.actors, self.market_value, self.Money,
+                                  audit_every, strict)
+        for actor in self.actors:
+            actor.ledger = self.ledger
+        return self.ledger
+
+    def enable_events(self, path, buffer_size=2**16):
+        '''
+        Record hires, fires, firm demises, expenditures, revenues and wages
+        to a binary event log in directory path (see events.py)
+        '''
+        from events import EventRecorder
+        self.events = EventRecorder(path, self, buffer_size)
+        return self.events
 
     def select_actor(self):
         '''
@@ -212,22 +630,31 @@ class MaterialWorld:
         '''
         return list(filter(lambda actor: actor.is_unemployed() or actor.is_employer(), self.actors))
 
-    def select_employer(self):
+    def employer_weight(self, actor):
         '''
-        Randomly select an employer. Returns an Actor object.
+        Weight of an actor in employer selection: its coins if it is a potential employer
         '''
-        employers = self.potential_employers()
-        total_coins = 0
-        weights = []
+        if actor.is_unemployed() or actor.is_employer():
+            return actor.coins
+        return 0
 
-        for e in employers:
-            total_coins += e.coins
+    def index_actor(self, actor):
+        '''
+        Update actor in employer index after a change of coins or employment
+        '''
+        self.employer_index.update(actor.id, self.employer_weight(actor))
 
-        for e in employers:
-            weights.append(e.coins / total_coins)
+    def rebuild_employer_index(self):
+        self.employer_index.rebuild(
+            [self.employer_weight(actor) for actor in self.actors])
 
-        options = random.choices(employers, weights, k=1)
-        return options[0]
+    def select_employer(self):
+        '''
+        Randomly select an employer, weighted by coins. Returns an Actor
+        object, or None if no potential employer has coins.
+        '''
+        index = self.employer_index.sample()
+        return None if index is None else self.actors[index]
 
     def hiring_rule(self, actor):
         '''
@@ -241,13 +668,16 @@ class MaterialWorld:
         employer = self.select_employer()
 
         # One cannot employ oneself
-        if employer.id == actor.id:
+        if employer is None or employer.id == actor.id:
             return
 
         # If employer has enough money, hire
         if (employer.coins > self.wage_avg):
             employer.employ_other(actor.id)
             actor.employ_self(employer.id)
+            self.index_actor(actor)
+            if self.events is not None:
+                self.events.record(HIRE, actor.id, employer.id)
 
     def expenditure_rule(self, actor):
         '''
@@ -261,16 +691,20 @@ class MaterialWorld:
         # Create expenditure
         exp = b.random_expenditure()
         b.remove_coins(exp)
+        self.index_actor(b)
+        if self.events is not None:
+            self.events.record(EXPENDITURE, b.id, actor.id, amount=exp)
 
         # Add to market value
         self.market_value += exp
+        if self.ledger is not None:
+            self.ledger.to_market(exp)
 
     def random_revenue(self):
         '''
         Select a random revenue to take from market value
         '''
-        revenue_interval = list(range(0, self.market_value + 1))
-        return normal_choice(revenue_interval)
+        return normal_int(0, self.market_value)
 
     def market_sample_rule(self, actor):
         '''
@@ -287,12 +721,20 @@ class MaterialWorld:
         if (actor.is_employed()):
             index = actor.employer
             self.actors[index].add_coins(random_revenue)
+            self.index_actor(self.actors[index])
+            if self.events is not None:
+                self.events.record(REVENUE, index, actor.id, amount=random_revenue)
 
         if (actor.is_employer()):
             actor.add_coins(random_revenue)
+            self.index_actor(actor)
+            if self.events is not None:
+                self.events.record(REVENUE, actor.id, actor.id, amount=random_revenue)
 
         # Update market value
         self.market_value -= random_revenue
+        if self.ledger is not None:
+            self.ledger.to_market(-random_revenue)
 
         return random_revenue
 
@@ -312,15 +754,18 @@ class MaterialWorld:
             return False
 
         # Enemploy randomly
-        firm_demise = False
+        slots = None if self.events is None else []
+        fired, firm_demise = actor.unemploy_others(u, slots)
 
-        for i in range(u):
-            id = normal_choice(actor.employees)
-            firm_demise = actor.unemploy_other(id) or firm_demise
+        for id in fired:
             self.actors[id].unemploy_self()
+            self.index_actor(self.actors[id])
 
+        if self.events is not None:
+            for id, slot in zip(fired, slots):
+                self.events.record(FIRE, id, actor.id, slot)
             if firm_demise:
-                break
+                self.events.record(DEMISE, actor.id)
 
         return firm_demise
 
@@ -328,7 +773,7 @@ class MaterialWorld:
         '''
         Get a random wage based on parameters
         '''
-        return normal_choice(self.wage_interval)
+        return normal_int(self.wa, self.wb)
 
     def wage_payment_rule(self, actor):
         '''
@@ -337,14 +782,37 @@ class MaterialWorld:
         wage_bill = 0
         wage = self.random_wage()
 
+        # Large firms settle the whole bill at once
+        if len(actor.employees) >= self.payroll_batch_size:
+            wages = payroll(actor.coins, len(actor.employees), wage)
+
+            for i, wage in zip(actor.employees, wages.tolist()):
+                self.actors[i].add_coins(wage)
+                self.index_actor(self.actors[i])
+
+            wage_bill = int(wages.sum())
+            actor.remove_coins(wage_bill)
+            self.index_actor(actor)
+
+            if self.events is not None:
+                self.events.record_payroll(actor.id, actor.employees.ids, wages,
+                                           wage_bill)
+
+            return wage_bill
+
         for i in actor.employees:
             # Get random wage
             if (actor.coins - wage < 0):
                 wage = actor.random_expenditure()
 
             self.actors[i].add_coins(wage)
+            self.index_actor(self.actors[i])
             actor.remove_coins(wage)
             wage_bill += wage
+            if self.events is not None:
+                self.events.record(WAGE, i, actor.id, amount=wage)
+
+        self.index_actor(actor)
 
         return wage_bill
 
@@ -354,6 +822,11 @@ class MaterialWorld:
         '''
         actor = self.select_actor()
 
+        if self.events is not None:
+            self.events.step += 1
+        if self.ledger is not None:
+            return self.audited_simulation_rule(actor)
+
         self.hiring_rule(actor)
 
         self.expenditure_rule(actor)
@@ -366,6 +839,25 @@ class MaterialWorld:
 
         return [firm_demise_flag, revenue, wage_bill]
 
+    def audited_simulation_rule(self, actor):
+        '''
+        simulation_rule with a ledger check after every rule, and a deep
+        audit after every rule of the steps it is due
+        '''
+        ledger = self.ledger
+        deep = ledger.step()
+        results = {}
+
+        for rule in ['hiring_rule', 'expenditure_rule', 'market_sample_rule',
+                     'firing_rule', 'wage_payment_rule']:
+            results[rule] = getattr(self, rule)(actor)
+            ledger.check(rule, actor, self.market_value)
+            if deep:
+                ledger.deep_audit(rule, self.actors)
+
+        return [results['firing_rule'], results['market_sample_rule'],
+                results['wage_payment_rule']]
+
     def one_month_rule(self):
         '''
         Excecute simulation N times, allowing every actor to have an opportunity to act
@@ -383,7 +875,10 @@ class MaterialWorld:
             if firm_demise:
                 firm_demise_counter += 1
 
+        self.rebuild_employer_index()
         self.analyzer.firm_size_measure(self.actors)
+        if self.events is not None:
+            self.events.end_month()
 
         return [firm_demise_counter, revenue_counter, total_wage_bill]
 
@@ -405,23 +900,609 @@ class MaterialWorld:
         self.analyzer.add_yearly_wage_bill(total_wage_bill)
         self.analyzer.class_size_measure(self.actors)
         self.analyzer.incomes_and_wealth_measure(self.actors)
+        if self.events is not None:
+            self.events.end_year()
 
-    def run_sim(self, years):
+    def run_sim(self, years, verbose=True, convergence=None):
         '''
-        Excecute a simulation rule for arbitrary year number
+        Excecute a simulation rule for arbitrary year number.
+        With an EquilibriumDetector as convergence, years is the maximum and
+        the run stops once enough equilibrium years have been measured.
+        Returns the detected burn-in year, or None.
         '''
-        print(f'Starting simulation for {years} years')
+        if verbose:
+            print(f'Starting simulation for {years} years')
+        if convergence is None:
+            self.analyzer.reserve(self.analyzer.years + years)
         for i in range(years):
-            if i % 10 == 0:
+            if verbose and i % 10 == 0:
                 print(f"year {i} running")
             self.one_year_rule()
+            if convergence is not None and convergence.observe(self.analyzer):
+                break
 
-        print('Doing futher analysis (GDP, ...)')
+        if verbose and convergence is not None:
+            print(convergence.summary())
+        if verbose:
+            print('Doing futher analysis (GDP, ...)')
         self.analyzer.gdp_growth_measures()
 
+        return None if convergence is None else convergence.burn_in
+
+
+# Array-backed employee storage
+
+
+class ArrayRoster:
+    def __init__(self, N):
+        '''
+        Employee ids of every firm, stored in one growable NumPy buffer per firm
+        '''
+        self.size = np.zeros(N, dtype=np.int64)
+        self.buffers = {}
+
+    def employees(self, firm):
+        '''
+        View of the employee ids of a firm
+        '''
+        buffer = self.buffers.get(firm)
+        if buffer is None:
+            return buffer
+        return buffer[:self.size[firm]]
+
+    def get(self, firm, index):
+        return int(self.buffers[firm][index])
+
+    def add(self, firm, employee_id):
+        '''
+        Append employee id to the firm, doubling its buffer when full
+        '''
+        size = self.size[firm]
+        buffer = self.buffers.get(firm)
+
+        if buffer is None:
+            buffer = np.empty(4, dtype=np.int64)
+            self.buffers[firm] = buffer
+        elif size == len(buffer):
+            buffer = np.concatenate((buffer, np.empty(size, dtype=np.int64)))
+            self.buffers[firm] = buffer
+
+        buffer[size] = employee_id
+        self.size[firm] = size + 1
+
+    def remove_at(self, firm, index):
+        '''
+        Swap-remove employee at position. If firm loses all employees, return True
+        '''
+        size = self.size[firm] - 1
+        buffer = self.buffers[firm]
+        buffer[index] = buffer[size]
+        self.size[firm] = size
+
+        if size == 0:
+            del self.buffers[firm]
+            return True
+        return False
+
+    def fire(self, firm, u):
+        '''
+        Remove u random employees (fewer if the firm runs out). Returns removed ids
+        '''
+        size = int(self.size[firm])
+        u = min(u, size)
+        buffer = self.buffers[firm]
+        fired = []
+
+        for i in range(u):
+            index = normal_int(0, size - 1)
+            size -= 1
+            fired.append(int(buffer[index]))
+            buffer[index] = buffer[size]
+
+        self.size[firm] = size
+        if size == 0:
+            del self.buffers[firm]
+        return fired
+
+# Define struct-of-arrays simulation world
+
+
+class ArrayWorld:
+    '''
+    Same rules as MaterialWorld, but actor state lives in NumPy arrays indexed
+    by actor id instead of Actor objects. Unemployment is marked with employer
+    id -1, so actor 0 can own a firm like any other actor.
+    '''
+    # Fixed wages
+    wa = MaterialWorld.wa
+    wb = MaterialWorld.wb
+    wage_interval = MaterialWorld.wage_interval
+    wage_avg = MaterialWorld.wage_avg
+
+    # For market redistribution
+    market_value = 0
+
+    # Firm size from which wages are paid with payroll()
+    payroll_batch_size = MaterialWorld.payroll_batch_size
+
+    # Run months with batched_month instead of N calls of simulation_rule
+    batched_months = True
+
+    def __init__(self, N, M, wa=None, wb=None, analyzer=None):
+        '''
+        Initialize simulation with initial conditions
+        '''
+        if wa is not None or wb is not None:
+            self.set_wages(self.wa if wa is None else wa,
+                           self.wb if wb is None else wb)
+
+        self.coins = np.full(N, M / N, dtype=np.float64)
+        self.yearly_income = np.zeros(N, dtype=np.float64)
+        self.employer = np.full(N, -1, dtype=np.int64)
+        self.roster = ArrayRoster(N)
+        self.firm_size = self.roster.size
+        self.employer_index = FenwickTree(self.coins.tolist())
+
+        self.Money = M
+        self.N = N
+        self.analyzer = Analyzer(N) if analyzer is None else analyzer
+
+    set_wages = MaterialWorld.set_wages
+
+    def add_coins(self, id, amount):
+        self.coins[id] += amount
+        self.yearly_income[id] += amount
+
+    def select_actor(self):
+        '''
+        Randomly select an actor. Returns an actor id.
+        '''
+        return normal_int(0, self.N - 1)
+
+    def index_actor(self, id):
+        '''
+        Update actor in employer index after a change of coins or employment
+        '''
+        if self.employer[id] < 0 or self.firm_size[id] > 0:
+            self.employer_index.update(id, float(self.coins[id]))
+        else:
+            self.employer_index.update(id, 0)
+
+    def rebuild_employer_index(self):
+        potential = (self.employer < 0) | (self.firm_size > 0)
+        self.employer_index.rebuild(np.where(potential, self.coins, 0).tolist())
+
+    def select_employer(self):
+        '''
+        Randomly select an employer, weighted by coins. Returns an actor id,
+        or None if no potential employer has coins.
+        '''
+        return self.employer_index.sample()
+
+    def random_expenditure(self, id):
+        '''
+        Select a random amount to spend
+        '''
+        b = self.coins[id]
+
+        if b <= 0:
+            return 0
+
+        return normal_int(0, math.floor(b))
+
+    def random_revenue(self):
+        '''
+        Select a random revenue to take from market value
+        '''
+        return normal_int(0, self.market_value)
+
+    def random_wage(self):
+        '''
+        Get a random wage based on parameters
+        '''
+        return normal_int(self.wa, self.wb)
+
+    def hiring_rule(self, id):
+        '''
+        Randomly employ someone
+        '''
+        # Check if actor already employed
+        if self.employer[id] >= 0 or self.firm_size[id] > 0:
+            return
+
+        # Select employer
+        employer = self.select_employer()
+
+        # One cannot employ oneself
+        if employer is None or employer == id:
+            return
+
+        # If employer has enough money, hire
+        if self.coins[employer] > self.wage_avg:
+            self.roster.add(employer, id)
+            self.employer[id] = employer
+            self.index_actor(id)
+
+    def expenditure_rule(self, id):
+        '''
+        Random actor expenses
+        '''
+        # Actors that are not current actor
+        b = id
+        while b == id:
+            b = self.select_actor()
+
+        # Create expenditure
+        exp = self.random_expenditure(b)
+        self.coins[b] -= exp
+        self.index_actor(b)
+
+        # Add to market value
+        self.market_value += exp
+
+    def market_sample_rule(self, id):
+        '''
+        Random firm revenue M1. Returns Revenue.
+        '''
+        # Check if actor is not unemployed
+        employer = self.employer[id]
+        if employer < 0:
+            return 0
+
+        # Select random revenue and add it to firm owner
+        random_revenue = self.random_revenue()
+        self.add_coins(employer, random_revenue)
+        self.index_actor(employer)
+
+        # Update market value
+        self.market_value -= random_revenue
+
+        return random_revenue
+
+    def firing_rule(self, id):
+        '''
+        Fire based on max money. Returns if firm is bankrupt.
+        '''
+        size = self.firm_size[id]
+
+        # If actor not employer, do nothing
+        if size == 0:
+            return False
+
+        # Count how many average wages cannot be payed
+        u = math.ceil(size - (self.coins[id] / self.wage_avg))
+        if u <= 0:
+            return False
+
+        # Enemploy randomly
+        for employee in self.roster.fire(id, u):
+            self.employer[employee] = -1
+            self.index_actor(employee)
+
+        return bool(self.firm_size[id] == 0)
+
+    def wage_payment_rule(self, id):
+        '''
+        Pay wages to all employees. Return total wage bill
+        '''
+        employees = self.roster.employees(id)
+        if employees is None:
+            return 0
+
+        wages = payroll(float(self.coins[id]), len(employees), self.random_wage())
+        self.coins[employees] += wages
+        self.yearly_income[employees] += wages
+
+        wage_bill = int(wages.sum())
+        self.coins[id] -= wage_bill
+        self.index_actor(id)
+
+        return wage_bill
+
+    def simulation_rule(self):
+        '''
+        Excecute all rules based on random actor
+        '''
+        id = self.select_actor()
+
+        self.hiring_rule(id)
+
+        self.expenditure_rule(id)
+
+        revenue = self.market_sample_rule(id)
+
+        firm_demise_flag = self.firing_rule(id)
+
+        wage_bill = self.wage_payment_rule(id)
+
+        return [firm_demise_flag, revenue, wage_bill]
+
+    def batched_month(self):
+        '''
+        N steps of simulation_rule in one loop. The month's random numbers
+        are drawn up front with NumPy, and actor state is held in lists while
+        it runs, so a step does no NumPy scalar indexing and few calls.
+        Small firms are paid one wage at a time, as payroll() would.
+        Every step reads the coins and employment left by the previous one,
+        so the steps themselves stay a sequential Python loop.
+        Returns [firm demises, revenue, wage bill].
+        '''
+        N = self.N
+        wage_avg = self.wage_avg
+        batch_size = self.payroll_batch_size
+        index = self.employer_index
+        update = index.update
+        find = index.find
+
+        coins = self.coins.tolist()
+        income = self.yearly_income.tolist()
+        employer = self.employer.tolist()
+        size = self.firm_size.tolist()
+        roster = self.roster
+        staffs = {firm: roster.employees(firm).tolist() for firm in roster.buffers}
+        market_value = self.market_value
+
+        actors = normal_ints(0, N - 1, size=N).tolist()
+        partners = normal_ints(0, N - 1, size=N).tolist()
+        wages = iter(normal_ints(self.wa, self.wb, size=N).tolist())
+        uniforms = np.random.random(N).tolist()
+        draw = pre_drawn_normal_int(3 * N)
+
+        firm_demise_counter = 0
+        revenue_counter = 0
+        total_wage_bill = 0
+
+        for step in range(N):
+            id = actors[step]
+
+            # Hiring
+            if employer[id] < 0 and size[id] == 0 and index.total > 0:
+                boss = find(uniforms[step] * index.total)
+                if boss is not None and boss != id and coins[boss] > wage_avg:
+                    staff = staffs.get(boss)
+                    if staff is None:
+                        staffs[boss] = [id]
+                    else:
+                        staff.append(id)
+                    size[boss] += 1
+                    employer[id] = boss
+                    update(id, 0)
+
+            # Expenditure
+            b = partners[step]
+            while b == id:
+                b = normal_int(0, N - 1)
+            if coins[b] > 0:
+                exp = draw(0, math.floor(coins[b]))
+                coins[b] -= exp
+                market_value += exp
+            update(b, coins[b] if employer[b] < 0 or size[b] > 0 else 0)
+
+            # Market sample
+            boss = employer[id]
+            if boss >= 0:
+                revenue = draw(0, market_value)
+                coins[boss] += revenue
+                income[boss] += revenue
+                update(boss, coins[boss] if employer[boss] < 0 or size[boss] > 0 else 0)
+                market_value -= revenue
+                revenue_counter += revenue
+
+            if size[id] == 0:
+                continue
+            staff = staffs[id]
+
+            # Firing
+            u = math.ceil(size[id] - coins[id] / wage_avg)
+            if u > 0:
+                for i in range(min(u, size[id])):
+                    slot = draw(0, len(staff) - 1)
+                    fired = staff[slot]
+                    staff[slot] = staff[-1]
+                    staff.pop()
+                    employer[fired] = -1
+                    update(fired, coins[fired])
+                size[id] = len(staff)
+                if not staff:
+                    del staffs[id]
+                    firm_demise_counter += 1
+                    continue
+
+            # Wage payment
+            wage = next(wages, None)
+            if wage is None:
+                wage = self.random_wage()
+            if len(staff) >= batch_size:
+                paid = payroll(coins[id], len(staff), wage).tolist()
+            else:
+                paid = []
+                left = coins[id]
+                for i in staff:
+                    if left - wage < 0:
+                        wage = draw(0, math.floor(left)) if left > 0 else 0
+                    left -= wage
+                    paid.append(wage)
+
+            for i, wage in zip(staff, paid):
+                coins[i] += wage
+                income[i] += wage
+            wage_bill = sum(paid)
+            coins[id] -= wage_bill
+            update(id, coins[id])
+            total_wage_bill += wage_bill
+
+        self.coins[:] = coins
+        self.yearly_income[:] = income
+        self.employer[:] = employer
+        self.firm_size[:] = size
+        roster.buffers = {firm: np.array(staff, dtype=np.int64)
+                          for firm, staff in staffs.items()}
+        self.market_value = market_value
+
+        return [firm_demise_counter, revenue_counter, total_wage_bill]
+
+    def one_month_rule(self):
+        '''
+        Excecute simulation N times, allowing every actor to have an opportunity to act
+        '''
+        firm_demise_counter = 0
+        revenue_counter = 0
+        total_wage_bill = 0
+
+        if self.batched_months:
+            [firm_demise_counter, revenue_counter,
+             total_wage_bill] = self.batched_month()
+        else:
+            for i in range(self.N):
+                [firm_demise, revenue, wage_bill] = self.simulation_rule()
+
+                revenue_counter += revenue
+                total_wage_bill += wage_bill
+
+                if firm_demise:
+                    firm_demise_counter += 1
+
+        self.rebuild_employer_index()
+        self.analyzer.firm_size_measure_arrays(self.firm_size)
+
+        return [firm_demise_counter, revenue_counter, total_wage_bill]
+
+    def one_year_rule(self):
+        '''
+        Repeat a month 12 times
+        '''
+        total_revenue = 0
+        total_wage_bill = 0
+
+        for i in range(12):
+            [firm_demises, revenue, wage_bill] = self.one_month_rule()
+            total_revenue += revenue
+            total_wage_bill += wage_bill
+
+            self.analyzer.firm_demise_measure(firm_demises)
+
+        self.analyzer.add_yearly_revenue(total_revenue)
+        self.analyzer.add_yearly_wage_bill(total_wage_bill)
+        self.analyzer.class_size_measure_arrays(
+            self.employer, self.firm_size, self.coins, self.yearly_income)
+        self.analyzer.incomes_and_wealth_measure_arrays(
+            self.coins, self.yearly_income)
+
+    run_sim = MaterialWorld.run_sim
+
+
+# Class labels stored per actor and year
+UNEMPLOYED = 0
+WORKER = 1
+CAPITALIST = 2
+
+# Event kinds of an event log (see events.py)
+HIRE = 1
+FIRE = 2
+DEMISE = 3
+EXPENDITURE = 4
+REVENUE = 5
+WAGE = 6
+PAYROLL = 7
+MONTH = 8
+YEAR = 9
+
+
+class ClassRows:
+    def __init__(self, analyzer, values, label):
+        '''
+        Per-year values of the actors in one class, read from Analyzer storage
+        '''
+        self.analyzer = analyzer
+        self.values = values
+        self.label = label
+
+    def __len__(self):
+        return min(self.analyzer.years, len(self.analyzer.class_measures))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('year out of range')
+
+        values = getattr(self.analyzer, self.values)[index]
+        return values[self.analyzer.actor_classes[index] == self.label]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+CLASS_LABELS = {
+    'unemployed': UNEMPLOYED,
+    'worker': WORKER,
+    'capitalist': CAPITALIST,
+}
+
+
+class DerivedCache:
+    def __init__(self, maxsize=128, max_bytes=2**28):
+        '''
+        Least recently used cache of results derived from Analyzer history.
+        Bounded by entries and by the bytes of the arrays held. Cleared when
+        the history it was computed from changes.
+        '''
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+
+    def validate(self, version):
+        '''
+        Drop everything if history moved on since the cached results
+        '''
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def get(self, key, compute):
+        '''
+        Cached result for key, computing and storing it on a miss
+        '''
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        value = compute()
+        size = sum(v.nbytes for v in (value if isinstance(value, tuple)
+                                      else (value,))
+                   if isinstance(v, np.ndarray))
+
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.nbytes += size
+        while len(self.entries) > 1 and (len(self.entries) > self.maxsize or
+                                         self.nbytes > self.max_bytes):
+            (old, _) = self.entries.popitem(last=False)
+            self.nbytes -= self.sizes.pop(old)
+        return value
+
 
 class Analyzer:
-    def __init__(self):
+    def __init__(self, N=None, years=0):
         # Per year
         self.class_measures = []
         self.revenues = []
@@ -430,62 +1511,171 @@ class Analyzer:
         self.wage_bills = []
         self.wage_shares = []
         self.profit_shares = []
-        self.actor_incomes = []
-        self.actor_wealths = []
-
-        self.capitalist_incomes = []
-        self.capitalist_wealths = []
-        self.worker_incomes = []
-        self.worker_wealths = []
 
         self.commonwealths = []
 
-        # Per month
-        self.firm_sizes = []
+        # Derived distributions, histograms and CCDFs
+        self.derived = DerivedCache()
+
+        # Per year and actor, preallocated: years x N
+        self.N = N
+        self.years = 0
+        self.incomes = None
+        self.wealths = None
+        self.classes = None
+        if N is not None:
+            self.reserve(years)
+
+        self.capitalist_incomes = ClassRows(self, 'actor_incomes', CAPITALIST)
+        self.capitalist_wealths = ClassRows(self, 'actor_wealths', CAPITALIST)
+        self.worker_incomes = ClassRows(self, 'actor_incomes', WORKER)
+        self.worker_wealths = ClassRows(self, 'actor_wealths', WORKER)
+
+        # Per month, firm size histograms as counts indexed by size
+        self.firm_size_counts = []
         self.firm_demises = []
 
+    def reserve(self, years):
+        '''
+        Make room for at least years rows of per-actor history. Until N is
+        known, rows are allocated by reserve_row as they come.
+        '''
+        if self.N is None:
+            return
+        if self.incomes is not None and len(self.incomes) >= years:
+            return
+
+        incomes = np.zeros((years, self.N), dtype=np.float64)
+        wealths = np.zeros((years, self.N), dtype=np.float64)
+        classes = np.zeros((years, self.N), dtype=np.int8)
+
+        if self.incomes is not None:
+            rows = len(self.incomes)
+            incomes[:rows] = self.incomes
+            wealths[:rows] = self.wealths
+            classes[:rows] = self.classes
+
+        self.incomes = incomes
+        self.wealths = wealths
+        self.classes = classes
+
+    def reserve_row(self, row, N):
+        '''
+        Grow storage geometrically until it holds row
+        '''
+        if self.N is None:
+            self.N = N
+
+        capacity = 0 if self.incomes is None else len(self.incomes)
+        if row >= capacity:
+            self.reserve(max(row + 1, 2 * capacity))
+
+    @property
+    def actor_incomes(self):
+        '''
+        Years x N view of yearly incomes
+        '''
+        if self.incomes is None:
+            return np.zeros((0, 0))
+        return self.incomes[:self.years]
+
+    @property
+    def actor_wealths(self):
+        '''
+        Years x N view of wealth at the end of each year
+        '''
+        if self.wealths is None:
+            return np.zeros((0, 0))
+        return self.wealths[:self.years]
+
+    @property
+    def actor_classes(self):
+        '''
+        Years x N view of class labels (UNEMPLOYED, WORKER, CAPITALIST)
+        '''
+        if self.classes is None:
+            return np.zeros((0, 0), dtype=np.int8)
+        return self.classes[:len(self.class_measures)]
+
+    @property
+    def firm_sizes(self):
+        '''
+        Sizes of all firms in every month, rebuilt from the monthly counts
+        '''
+        return np.concatenate([np.repeat(np.arange(len(counts)), counts)
+                               for counts in self.firm_size_counts] or [[]])
+
+    def firm_size_distribution(self):
+        '''
+        Firm size counts over all months, indexed by size
+        '''
+        size = max((len(c) for c in self.firm_size_counts), default=0)
+        total = np.zeros(size, dtype=np.int64)
+        for counts in self.firm_size_counts:
+            total[:len(counts)] += counts
+        return total
+
+    def count_classes(self, labels):
+        '''
+        Append a year of class counts [unemployed, workers, capitalists, undef]
+        '''
+        counts = np.bincount(labels, minlength=3)
+        data = [int(counts[UNEMPLOYED]), int(counts[WORKER]),
+                int(counts[CAPITALIST]), 0]
+        self.class_measures.append(data)
+
+    def store_classes(self, labels):
+        '''
+        Store a year of class labels and count classes
+        '''
+        row = len(self.class_measures)
+        self.reserve_row(row, len(labels))
+        self.classes[row] = labels
+        self.count_classes(self.classes[row])
+
+    def store_incomes_and_wealths(self, incomes, wealths):
+        row = self.years
+        self.reserve_row(row, len(incomes))
+        self.incomes[row] = incomes
+        self.wealths[row] = wealths
+        self.years += 1
+
     def class_size_measure(self, actors):
         '''
         Sepparate by classes
         '''
-        unemployed = 0
-        workers = 0
-        capitalists = 0
-        undef = 0
-        capitalist_incomes = []
-        capitalist_wealths = []
-        worker_incomes = []
-        worker_wealths = []
-
+        labels = []
         for actor in actors:
             if (actor.is_employer()):
-                capitalists += 1
-                capitalist_incomes.append(actor.yearly_income)
-                capitalist_wealths.append(actor.coins)
+                labels.append(CAPITALIST)
             elif (actor.is_employed()):
-                workers += 1
-                worker_incomes.append(actor.yearly_income)
-                worker_wealths.append(actor.coins)
-            elif (actor.is_unemployed()):
-                unemployed += 1
+                labels.append(WORKER)
             else:
-                undef += 1
-        data = [unemployed, workers, capitalists, undef]
+                labels.append(UNEMPLOYED)
 
-        self.capitalist_incomes.append(capitalist_incomes)
-        self.capitalist_wealths.append(capitalist_wealths)
-        self.worker_incomes.append(worker_incomes)
-        self.worker_wealths.append(worker_wealths)
-        self.class_measures.append(data)
+        self.store_classes(labels)
+
+    def class_size_measure_arrays(self, employer, firm_size, coins, yearly_income):
+        '''
+        Sepparate by classes, from ArrayWorld state arrays
+        '''
+        labels = np.where(firm_size > 0, CAPITALIST,
+                          np.where(employer >= 0, WORKER, UNEMPLOYED))
+        self.store_classes(labels)
 
     def firm_size_measure(self, actors):
         '''
         Measures firm size
         '''
-        for actor in actors:
-            if actor.is_employer():
-                size = len(actor.employees)
-                self.firm_sizes.append(size)
+        sizes = [len(actor.employees) for actor in actors if actor.is_employer()]
+        self.firm_size_counts.append(
+            np.bincount(np.asarray(sizes, dtype=np.int64)))
+
+    def firm_size_measure_arrays(self, firm_size):
+        '''
+        Measures firm size, from ArrayWorld firm sizes
+        '''
+        self.firm_size_counts.append(np.bincount(firm_size[firm_size > 0]))
 
     def firm_demise_measure(self, demises):
         '''
@@ -508,11 +1698,16 @@ class Analyzer:
     def gdp_growth_measures(self):
         '''
         Measures GDP growth, compared to previous year.
-        Also measures recessions.
+        Also measures recessions. Recomputed from scratch on every call.
         '''
         revenues = self.revenues
         wages = self.wage_bills
 
+        self.gdp_growth = [1]
+        self.recessions = []
+        self.wage_shares = []
+        self.profit_shares = []
+
         recession_duration = 0
         for i in range(1, len(revenues)):
             gdp_growth = revenues[i] / revenues[i - 1]
@@ -542,51 +1737,159 @@ class Analyzer:
             wealths.append(actor.coins)
             actor.reset_yearly_income()
 
-        self.actor_incomes.append(incomes)
-        self.actor_wealths.append(wealths)
+        self.store_incomes_and_wealths(incomes, wealths)
 
-    def entropy_analysis(self, N, wealth_cap=0):
-        classes = 100
-        min_wealth = 0
+    def incomes_and_wealth_measure_arrays(self, coins, yearly_income):
+        '''
+        Collect yearly incomes from ArrayWorld arrays and add to dataset.
+        '''
+        self.store_incomes_and_wealths(yearly_income, coins)
+        yearly_income.fill(0)
+
+    def wealth_bins(self, wealth_cap=0, classes=100):
+        '''
+        Bin edges for entropy and commonwealth: classes steps up to wealth_cap,
+        or up to the max wealth in history if wealth_cap is 0
+        '''
         max_wealth = wealth_cap
 
         if wealth_cap == 0:
-            max_wealth = max(max(self.actor_wealths))
+            max_wealth = self.actor_wealths.max()
 
         d = max_wealth / classes
-        bins = range(0, math.ceil(max_wealth) + 1, math.ceil(d))
-        print(bins)
+        return np.arange(0, math.ceil(max_wealth) + 1, math.ceil(d))
 
-        entropy_evolution = []
+    def wealth_histograms(self, wealth_cap=0, classes=100):
+        '''
+        Bin edges, plus years x bins counts and wealth sums for every year.
+        Cached per (wealth_cap, classes) until a new year is measured.
+        '''
+        return self.cached(('wealth_histograms', wealth_cap, classes),
+                           lambda: self.compute_wealth_histograms(
+                               wealth_cap, classes))
+
+    def compute_wealth_histograms(self, wealth_cap, classes):
+        edges = self.wealth_bins(wealth_cap, classes)
+        wealths = self.actor_wealths
+        years, N = wealths.shape
+        nbins = len(edges) - 1
+
+        counts = np.zeros((years, nbins), dtype=np.int64)
+        sums = np.zeros((years, nbins), dtype=np.float64)
+
+        # Bin blocks of years at once, bounding temporary memory
+        step = max(1, 2**22 // max(N, 1))
+        for start in range(0, years, step):
+            block = np.asarray(wealths[start:start + step])
+            rows = len(block)
+
+            # Same bins as np.histogram: last bin includes its right edge
+            index = np.searchsorted(edges, block, side='right') - 1
+            index[block == edges[-1]] = nbins - 1
+            inside = (index >= 0) & (index < nbins)
+
+            flat = (np.arange(rows)[:, None] * nbins + index)[inside]
+            counts[start:start + rows] = np.bincount(
+                flat, minlength=rows * nbins).reshape(rows, nbins)
+            sums[start:start + rows] = np.bincount(
+                flat, block[inside], minlength=rows * nbins).reshape(rows, nbins)
+
+        return edges, counts, sums
+
+    def entropy_analysis(self, N, wealth_cap=0, plot=False):
+        '''
+        Entropy of the wealth distribution per year
+        '''
+        classes = 100
+        (_, counts, _) = self.wealth_histograms(wealth_cap, classes)
+        entropy_evolution = entropy(N, classes, counts)
 
-        for yearly_actor_wealths in self.actor_wealths:
-            class_count = [0] * classes
-            (h, _, _) = plt.hist(yearly_actor_wealths, bins=bins)
-            s = entropy(N, classes, h)
-            entropy_evolution.append(s)
+        if plot:
+            import matplotlib.pyplot as plt
+            plt.plot(range(len(entropy_evolution)), entropy_evolution)
+            plt.show()
 
-        return entropy_evolution
+        return entropy_evolution.tolist()
 
-    def aggregated_income_analysis(self):
-        # General income ccdf
-        income_aggregation = np.sum(self.actor_incomes, 0)
-        data = income_aggregation
-        general_values, general_base = np.histogram(data, bins=100)
-        general_cum = np.cumsum(general_values)
+    def cached(self, key, compute):
+        '''
+        Result of compute() memoized under key until history changes
+        '''
+        self.derived.validate((self.years, len(self.class_measures)))
+        return self.derived.get(key, compute)
 
-        # Income ccdf by class
-        capitalist = list(chain(*self.capitalist_incomes))
-        worker = list(chain(*self.worker_incomes))
+    def year_range(self, years=None):
+        '''
+        (start, stop) of years, given as None (all), a slice or a pair
+        '''
+        if years is None:
+            years = slice(None)
+        elif not isinstance(years, slice):
+            years = slice(*years)
+        (start, stop, _) = years.indices(
+            min(self.years, len(self.class_measures)))
+        return start, stop
+
+    def distribution_values(self, metric='incomes', klass=None, years=None):
+        '''
+        Values of metric ('incomes' or 'wealths') over a year range.
+        klass None gives per actor totals; a class name ('unemployed', 'worker',
+        'capitalist') gives every yearly value of actors in that class.
+        '''
+        (start, stop) = self.year_range(years)
+
+        def compute():
+            values = getattr(self, 'actor_' + metric)[start:stop]
+            if klass is None:
+                return np.sum(values, 0)
+            classes = self.actor_classes[start:stop]
+            return np.asarray(values)[classes == CLASS_LABELS[klass]]
 
-        capitalist_incomes = np.array(capitalist)
-        worker_incomes = np.array(worker)
+        return self.cached(('values', metric, klass, start, stop), compute)
 
-        capitalist_values, capitalist_base = np.histogram(
-            capitalist_incomes, bins=100)
-        worker_values, worker_base = np.histogram(worker_incomes, bins=100)
+    def ccdf(self, metric='incomes', klass=None, years=None, bins=100):
+        '''
+        Left bin edges and CCDF of distribution_values, on np.histogram bins.
+        As in the notebook plots, class curves subtract cumulative counts
+        divided by N.
+        '''
+        (start, stop) = self.year_range(years)
+        binning = bins if np.ndim(bins) == 0 else tuple(np.asarray(bins).tolist())
+
+        def compute():
+            data = self.distribution_values(metric, klass, (start, stop))
+            (values, base) = np.histogram(data, bins=bins)
+            cum = np.cumsum(values)
+            if klass is not None:
+                cum = cum / self.N
+            return base[:-1], len(data) - cum
+
+        return self.cached(('ccdf', metric, klass, start, stop, binning), compute)
 
-        capitalist_cum = np.cumsum(capitalist_values) / N
-        worker_cum = np.cumsum(worker_values) / N
+    def year_entropy(self, wealth_cap=0, classes=100):
+        '''
+        Entropy of the last year's wealth distribution, with classes steps up
+        to wealth_cap, or up to that year's max wealth if wealth_cap is 0
+        '''
+        wealths = np.asarray(self.actor_wealths[-1])
+        max_wealth = wealth_cap if wealth_cap else max(wealths.max(), 1)
+
+        bins = np.arange(0, math.ceil(max_wealth) + 1,
+                         math.ceil(max_wealth / classes))
+        (h, _) = np.histogram(wealths, bins=bins)
+        return float(entropy(len(wealths), len(bins) - 1, h))
+
+    def aggregated_income_analysis(self):
+        import matplotlib.pyplot as plt
+        import pandas as pd
+
+        # General income ccdf
+        income_aggregation = self.distribution_values('incomes')
+        general_base, general_ccdf = self.ccdf('incomes')
+
+        # Income ccdf by class
+        capitalist_base, capitalist_ccdf = self.ccdf('incomes', 'capitalist')
+        worker_base, worker_ccdf = self.ccdf('incomes', 'worker')
 
         # Lower regime income distribution
 
@@ -598,15 +1901,13 @@ class Analyzer:
         # Plot income ccdf in log-log scale
         axis[0, 0].set_xscale('log')
         axis[0, 0].set_yscale('log')
-        axis[0, 0].plot(general_base[:-1], len(data) - general_cum, c='green')
+        axis[0, 0].plot(general_base, general_ccdf, c='green')
 
         # Plot income ccdf by class in log-log scale
         axis[0, 1].set_xscale('log')
         axis[0, 1].set_yscale('log')
-        axis[0, 1].plot(capitalist_base[:-1],
-                        len(capitalist_incomes) - capitalist_cum, c='green')
-        axis[0, 1].plot(worker_base[:-1],
-                        len(worker_incomes) - worker_cum, c='blue')
+        axis[0, 1].plot(capitalist_base, capitalist_ccdf, c='green')
+        axis[0, 1].plot(worker_base, worker_ccdf, c='blue')
 
         # Plot lower regime income dist in log-lin scale
         axis[1, 0].set_xscale('log')
@@ -617,6 +1918,9 @@ class Analyzer:
         plt.show()
 
     def disaggregated_income_analysis_per_year(self, years, step):
+        import matplotlib.pyplot as plt
+        from colour import Color
+
         figure, axis = plt.subplots(1, 2)
 
         green = Color("green")
@@ -626,27 +1930,16 @@ class Analyzer:
 
         for i in range(0, years, step):
             # Income ccdf by class
-            capitalist = self.capitalist_incomes[i]
-            worker = self.worker_incomes[i]
-
-            capitalist_incomes = np.array(capitalist)
-            worker_incomes = np.array(worker)
-
-            capitalist_values, capitalist_base = np.histogram(
-                capitalist_incomes, bins=100)
-            worker_values, worker_base = np.histogram(worker_incomes, bins=100)
-
-            capitalist_cum = np.cumsum(capitalist_values) / N
-            worker_cum = np.cumsum(worker_values) / N
+            capitalist_base, capitalist_ccdf = self.ccdf(
+                'incomes', 'capitalist', (i, i + 1))
+            worker_base, worker_ccdf = self.ccdf('incomes', 'worker', (i, i + 1))
 
             # Lower regime income distribution
 
             # Plot income ccdf by class in log-log scale
             c = green_range[i].get_rgb()
-            axis[0].plot(capitalist_base[:-1],
-                         len(capitalist_incomes) - capitalist_cum, c=c)
-            axis[1].plot(worker_base[:-1],
-                         len(worker_incomes) - worker_cum, c=c)
+            axis[0].plot(capitalist_base, capitalist_ccdf, c=c)
+            axis[1].plot(worker_base, worker_ccdf, c=c)
 
         axis[0].set_xscale('log')
         axis[0].set_yscale('log')
@@ -655,25 +1948,16 @@ class Analyzer:
         plt.show()
 
     def aggregated_wealth_analysis(self):
+        import matplotlib.pyplot as plt
+        import pandas as pd
+
         # General income ccdf
-        income_aggregation = np.sum(self.actor_wealths, 0)
-        data = income_aggregation
-        general_values, general_base = np.histogram(data, bins=100)
-        general_cum = np.cumsum(general_values)
+        income_aggregation = self.distribution_values('wealths')
+        general_base, general_ccdf = self.ccdf('wealths')
 
         # Income ccdf by class
-        capitalist = list(chain(*self.capitalist_wealths))
-        worker = list(chain(*self.worker_wealths))
-
-        capitalist_incomes = np.array(capitalist)
-        worker_incomes = np.array(worker)
-
-        capitalist_values, capitalist_base = np.histogram(
-            capitalist_incomes, bins=100)
-        worker_values, worker_base = np.histogram(worker_incomes, bins=100)
-
-        capitalist_cum = np.cumsum(capitalist_values) / N
-        worker_cum = np.cumsum(worker_values) / N
+        capitalist_base, capitalist_ccdf = self.ccdf('wealths', 'capitalist')
+        worker_base, worker_ccdf = self.ccdf('wealths', 'worker')
 
         # Lower regime income distribution
 
@@ -685,15 +1969,13 @@ class Analyzer:
         # Plot income ccdf in log-log scale
         axis[0, 0].set_xscale('log')
         axis[0, 0].set_yscale('log')
-        axis[0, 0].plot(general_base[:-1], len(data) - general_cum, c='green')
+        axis[0, 0].plot(general_base, general_ccdf, c='green')
 
         # Plot income ccdf by class in log-log scale
         axis[0, 1].set_xscale('log')
         axis[0, 1].set_yscale('log')
-        axis[0, 1].plot(capitalist_base[:-1],
-                        len(capitalist_incomes) - capitalist_cum, c='green')
-        axis[0, 1].plot(worker_base[:-1],
-                        len(worker_incomes) - worker_cum, c='blue')
+        axis[0, 1].plot(capitalist_base, capitalist_ccdf, c='green')
+        axis[0, 1].plot(worker_base, worker_ccdf, c='blue')
 
         # Plot lower regime income dist in log-lin scale
         axis[1, 0].set_xscale('log')
@@ -703,149 +1985,239 @@ class Analyzer:
         # Plot higher regime ccdf in log-log scale
         plt.show()
 
-    def commonwealth_analysis(self, N, classes, wealth_cap=0):
-        max_wealth = wealth_cap
+    def commonwealth_series(self, N, classes, wealth_cap=0, mc=mc):
+        '''
+        Commonwealth per year, without plotting: sum over wealth bins of
+        bin count times O(mean wealth in bin)
+        '''
+        (_, counts, sums) = self.wealth_histograms(wealth_cap, classes)
+        means = sums / np.where(counts > 0, counts, 1)
+        return np.sum(counts * O(means, mc), axis=1)
 
-        if wealth_cap == 0:
-            max_wealth = max(max(self.actor_wealths))
+    def commonwealth_analysis(self, N, classes, wealth_cap=0, plot=True):
+        self.commonwealths.extend(
+            self.commonwealth_series(N, classes, wealth_cap).tolist())
 
-        d = max_wealth / classes
-        bins = range(0, math.ceil(max_wealth) + 1, math.ceil(d))
-        print(bins)
+        # Plot commonwealth evolution
+        if plot:
+            import matplotlib.pyplot as plt
+            years = range(len(self.commonwealths))
+            figure = plt.figure()
+            ax = figure.add_subplot(1, 1, 1)
+            plt.plot(years, self.commonwealths)
+            plt.show()
 
-        for yearly_actor_wealths in self.actor_wealths:
-            (h, _, _) = plt.hist(yearly_actor_wealths, bins=bins)
-            commonwealth = commonwealth_function(
-                N, classes, h, yearly_actor_wealths)
-            self.commonwealths.append(commonwealth)
 
-        # Plot commonwealth evolution
-        years = range(0, 100)
-        figure = plt.figure()
-        ax = figure.add_subplot(1, 1, 1)
-        plt.plot(years, self.commonwealths)
-        plt.show()
+# Equilibrium detection
+
+
+class EquilibriumDetector:
+    def __init__(self, samples=50, window=10, z=2.0, rtol=0.01, min_years=0):
+        '''
+        Moving-window stationarity test on the yearly class shares, wealth
+        entropy and wage share. Burn-in ends when, for every series, the means
+        of the last two windows of years differ by at most z standard errors
+        or rtol of their level. Converged once samples years have been
+        measured from the end of burn-in on.
+        '''
+        self.samples = samples
+        self.window = window
+        self.z = z
+        self.rtol = rtol
+        self.min_years = min_years
+
+        # Years x [unemployed, worker, capitalist shares, entropy, wage share]
+        self.series = []
+        self.first_year = None
+        self.burn_in = None
+
+    @property
+    def equilibrium_years(self):
+        if self.burn_in is None:
+            return 0
+        return self.first_year + len(self.series) - self.burn_in
+
+    @property
+    def converged(self):
+        return self.burn_in is not None and self.equilibrium_years >= self.samples
+
+    def observe(self, analyzer):
+        '''
+        Add the year just measured by analyzer. Returns True once converged.
+        '''
+        if self.first_year is None:
+            self.first_year = len(analyzer.class_measures) - 1
+
+        counts = analyzer.class_measures[-1]
+        total = sum(counts) or 1
+        revenue = analyzer.revenues[-1]
+        self.series.append([
+            counts[UNEMPLOYED] / total,
+            counts[WORKER] / total,
+            counts[CAPITALIST] / total,
+            analyzer.year_entropy(),
+            analyzer.wage_bills[-1] / revenue if revenue else 0.0,
+        ])
+
+        if self.burn_in is None and self.stationary():
+            # The recent window is the first one in equilibrium
+            self.burn_in = self.first_year + len(self.series) - self.window
+
+        return self.converged
+
+    def stationary(self):
+        '''
+        Whether the last two windows of every series agree
+        '''
+        w = self.window
+        if len(self.series) < max(2 * w, self.min_years):
+            return False
+
+        data = np.asarray(self.series[-2 * w:])
+        before, after = data[:w], data[w:]
+
+        difference = np.abs(after.mean(axis=0) - before.mean(axis=0))
+        error = np.sqrt((before.var(axis=0, ddof=1) +
+                         after.var(axis=0, ddof=1)) / w)
+        level = np.abs(data.mean(axis=0))
+        return bool(np.all((difference <= self.z * error) |
+                           (difference <= self.rtol * level)))
+
+    def summary(self):
+        if self.burn_in is None:
+            return f'No equilibrium detected in {len(self.series)} years'
+        return (f'Burn-in ended at year {self.burn_in}, '
+                f'{self.equilibrium_years} equilibrium years measured')
+
 
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from collections import Counter
 
-# Simulation conditions
-N = 1_000
-M = 100_000
-world = MaterialWorld(N, M)
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the notebook simulation.')
+    parser.add_argument('--ledger', action='store_true',
+                        help='check money conservation in a ledger, with a '
+                             'deep audit every N steps')
+    args = parser.parse_args()
 
-# Run 100 years
-world.run_sim(100)
+    # Simulation conditions
+    N = 1_000
+    M = 100_000
+    world = MaterialWorld(N, M)
+    if args.ledger:
+        world.enable_ledger(audit_every=N)
 
-analyzer = world.analyzer
+    # Run 100 years
+    world.run_sim(100)
 
-print(analyzer.class_measures)
+    analyzer = world.analyzer
 
-print(analyzer.firm_sizes)
+    print(analyzer.class_measures)
 
-max(analyzer.firm_sizes)
+    print(analyzer.firm_sizes)
 
-print(analyzer.firm_demises)
+    max(analyzer.firm_sizes)
 
-print(analyzer.gdp_growth)
+    print(analyzer.firm_demises)
 
-print(analyzer.recessions)
+    print(analyzer.gdp_growth)
 
-# sum(analyzer.recessions)
+    print(analyzer.recessions)
 
-print(analyzer.wage_shares)
+    # sum(analyzer.recessions)
 
-print(analyzer.profit_shares)
+    print(analyzer.wage_shares)
 
-sum = 0
-for p in world.actors:
-    sum += p.coins
-    if p.coins < 0:
-        print(p.id)
-        print(p.coins)
+    print(analyzer.profit_shares)
 
-print(f'total money: {sum}')
+    if world.ledger is not None:
+        print(world.ledger.summary())
+        print(f'total money: {world.ledger.actor_money + world.ledger.market_value}')
 
-print(max(max(analyzer.actor_incomes)))
+    print(analyzer.actor_incomes.max())
 
-print(max(max(analyzer.actor_wealths)))
+    print(analyzer.actor_wealths.max())
 
-ent = analyzer.entropy_analysis(N)
+    ent = analyzer.entropy_analysis(N)
 
-years = range(0, 100)
-plt.plot(years, ent)
+    years = range(0, 100)
+    plt.plot(years, ent)
 
-ent = analyzer.entropy_analysis(N, 1000)
+    ent = analyzer.entropy_analysis(N, 1000)
 
-years = range(0, 100)
-plt.plot(years, ent)
+    years = range(0, 100)
+    plt.plot(years, ent)
 
-ent = analyzer.entropy_analysis(N, 2000)
+    ent = analyzer.entropy_analysis(N, 2000)
 
-years = range(0, 100)
-plt.plot(years, ent)
+    years = range(0, 100)
+    plt.plot(years, ent)
 
-ent = analyzer.entropy_analysis(N, 5000)
+    ent = analyzer.entropy_analysis(N, 5000)
 
-years = range(0, 100)
-plt.plot(years, ent)
+    years = range(0, 100)
+    plt.plot(years, ent)
 
-analyzer.aggregated_income_analysis()
+    analyzer.aggregated_income_analysis()
 
-analyzer.aggregated_wealth_analysis()
+    analyzer.aggregated_wealth_analysis()
 
-analyzer.commonwealth_analysis(N, 20, 1000)
+    analyzer.commonwealth_analysis(N, 20, 1000)
 
-analyzer.disaggregated_income_analysis_per_year(100, 10)
+    analyzer.disaggregated_income_analysis_per_year(100, 10)
 
-capitalists = []
-workers = []
-unemployed = []
+    capitalists = []
+    workers = []
+    unemployed = []
 
-for [u, w, c, _] in analyzer.class_measures:
-    workers.append(w)
-    capitalists.append(c)
-    unemployed.append(u)
+    for [u, w, c, _] in analyzer.class_measures:
+        workers.append(w)
+        capitalists.append(c)
+        unemployed.append(u)
 
-(h, _, _) = plt.hist(unemployed, bins=20)
+    (h, _, _) = plt.hist(unemployed, bins=20)
 
-plt.show()
+    plt.show()
 
-(h, _, _) = plt.hist(workers, bins=20)
-plt.show()
+    (h, _, _) = plt.hist(workers, bins=20)
+    plt.show()
 
-(h, _, _) = plt.hist(capitalists, bins=20)
-plt.show()
+    (h, _, _) = plt.hist(capitalists, bins=20)
+    plt.show()
 
-years = range(0, 99)
-profit_share = analyzer.profit_shares
-wage_share = analyzer.wage_shares
-plt.plot(years, profit_share)
-plt.plot(years, wage_share)
+    years = range(0, 99)
+    profit_share = analyzer.profit_shares
+    wage_share = analyzer.wage_shares
+    plt.plot(years, profit_share)
+    plt.plot(years, wage_share)
 
-firm_demises = analyzer.firm_demises
-firm_demises.sort()
-count = Counter(firm_demises)
-count[0] = 0
-df = pd.DataFrame.from_dict(count, orient='index')
-df.plot(kind='bar')
+    firm_demises = analyzer.firm_demises
+    firm_demises.sort()
+    count = Counter(firm_demises)
+    count[0] = 0
+    df = pd.DataFrame.from_dict(count, orient='index')
+    df.plot(kind='bar')
 
-recessions = analyzer.recessions
-recessions.sort()
-count = Counter(recessions)
-count[0] = 0
-df = pd.DataFrame.from_dict(count, orient='index')
-df.plot(kind='bar')
+    recessions = analyzer.recessions
+    recessions.sort()
+    count = Counter(recessions)
+    count[0] = 0
+    df = pd.DataFrame.from_dict(count, orient='index')
+    df.plot(kind='bar')
 
-gdp = analyzer.gdp_growth
-gdp = list(filter(lambda a: a < 7.5, gdp))
-gdp = [round(item, 1) for item in gdp]
+    gdp = analyzer.gdp_growth
+    gdp = list(filter(lambda a: a < 7.5, gdp))
+    gdp = [round(item, 1) for item in gdp]
 
-gdp.sort()
-print(gdp)
+    gdp.sort()
+    print(gdp)
 
-count = Counter(gdp)
-df = pd.DataFrame.from_dict(count, orient='index')
-# plt.xscale('log')
-df.plot(kind='bar', logy=True)
+    count = Counter(gdp)
+    df = pd.DataFrame.from_dict(count, orient='index')
+    # plt.xscale('log')
+    df.plot(kind='bar', logy=True)
 
-incomes = analyzer.worker_incomes[:-1][0]
-print(np.mean(incomes))
+    incomes = analyzer.worker_incomes[:-1][0]
+    print(np.mean(incomes))
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""
+Mean-field master equation of the MaterialWorld rules.
+
+Instead of N actors, MeanFieldWorld evolves the fractions of the population
+on a fixed wealth grid: unemployed, workers, and capitalists by firm size
+and wealth. Every month is a few substeps of length dt in which each rule
+moves mass at the rate it is applied in one_month_rule:
+
+    hiring       unemployed actors pick an employer weighted by wealth among
+                 unemployed and capitalists; hiring succeeds above wage_avg
+    expenditure  actors spend a truncated normal fraction of their wealth
+    firing       a firm keeps min(size, floor(wealth / wage_avg)) employees
+    revenue      each worker's step hands its employer a share of the market
+    wages        a firm pays min(size * wage, wealth), wage in [wa, wb]
+
+Firing comes before revenue because a substep hands out the whole market at
+once: checked after it, every firm would be at its richest, and at high
+money per actor no firm would ever fail.
+
+select_actor draws ids from a truncated normal, so actors near the ends of
+the id range act, spend and pay far less often than those in the middle.
+The population is split into activity groups by that selection rate, each
+with its own densities.
+
+Values between grid points are split linearly between their neighbours,
+which keeps mass and money, and the market is a state variable, so money
+is conserved up to rounding. The cost of a simulated year depends on the
+grid, not on N, and the yearly and monthly series fill an Analyzer.
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import math
+
+# Froms
+from main import MaterialWorld, Analyzer, entropy
+
+
+def fraction_kernel(nodes=9):
+    '''
+    Nodes in [0, 1] and weights of the truncated normal of normal_int(0, n):
+    mean 1/2, standard deviation 1/6
+    '''
+    v = (np.arange(nodes) + 0.5) / nodes
+    p = np.exp(-0.5 * ((v - 0.5) * 6) ** 2)
+    return v, p / p.sum()
+
+
+def activity_groups(groups=10):
+    '''
+    Population shares and relative selection rates of select_actor, which
+    draws ids from a normal truncated at 3 standard deviations. Groups split
+    the distance from the middle id evenly.
+    '''
+    edges = np.linspace(0, 3, groups + 1)
+    cdf = np.array([math.erf(x / math.sqrt(2)) for x in edges])
+    rates = np.diff(cdf) / np.diff(edges)
+    return np.full(groups, 1 / groups), rates / rates.mean()
+
+
+def wealth_grid(mean_wealth, points=100, linear=8, span=1e4):
+    '''
+    Wealth grid: whole numbers up to linear, then geometric up to span times
+    the mean wealth
+    '''
+    top = max(span * mean_wealth, 2 * linear)
+    return np.unique(np.r_[np.arange(linear),
+                           np.geomspace(linear, top, points - linear)])
+
+
+def split_points(grid, targets):
+    '''
+    Lower grid index of every target and the share going to the point above
+    '''
+    index = np.clip(np.searchsorted(grid, targets, side='right') - 1,
+                    0, len(grid) - 2)
+    upper = np.clip((targets - grid[index]) / (grid[index + 1] - grid[index]), 0, 1)
+    return index, upper
+
+
+def size_grid(max_firm_size=1000, points=48, linear=16):
+    '''
+    Firm sizes: every size up to linear, then geometric up to max_firm_size
+    '''
+    return np.unique(np.r_[np.arange(linear),
+                           np.geomspace(linear, max(max_firm_size, linear),
+                                        max(points - linear, 1)).round()])
+
+
+def transport(grid, density, targets, weights=None, split=None):
+    '''
+    Move the mass of density (..., K) at every grid point to targets (..., K),
+    or to targets (..., K, J) with weights (J,), splitting each between the
+    neighbouring grid points. split is split_points of fixed targets.
+    '''
+    K = len(grid)
+    shape = density.shape
+    if weights is not None:
+        density = density[..., None] * weights
+    if split is None:
+        split = split_points(grid, np.broadcast_to(targets, density.shape))
+    (index, upper) = split
+
+    rows = np.arange(int(np.prod(shape[:-1]))) * K
+    rows = rows.reshape(shape[:-1] + (1,) * (density.ndim - len(shape) + 1))
+    flat = (rows + index).ravel()
+    total = int(np.prod(shape))
+    upper = density * upper
+    moved = (np.bincount(flat, (density - upper).ravel(), total) +
+             np.bincount(flat + 1, upper.ravel(), total))
+    return moved.reshape(shape)
+
+
+class MeanFieldAnalyzer(Analyzer):
+    def __init__(self, N=None):
+        '''
+        Analyzer of a MeanFieldWorld: regular yearly and monthly series, plus
+        the wealth densities of every class at the end of each year
+        '''
+        super().__init__()
+        self.N = N
+        self.grid = None
+        self.densities = []
+
+    def reserve(self, years):
+        '''
+        Nothing to preallocate
+        '''
+
+    def store_densities(self, grid, unemployed, workers, capitalists):
+        '''
+        Store a year of class wealth densities, as fractions of N
+        '''
+        self.grid = grid
+        self.densities.append(np.stack((unemployed, workers, capitalists)))
+        self.years += 1
+
+    def wealth_counts(self, year, wealth_cap=0, classes=100):
+        '''
+        Expected number of actors in classes wealth bins up to wealth_cap,
+        or up to the largest wealth held by at least half an actor
+        '''
+        density = self.densities[year].sum(axis=0) * self.N
+        cap = wealth_cap
+        if cap == 0:
+            cap = max(self.grid[np.flatnonzero(density >= 0.5)].max(), 1)
+
+        bins = np.arange(0, math.ceil(cap) + 1, math.ceil(cap / classes))
+        index = np.clip(np.searchsorted(bins, self.grid, side='right') - 1,
+                        0, len(bins) - 2)
+        return np.bincount(index, density, len(bins) - 1)
+
+    def wealth_bins(self, wealth_cap=0, classes=100):
+        '''
+        Bin edges as Analyzer.wealth_bins, up to the largest wealth held by
+        at least half an actor in any year if wealth_cap is 0
+        '''
+        cap = wealth_cap
+        if cap == 0:
+            cap = 1
+            for density in self.densities:
+                held = density.sum(axis=0) * self.N >= 0.5
+                if held.any():
+                    cap = max(cap, self.grid[held].max())
+
+        return np.arange(0, math.ceil(cap) + 1, math.ceil(cap / classes))
+
+    def compute_wealth_histograms(self, wealth_cap, classes):
+        '''
+        Expected counts and wealth sums of the yearly densities in wealth
+        bins, so that commonwealth_series works as for actor histories
+        '''
+        edges = self.wealth_bins(wealth_cap, classes)
+        nbins = len(edges) - 1
+        if not self.densities:
+            return edges, np.zeros((0, nbins)), np.zeros((0, nbins))
+
+        # Same bins as np.histogram: last bin includes its right edge
+        index = np.searchsorted(edges, self.grid, side='right') - 1
+        index[self.grid == edges[-1]] = nbins - 1
+        inside = np.flatnonzero((index >= 0) & (index < nbins))
+        bins = np.zeros((len(self.grid), nbins))
+        bins[inside, index[inside]] = 1
+
+        counts = np.stack([d.sum(axis=0) for d in self.densities]) * self.N
+        return edges, counts @ bins, (counts * self.grid) @ bins
+
+    def year_entropy(self, wealth_cap=0, classes=100):
+        counts = self.wealth_counts(-1, wealth_cap, classes)
+        return float(entropy(self.N, len(counts), counts))
+
+    def entropy_analysis(self, N, wealth_cap=0, plot=False):
+        entropy_evolution = []
+        for year in range(len(self.densities)):
+            counts = self.wealth_counts(year, wealth_cap)
+            entropy_evolution.append(float(entropy(N, len(counts), counts)))
+
+        if plot:
+            import matplotlib.pyplot as plt
+            plt.plot(range(len(entropy_evolution)), entropy_evolution)
+            plt.show()
+
+        return entropy_evolution
+
+
+class MeanFieldWorld:
+    # Fixed wages
+    wa = MaterialWorld.wa
+    wb = MaterialWorld.wb
+    wage_interval = MaterialWorld.wage_interval
+    wage_avg = MaterialWorld.wage_avg
+
+    def __init__(self, N, M, wa=None, wb=None, analyzer=None, grid_points=64,
+                 max_firm_size=1000, size_points=32, groups=10, substeps=2,
+                 kernel_nodes=9):
+        '''
+        Population of N actors holding M coins, as densities that sum to 1.
+        Unemployed and workers are (groups, K) over the wealth grid,
+        capitalists (groups, S, K) by firm size and wealth, on a grid of
+        size_points sizes up to max_firm_size.
+        '''
+        if wa is not None or wb is not None:
+            self.set_wages(self.wa if wa is None else wa,
+                           self.wb if wb is None else wb)
+
+        self.N = N
+        self.Money = M
+        self.analyzer = MeanFieldAnalyzer(N) if analyzer is None else analyzer
+        self.substeps = substeps
+
+        self.grid = wealth_grid(M / N, grid_points)
+        self.sizes = size_grid(max_firm_size, size_points)
+        (shares, self.rates) = activity_groups(groups)
+        (self.fractions, self.weights) = fraction_kernel(kernel_nodes)
+        K = len(self.grid)
+
+        # Spending moves wealth w to w * (1 - v): a fixed K x K operator
+        self.spending = transport(self.grid, np.eye(K),
+                                  self.grid[:, None] * (1 - self.fractions),
+                                  self.weights)
+
+        # A paying firm of size s moves to w - min(s * wage, w), a firing
+        # one to size min(s, floor(w / wage_avg)): fixed for the grid
+        bills = np.minimum(self.sizes[:, None] * (self.wa + self.wb) / 2,
+                           self.grid)
+        self.paying = split_points(
+            self.grid, np.broadcast_to(self.grid - bills,
+                                       (groups,) + bills.shape))
+        self.keep = np.minimum(self.sizes[:, None],
+                               np.floor(self.grid / self.wage_avg)[None, :])
+        self.keeping = split_points(
+            self.sizes, np.broadcast_to(self.keep, (groups,) + self.keep.shape))
+
+        start = transport(self.grid, np.eye(1, K)[0], np.full(K, M / N))
+        self.unemployed = shares[:, None] * start
+        self.workers = np.zeros((groups, K))
+        self.firms = np.zeros((groups, len(self.sizes), K))
+
+        # Market value per actor
+        self.market_value = 0.0
+
+    set_wages = MaterialWorld.set_wages
+
+    @property
+    def class_fractions(self):
+        '''
+        Fractions of unemployed, workers and capitalists
+        '''
+        return np.array([self.unemployed.sum(), self.workers.sum(),
+                         self.firms.sum()])
+
+    @property
+    def money(self):
+        '''
+        Coins per actor held by actors
+        '''
+        return float((self.unemployed.sum(axis=0) + self.workers.sum(axis=0) +
+                      self.firms.sum(axis=(0, 1))) @ self.grid)
+
+    def acting(self, dt, density):
+        '''
+        Mass of density (groups, ...) selected to act in a substep
+        '''
+        rates = np.minimum(dt * self.rates, 1)
+        return rates.reshape((-1,) + (1,) * (density.ndim - 1)) * density
+
+    def move_sizes(self, density, sizes, split=None):
+        '''
+        Firms of density (groups, R, K) moved to sizes of the same shape,
+        split between the neighbouring sizes of the grid. split is
+        split_points of fixed sizes. Returns (groups, S, K).
+        '''
+        (G, S, K) = (len(self.rates), len(self.sizes), len(self.grid))
+        if split is None:
+            (density, sizes) = np.broadcast_arrays(density, sizes)
+            split = split_points(self.sizes, sizes)
+        (index, upper) = split
+
+        groups = np.arange(G).reshape(-1, 1, 1) * S * K
+        flat = (groups + index * K + np.arange(K)).ravel()
+        upper = density * upper
+        moved = (np.bincount(flat, (density - upper).ravel(), G * S * K) +
+                 np.bincount(flat + K, upper.ravel(), G * S * K))
+        return moved.reshape(G, S, K)
+
+    def hiring_rule(self, dt):
+        '''
+        Acting unemployed actors are hired by employers picked by wealth.
+        Founders and hires both come from the unemployed, so an actor
+        picked as a founder is not hired, and nobody is hired twice.
+        '''
+        grid = self.grid
+        acting = self.acting(dt, self.unemployed)
+        attempts = acting.sum()
+        firms = self.firms.sum(axis=(0, 1))
+        potential = (self.unemployed.sum(axis=0) + firms) @ grid
+        if attempts <= 0 or potential <= 0:
+            return
+
+        # Hires expected by every employer, picked by wealth and hiring if
+        # richer than wage_avg
+        rate = attempts * (grid > self.wage_avg) * grid / potential
+
+        # Unemployed employers are picked with probability min(rate, 1)
+        picked = np.minimum(rate, 1)
+        founded = np.divide(rate, picked, out=np.zeros_like(rate), where=picked > 0)
+        founders = picked * self.unemployed
+        demand = (founders @ founded).sum() + rate @ firms
+
+        # Hires come from the acting unemployed that are not founders:
+        # scaled by s, demand is s * demand and the hiring pool
+        # attempts - s * (acting founders)
+        acting_founders = picked * acting
+        scale = min(1.0, attempts / (demand + acting_founders.sum()))
+        founders *= scale
+        rate *= scale
+        pool = acting - scale * acting_founders
+
+        employees = self.sizes @ self.firms.sum(axis=(0, 2))
+        self.firms = (self.move_sizes(self.firms, self.sizes[:, None] + rate) +
+                      self.move_sizes(founders[:, None, :], founded))
+        hires = self.sizes @ self.firms.sum(axis=(0, 2)) - employees
+
+        # Hired in proportion to the pool, which never exceeds the
+        # unemployed left after founding
+        hired = min(hires / pool.sum(), 1) * pool
+        self.unemployed -= founders + hired
+        self.workers += hired
+
+    def expenditure_rule(self, dt):
+        '''
+        Returns coins per actor spent into the market
+        '''
+        before = self.money
+        for name in ['unemployed', 'workers', 'firms']:
+            density = getattr(self, name)
+            spending = self.acting(dt, density)
+            setattr(self, name, density - spending + spending @ self.spending)
+        return before - self.money
+
+    def market_sample_rule(self, dt, spent):
+        '''
+        Hand the market to employers, per worker step. Returns revenue per actor.
+        '''
+        market = self.market_value + spent
+        workers = self.workers.sum()
+        if workers <= 0:
+            self.market_value = market
+            return 0.0
+
+        # Draws of a firm of size s: s times the mean rate of its workers
+        draws = self.sizes * self.acting(dt, self.workers).sum() / workers
+        events = draws @ self.firms.sum(axis=(0, 2))
+        per_event = market / events if events > 0 else 0.0
+
+        before = self.money
+        self.firms = transport(self.grid, self.firms,
+                               self.grid + (draws * per_event)[:, None])
+        revenue = self.money - before
+        self.market_value = market - revenue
+        return revenue
+
+    def firing_rule(self, dt):
+        '''
+        Returns firm demises per actor
+        '''
+        keep = self.keep
+        acting = self.acting(dt, self.firms)
+        fired = float(((self.sizes[:, None] - keep) * acting).sum())
+        demises = float(acting[:, 1:][:, keep[1:] == 0].sum())
+
+        # Acting firms shrink to their new size; size 0 is unemployment
+        self.firms = (self.firms - acting +
+                      self.move_sizes(acting, keep, split=self.keeping))
+        self.unemployed += self.firms[:, 0]
+        self.firms[:, 0] = 0
+
+        if fired > 0:
+            leaving = fired * self.workers / self.workers.sum()
+            self.workers -= leaving
+            self.unemployed += leaving
+
+        return demises
+
+    def wage_payment_rule(self, dt):
+        '''
+        Returns the wage bill per actor
+        '''
+        wage = (self.wa + self.wb) / 2
+        acting = self.acting(dt, self.firms)
+        before = self.money
+        self.firms = (self.firms - acting +
+                      transport(self.grid, acting, None, split=self.paying))
+        paid = before - self.money
+
+        workers = self.workers.sum()
+        paid_workers = float(acting.sum(axis=(0, 2)) @ self.sizes)
+        if paid <= 0 or workers <= 0:
+            return 0.0
+
+        # Each worker is paid when its employer acts, a share of the mean
+        # wage drawn between wa and wb
+        wages = self.wa + (self.wb - self.wa) * self.fractions
+        scale = paid / paid_workers / wage
+        moving = paid_workers / workers * self.workers
+        self.workers = (self.workers - moving +
+                        transport(self.grid, moving,
+                                  self.grid[:, None] + scale * wages, self.weights))
+        return paid
+
+    def one_month_rule(self):
+        '''
+        Substeps of every rule. Returns [firm demises, revenue, wage bill]
+        in the units of the agent engines.
+        '''
+        dt = 1 / self.substeps
+        demises = revenue = wage_bill = 0.0
+
+        for i in range(self.substeps):
+            self.hiring_rule(dt)
+            spent = self.expenditure_rule(dt)
+            demises += self.firing_rule(dt)
+            revenue += self.market_sample_rule(dt, spent)
+            wage_bill += self.wage_payment_rule(dt)
+
+        counts = np.bincount(self.sizes.astype(np.int64),
+                             self.firms.sum(axis=(0, 2)) * self.N)
+        self.analyzer.firm_size_counts.append(np.round(counts).astype(np.int64))
+
+        return [demises * self.N, revenue * self.N, wage_bill * self.N]
+
+    def one_year_rule(self):
+        '''
+        Repeat a month 12 times
+        '''
+        total_revenue = 0
+        total_wage_bill = 0
+
+        for i in range(12):
+            [firm_demises, revenue, wage_bill] = self.one_month_rule()
+            total_revenue += revenue
+            total_wage_bill += wage_bill
+
+            self.analyzer.firm_demise_measure(firm_demises)
+
+        self.analyzer.add_yearly_revenue(total_revenue)
+        self.analyzer.add_yearly_wage_bill(total_wage_bill)
+
+        counts = np.round(self.class_fractions * self.N).astype(int).tolist()
+        self.analyzer.class_measures.append(counts + [0])
+        self.analyzer.store_densities(
+            self.grid, self.unemployed.sum(axis=0), self.workers.sum(axis=0),
+            self.firms.sum(axis=(0, 1)))
+
+    run_sim = MaterialWorld.run_sim
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in per-rule instrumentation of MaterialWorld and ArrayWorld.
+
+RuleProfiler wraps the five rules of simulation_rule and one_month_rule on
+a single world instance. A world without a profiler attached runs the plain
+class methods, so the disabled mode costs nothing. An ArrayWorld runs its
+months step by step through the rule methods while profiled, instead of in
+its batched loop, so it is slower than unprofiled. LeapingWorld applies the
+rules in vectorized leaps instead of the rule methods, so it is rejected.
+"""
+
+# Built-int
+import time
+
+# Froms
+from main import sampler_stats
+
+
+RULES = ['hiring_rule', 'expenditure_rule', 'market_sample_rule',
+         'firing_rule', 'wage_payment_rule']
+
+
+class RuleProfiler:
+    def __init__(self, callback=None, clock=time.perf_counter):
+        '''
+        Per-rule call counts, wall time and normal sampler rejections, plus
+        steps per second for every month. callback(month, profiler) is
+        called after each month with that month's record.
+        '''
+        self.callback = callback
+        self.clock = clock
+        self.world = None
+
+        self.calls = dict.fromkeys(RULES, 0)
+        self.seconds = dict.fromkeys(RULES, 0.0)
+        self.rejections = dict.fromkeys(RULES, 0)
+        self.months = []
+
+    def attach(self, world):
+        '''
+        Instrument a world. Returns self.
+        '''
+        from leaping import LeapingWorld
+        if isinstance(world, LeapingWorld):
+            raise TypeError('LeapingWorld does not run the rule methods, '
+                            'so there is nothing to profile')
+
+        if self.world is not None:
+            self.detach()
+
+        self.world = world
+        for name in RULES:
+            setattr(world, name, self.timed(name, getattr(world, name)))
+        world.one_month_rule = self.timed_month(world.one_month_rule)
+        if hasattr(world, 'batched_months'):
+            world.batched_months = False
+        return self
+
+    def detach(self):
+        '''
+        Restore the world's plain methods
+        '''
+        for name in RULES + ['one_month_rule', 'batched_months']:
+            self.world.__dict__.pop(name, None)
+        self.world = None
+
+    def timed(self, name, rule):
+        clock = self.clock
+        calls = self.calls
+        seconds = self.seconds
+        rejections = self.rejections
+
+        def wrapper(*args):
+            rejected = sampler_stats.rejections
+            start = clock()
+            result = rule(*args)
+            seconds[name] += clock() - start
+            calls[name] += 1
+            rejections[name] += sampler_stats.rejections - rejected
+            return result
+
+        return wrapper
+
+    def timed_month(self, one_month_rule):
+        def wrapper():
+            rejected = sampler_stats.rejections
+            start = self.clock()
+            result = one_month_rule()
+            seconds = self.clock() - start
+
+            month = {
+                'month': len(self.months),
+                'steps': self.world.N,
+                'seconds': seconds,
+                'steps_per_second': self.world.N / seconds if seconds > 0 else 0.0,
+                'rejections': sampler_stats.rejections - rejected,
+            }
+            self.months.append(month)
+
+            if self.callback is not None:
+                self.callback(month, self)
+            return result
+
+        return wrapper
+
+    def report(self):
+        '''
+        Structured summary: totals per rule and the monthly records
+        '''
+        rules = {}
+        for name in RULES:
+            calls = self.calls[name]
+            rules[name] = {
+                'calls': calls,
+                'seconds': self.seconds[name],
+                'seconds_per_call': self.seconds[name] / calls if calls else 0.0,
+                'rejections': self.rejections[name],
+            }
+
+        seconds = sum(m['seconds'] for m in self.months)
+        steps = sum(m['steps'] for m in self.months)
+        return {
+            'rules': rules,
+            'months': list(self.months),
+            'steps': steps,
+            'seconds': seconds,
+            'steps_per_second': steps / seconds if seconds > 0 else 0.0,
+        }
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Headless figure reports of Analyzer histories.
+
+figure_data computes everything the notebook plots show (income and wealth
+CCDFs, CCDFs per year, entropy, commonwealth, class size histograms,
+profit and wage shares, firm demise, recession and GDP growth bar charts)
+as plain arrays. render_figure then draws one figure to a file with the Agg
+backend, without pyplot or a display. Figures of one or many runs are
+rendered across a process pool. Runs are checkpoint snapshots, trace
+directories, or the results files of cli.py, which only have the yearly and
+monthly series:
+
+    python report.py snapshot.npz trace_directory results.npz --output reports
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import argparse
+import json
+import os
+import sys
+
+# Froms
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# Ends of the per-year colour gradient, as matplotlib's 'green' and 'blue'
+GREEN = (0.0, 0.5, 0.0)
+BLUE = (0.0, 0.0, 1.0)
+
+
+def gradient(start, end, n):
+    '''
+    n RGB colours from start to end
+    '''
+    steps = np.linspace(0, 1, max(n, 1))[:, None]
+    colours = (1 - steps) * np.asarray(start) + steps * np.asarray(end)
+    return [tuple(c) for c in colours.tolist()]
+
+
+def line(x, y, color=None, label=None):
+    return {'x': np.asarray(x), 'y': np.asarray(y), 'color': color, 'label': label}
+
+
+def counts_panel(values, title, yscale='linear', zero=True):
+    '''
+    Bar panel of how often every value occurs, as the notebook's Counter
+    plots. zero adds a bar for 0 if it is missing.
+    '''
+    (x, height) = np.unique(np.asarray(values), return_counts=True)
+    if zero and (len(x) == 0 or x[0] != 0):
+        x = np.r_[0, x]
+        height = np.r_[0, height]
+    return {'kind': 'bar', 'x': x, 'height': height, 'title': title,
+            'yscale': yscale}
+
+
+def ccdf_figure(analyzer, metric):
+    general = analyzer.ccdf(metric)
+    capitalist = analyzer.ccdf(metric, 'capitalist')
+    worker = analyzer.ccdf(metric, 'worker')
+    return {
+        'name': metric + '_ccdf',
+        'panels': [
+            {'kind': 'line', 'lines': [line(*general, color='green')],
+             'xscale': 'log', 'yscale': 'log', 'title': f'{metric} CCDF'},
+            {'kind': 'line', 'lines': [
+                line(*capitalist, color='green', label='capitalists'),
+                line(*worker, color='blue', label='workers')],
+             'xscale': 'log', 'yscale': 'log', 'title': f'{metric} CCDF by class'},
+        ],
+    }
+
+
+def yearly_ccdf_figure(analyzer, metric, step):
+    years = min(analyzer.years, len(analyzer.class_measures))
+    colours = gradient(GREEN, BLUE, years)
+    panels = []
+    for klass in ['capitalist', 'worker']:
+        lines = [line(*analyzer.ccdf(metric, klass, (i, i + 1)), color=colours[i])
+                 for i in range(0, years, step)]
+        panels.append({'kind': 'line', 'lines': lines, 'xscale': 'log',
+                       'yscale': 'log', 'title': f'{klass} {metric} CCDF per year'})
+    return {'name': metric + '_ccdf_per_year', 'panels': panels}
+
+
+def figure_data(analyzer, N=None, step=10, entropy_caps=(0, 1000, 2000, 5000),
+                commonwealth_classes=20, commonwealth_cap=1000):
+    '''
+    Data of every report figure of an analyzer, as a list of picklable dicts
+    {'name', 'panels'}. Figures of per-actor histories are left out when the
+    analyzer has none, as in a MeanFieldAnalyzer.
+    '''
+    N = N or analyzer.N
+    analyzer.gdp_growth_measures()
+    figures = []
+
+    if analyzer.actor_wealths.size:
+        for metric in ['incomes', 'wealths']:
+            figures.append(ccdf_figure(analyzer, metric))
+        figures.append(yearly_ccdf_figure(analyzer, 'incomes', step))
+
+    if analyzer.years:
+        lines = []
+        if hasattr(analyzer, 'entropies'):
+            # A StreamingAnalyzer has only the caps it tracked
+            entropy_caps = [cap for cap in entropy_caps
+                            if cap in analyzer.entropies]
+        for cap in entropy_caps:
+            ent = analyzer.entropy_analysis(N, cap)
+            lines.append(line(range(len(ent)), ent,
+                              label=f'wealth cap {cap}' if cap else 'no cap'))
+        figures.append({'name': 'entropy', 'panels': [
+            {'kind': 'line', 'lines': lines, 'title': 'Wealth entropy'}]})
+
+    if analyzer.actor_wealths.size:
+        commonwealth = analyzer.commonwealth_series(
+            N, commonwealth_classes, commonwealth_cap)
+        figures.append({'name': 'commonwealth', 'panels': [
+            {'kind': 'line', 'lines': [line(range(len(commonwealth)), commonwealth)],
+             'title': 'Commonwealth'}]})
+
+    if analyzer.class_measures:
+        classes = np.asarray(analyzer.class_measures)
+        panels = []
+        for column, title in enumerate(['unemployed', 'workers', 'capitalists']):
+            (counts, edges) = np.histogram(classes[:, column], bins=20)
+            panels.append({'kind': 'hist', 'counts': counts, 'edges': edges,
+                           'title': title})
+        figures.append({'name': 'class_sizes', 'panels': panels})
+
+    if analyzer.wage_shares:
+        years = range(1, len(analyzer.wage_shares) + 1)
+        figures.append({'name': 'shares', 'panels': [
+            {'kind': 'line', 'title': 'Profit and wage shares', 'lines': [
+                line(years, analyzer.profit_shares, label='profit share'),
+                line(years, analyzer.wage_shares, label='wage share')]}]})
+
+    if analyzer.firm_demises:
+        figures.append({'name': 'firm_demises', 'panels': [
+            counts_panel(analyzer.firm_demises, 'Firm demises per month')]})
+
+    figures.append({'name': 'recessions', 'panels': [
+        counts_panel(analyzer.recessions, 'Recession duration (years)')]})
+
+    gdp = np.round(np.asarray(analyzer.gdp_growth, dtype=np.float64), 1)
+    figures.append({'name': 'gdp_growth', 'panels': [
+        counts_panel(gdp[gdp < 7.5], 'GDP growth', yscale='log', zero=False)]})
+
+    return figures
+
+
+def draw_panel(axis, panel):
+    axis.set_xscale(panel.get('xscale', 'linear'))
+    axis.set_yscale(panel.get('yscale', 'linear'))
+    axis.set_title(panel.get('title', ''))
+
+    kind = panel['kind']
+    if kind == 'line':
+        for data in panel['lines']:
+            axis.plot(data['x'], data['y'], c=data['color'], label=data['label'])
+        if any(data['label'] for data in panel['lines']):
+            axis.legend()
+    elif kind == 'bar':
+        labels = [f'{x:g}' for x in panel['x']]
+        axis.bar(labels, panel['height'])
+        axis.tick_params(axis='x', labelrotation=90)
+    elif kind == 'hist':
+        axis.stairs(panel['counts'], panel['edges'], fill=True)
+    else:
+        raise ValueError(f'unknown panel kind {kind!r}')
+
+
+def render_figure(figure, path, dpi=100):
+    '''
+    Draw one figure_data figure to path with the Agg backend. Returns path.
+    '''
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    panels = figure['panels']
+    canvas = FigureCanvasAgg(Figure(figsize=(6 * len(panels), 4.5), dpi=dpi))
+    axes = canvas.figure.subplots(1, len(panels), squeeze=False)[0]
+    for axis, panel in zip(axes, panels):
+        draw_panel(axis, panel)
+
+    canvas.figure.tight_layout()
+    canvas.figure.savefig(path)
+    return path
+
+
+def load_analyzer(source):
+    '''
+    Analyzer of a checkpoint snapshot file, a trace directory or a compact
+    results file
+    '''
+    if os.path.isdir(source):
+        from traces import TraceReader
+        return TraceReader(source).analyzer()
+
+    with np.load(source) as data:
+        snapshot = 'meta' in data.files
+        if not snapshot:
+            from ensemble import results_analyzer
+            return results_analyzer(data)
+
+    import checkpoint
+    return checkpoint.load(source, restore_random=False).analyzer
+
+
+def run_figure_data(source, options):
+    return figure_data(load_analyzer(source), **options)
+
+
+def render_report(analyzer, directory, processes=None, format='png', dpi=100,
+                  **options):
+    '''
+    Compute the figures of an analyzer, then render them across a process
+    pool into directory. Returns the file paths.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    figures = figure_data(analyzer, **options)
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [pool.submit(render_figure, figure,
+                               os.path.join(directory, f'{figure["name"]}.{format}'),
+                               dpi)
+                   for figure in figures]
+        return [future.result() for future in futures]
+
+
+def render_runs(sources, directory, processes=None, format='png', dpi=100,
+                **options):
+    '''
+    Reports of several runs (snapshot files, trace directories or results
+    files), one
+    subdirectory each. Runs are loaded and their figures computed in the
+    pool, and each figure is rendered as soon as its run is ready.
+    Returns {source: [paths]}.
+    '''
+    paths = {source: [] for source in sources}
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        runs = {pool.submit(run_figure_data, source, options): source
+                for source in sources}
+
+        renders = {}
+        for future in as_completed(runs):
+            source = runs[future]
+            name = os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+            run_directory = os.path.join(directory, name)
+            os.makedirs(run_directory, exist_ok=True)
+            for figure in future.result():
+                path = os.path.join(run_directory, f'{figure["name"]}.{format}')
+                renders[pool.submit(render_figure, figure, path, dpi)] = source
+
+        for future in as_completed(renders):
+            paths[renders[future]].append(future.result())
+
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Render Analyzer figures of runs to image files.')
+    parser.add_argument('sources', nargs='+',
+                        help='checkpoint snapshots, trace directories or '
+                        'cli.py results files')
+    parser.add_argument('--output', default='reports')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--format', default='png')
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--step', type=int, default=10,
+                        help='years between per-year CCDF curves')
+    args = parser.parse_args(argv)
+
+    paths = render_runs(args.sources, args.output, args.processes, args.format,
+                        args.dpi, step=args.step)
+    print(json.dumps({source: sorted(p) for source, p in paths.items()}, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
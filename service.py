@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Local asyncio service publishing live Analyzer metrics of running simulations.
+
+Simulations run in a process pool, each on its own core and with its own
+random generators, so a seeded run is reproducible while others run. After
+every one_year_rule the worker sends the year's metrics through a queue to
+the event loop, which fans them out to subscribers over HTTP Server-Sent
+Events. Every subscriber has a bounded queue that drops its oldest events
+when full, so slow consumers never hold up a simulation.
+
+    python service.py --port 8765
+    curl -X POST 'localhost:8765/simulations?N=1000&years=100&engine=array&seed=1'
+    curl localhost:8765/simulations/1/events
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import signal
+
+# Froms
+from queue import Empty
+from urllib.parse import urlsplit, parse_qs
+from ensemble import ENGINES
+
+
+def year_metrics(analyzer):
+    '''
+    Metrics of the last measured year
+    '''
+    revenues = analyzer.revenues
+    wage_bill = analyzer.wage_bills[-1]
+    revenue = revenues[-1]
+
+    return {
+        'year': len(revenues) - 1,
+        'class_measures': analyzer.class_measures[-1],
+        'revenue': revenue,
+        'wage_bill': wage_bill,
+        'wage_share': wage_bill / revenue if revenue else None,
+        'gdp_growth': (revenue / revenues[-2] - 1
+                       if len(revenues) > 1 and revenues[-2] else None),
+        'firm_demises': analyzer.firm_demises[-12:],
+    }
+
+
+# Queue of (simulation id, event) from a worker process to the service
+worker_events = None
+
+
+def init_worker(events):
+    '''
+    Pool worker setup. Signals are left to the service, which terminates
+    its workers when it stops.
+    '''
+    global worker_events
+    worker_events = events
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def run_simulation(id, N, M, years, engine, seed):
+    '''
+    Simulation loop, in a worker process. Seeds this process's generators
+    (from fresh entropy without a seed) and sends every year's metrics,
+    then an end event, to the service.
+    '''
+    events = worker_events
+    random.seed(seed)
+    np.random.seed(None if seed is None else seed % 2**32)
+
+    try:
+        world = ENGINES[engine](N, M)
+        world.analyzer.reserve(years)
+        for year in range(years):
+            world.one_year_rule()
+            events.put((id, dict(year_metrics(world.analyzer), event='year')))
+        world.analyzer.gdp_growth_measures()
+    except Exception:
+        events.put((id, {'event': 'end', 'status': 'failed'}))
+        raise
+
+    events.put((id, {'event': 'end', 'status': 'done'}))
+
+
+class Simulation:
+    def __init__(self, id, N, years, queue_size):
+        '''
+        A world running in a worker process, with its metric history and
+        subscribers
+        '''
+        self.id = id
+        self.N = N
+        self.years = years
+        self.queue_size = queue_size
+        self.status = 'running'
+        self.history = []
+        self.subscribers = set()
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'N': self.N,
+            'years': self.years,
+            'status': self.status,
+            'latest': self.history[-1] if self.history else None,
+        }
+
+    def subscribe(self):
+        '''
+        New bounded queue, preloaded with the history that fits in it
+        '''
+        queue = asyncio.Queue(self.queue_size)
+        for event in self.history[-self.queue_size:]:
+            queue.put_nowait(event)
+        if self.status != 'running':
+            self.push(queue, {'event': 'end', 'status': self.status})
+        else:
+            self.subscribers.add(queue)
+        return queue
+
+    def push(self, queue, event):
+        '''
+        Enqueue without waiting, dropping the oldest event if the queue is full
+        '''
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def publish(self, event):
+        if event.get('event') == 'year':
+            self.history.append(event)
+        for queue in self.subscribers:
+            self.push(queue, event)
+
+    def end(self, status):
+        '''
+        Publish the end of the run once, and let go of the subscribers
+        '''
+        if self.status != 'running':
+            return
+        self.status = status
+        self.publish({'event': 'end', 'status': status})
+        self.subscribers.clear()
+
+
+class MetricsService:
+    def __init__(self, host='127.0.0.1', port=8765, workers=4, queue_size=64):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pool = None
+        self.events = None
+        self.simulations = {}
+        self.server = None
+
+    def start_simulation(self, N=1_000, M=100_000, years=100, engine='material',
+                         seed=None):
+        '''
+        Run a new world in the process pool. Returns the Simulation.
+        '''
+        if engine not in ENGINES:
+            raise ValueError(f'engine must be one of {list(ENGINES)}')
+
+        simulation = Simulation(len(self.simulations) + 1, N, years,
+                                self.queue_size)
+        self.simulations[simulation.id] = simulation
+
+        # A run that fails before it can send its end event still ends
+        loop = asyncio.get_running_loop()
+
+        def failed(error):
+            loop.call_soon_threadsafe(simulation.end, 'failed')
+
+        self.pool.apply_async(run_simulation, (
+            simulation.id, N, M, years, engine, seed), error_callback=failed)
+        return simulation
+
+    def next_message(self, timeout=0.1):
+        try:
+            return self.events.get(timeout=timeout)
+        except Empty:
+            return None
+
+    async def relay(self):
+        '''
+        Hand the events of the worker processes to their simulations, in
+        the order they were sent. Waits in short polls, so that it can be
+        cancelled.
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self.next_message)
+            if message is None:
+                continue
+
+            (id, event) = message
+            simulation = self.simulations[id]
+            if event['event'] == 'end':
+                simulation.end(event['status'])
+            else:
+                simulation.publish(event)
+
+    async def serve(self):
+        '''
+        Serve until cancelled, then stop the runs still going
+        '''
+        self.events = multiprocessing.Queue()
+        self.pool = multiprocessing.Pool(self.workers, init_worker, (self.events,))
+        relay = asyncio.ensure_future(self.relay())
+
+        try:
+            self.server = await asyncio.start_server(
+                self.handle, self.host, self.port)
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            relay.cancel()
+            self.pool.terminate()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            method, target, _ = request.decode().split(' ', 2)
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            url = urlsplit(target)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            parts = [p for p in url.path.split('/') if p]
+            await self.route(method, parts, params, writer)
+        except (ValueError, KeyError) as e:
+            await self.respond(writer, 400, {'error': str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, parts, params, writer):
+        if parts == ['simulations'] and method == 'GET':
+            await self.respond(writer, 200, [
+                s.summary() for s in self.simulations.values()])
+
+        elif parts == ['simulations'] and method == 'POST':
+            simulation = self.start_simulation(
+                N=int(params.get('N', 1_000)),
+                M=int(params.get('M', 100_000)),
+                years=int(params.get('years', 100)),
+                engine=params.get('engine', 'material'),
+                seed=int(params['seed']) if 'seed' in params else None)
+            await self.respond(writer, 201, simulation.summary())
+
+        elif len(parts) >= 2 and parts[0] == 'simulations':
+            simulation = self.simulations.get(int(parts[1]))
+            if simulation is None:
+                await self.respond(writer, 404, {'error': 'no such simulation'})
+            elif parts[2:] == ['events']:
+                await self.stream(simulation, writer)
+            else:
+                await self.respond(writer, 200, dict(
+                    simulation.summary(), history=simulation.history))
+
+        else:
+            await self.respond(writer, 404, {'error': 'not found'})
+
+    async def respond(self, writer, status, body):
+        data = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status} \r\n'
+                     'Content-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\n'
+                     'Connection: close\r\n\r\n'.encode() + data)
+        await writer.drain()
+
+    async def stream(self, simulation, writer):
+        '''
+        Server-Sent Events of one simulation, until it ends or the client leaves
+        '''
+        writer.write(b'HTTP/1.1 200 \r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+        await writer.drain()
+
+        queue = simulation.subscribe()
+        try:
+            while True:
+                event = await queue.get()
+                writer.write(f'data: {json.dumps(event)}\n\n'.encode())
+                await writer.drain()
+                if event.get('event') == 'end':
+                    break
+        finally:
+            simulation.subscribers.discard(queue)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Live simulation metrics.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    # Stop on SIGTERM as on Ctrl-C, so worker processes are not left behind
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    service = MetricsService(args.host, args.port, args.workers, args.queue_size)
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
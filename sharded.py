@@ -0,0 +1,954 @@
+# -*- coding: utf-8 -*-
+"""
+Sharded simulation across worker processes with a shared market.
+
+Actors are partitioned into shards, each an ArrayWorld in its own process
+that runs batched months of its actors. Employers and spenders are
+picked across all shards: a hire goes to a shard drawn by the potential
+employer coins of every shard, and an expenditure to a shard drawn by its
+number of actors. Steps that reach into another shard are settled there at
+the next sync, every sync_interval months (by default a quarter of a
+month) and at the end of every year, so that merged years hold all the
+money: hire requests are answered,
+wages of remote employees and firings are applied, and remote spends are
+made until the next sync. A firm draws the revenue of its employees
+in other shards itself, once per employee and month on average. Spending
+and revenue go through one market: at every sync the shards pool their market value in shared memory
+and split it in proportion to the employees of their firms, for whom
+revenue is drawn, and publish their potential employer coins. The per-shard histories are merged into one Analyzer.
+
+Between syncs a shard sees the other shards' employer coins of the last sync,
+and remote steps wait for the sync. Actors fired by a firm in another shard
+only become unemployed at the sync, which matters because the unemployed are
+few and found the new firms, so syncs every month give fewer firm demises and
+larger firms. Results differ from the single-process engine; compare_engines
+measures by how much, and the speedup of sharding as the CPU time of the
+single-process run over that of the slowest shard:
+
+    python sharded.py --N 100000 --years 20 --shards 8
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import argparse
+import copy
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+import traceback
+
+# Froms
+from bisect import bisect_right
+from main import (ArrayWorld, Analyzer, payroll, normal_int, normal_ints,
+                  pre_drawn_normal_int, UNEMPLOYED, WORKER, CAPITALIST)
+from ensemble import replica_seeds, run_world
+from streaming import gini
+
+
+PARTITIONS = ['random', 'block']
+
+
+def partition_actors(N, shards, partition='random', seed=0):
+    '''
+    Global actor ids of every shard. partition is 'random', 'block'
+    (contiguous ids) or an array with the shard of every actor.
+    '''
+    if isinstance(partition, str):
+        if partition == 'random':
+            ids = np.random.default_rng(seed).permutation(N)
+        elif partition == 'block':
+            ids = np.arange(N)
+        else:
+            raise ValueError(f'partition must be one of {PARTITIONS} or an array')
+        return [np.sort(part) for part in np.array_split(ids, shards)]
+
+    labels = np.asarray(partition)
+    return [np.flatnonzero(labels == shard) for shard in range(shards)]
+
+
+def market_shares(total, weights):
+    '''
+    Integer split of total in proportion to weights, remainders to the
+    largest fractions. Every shard computes the same split.
+    '''
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.sum() <= 0:
+        weights = np.ones(len(weights))
+
+    exact = total * weights / weights.sum()
+    shares = np.floor(exact).astype(np.int64)
+    remainder = int(total - shares.sum())
+    shares[np.argsort(shares - exact, kind='stable')[:remainder]] += 1
+    return shares
+
+
+# Outbox entries of cross-shard steps, sent at every sync: hire requests
+# (local id), spends of the receiving shard's actors (count), wages (local
+# id, amount) and fired employees (local id)
+OUTBOX = {'hires': [], 'spends': 0, 'wages': [], 'fired': []}
+
+# Answers to hire requests, sent back in the same sync: hired (local id,
+# firm) and rejected (local id)
+ANSWERS = {'hired': [], 'rejected': []}
+
+
+class ShardAnalyzer(Analyzer):
+    def __init__(self, history=True):
+        '''
+        Analyzer of one shard. Keeps per actor rows only until they are sent.
+        '''
+        super().__init__()
+        self.history = history
+        self.labels = None
+        self.rows = []
+
+    def reserve(self, years):
+        '''
+        Nothing to preallocate
+        '''
+
+    def store_classes(self, labels):
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.count_classes(self.labels)
+
+    def store_incomes_and_wealths(self, incomes, wealths):
+        if self.history:
+            self.rows.append((self.labels, np.array(incomes), np.array(wealths)))
+        self.years += 1
+
+
+class ShardWorld(ArrayWorld):
+    def __init__(self, shard, N, M, wa, wb, market, employed, weights,
+                 populations, inboxes, barrier, sync_interval, history=True):
+        '''
+        ArrayWorld of one shard, pooling its market with the others and
+        settling cross-shard hires, spends and payments every
+        sync_interval months
+        '''
+        super().__init__(N, M, wa, wb, analyzer=ShardAnalyzer(history))
+        self.shard = shard
+        self.shards = len(populations)
+        self.market = market
+        self.employed = employed
+        self.weights = weights
+        self.population_bounds = np.cumsum(populations).tolist()
+        self.inboxes = inboxes
+        self.barrier = barrier
+        self.sync_interval = sync_interval
+        self.months = 0
+
+        # {local id: (shard, firm)} of actors employed by another shard, whose
+        # employer is N + id here. firm is None until the hire is answered.
+        self.remote_employer = {}
+
+        # Spends of actors here for steps of other shards, received at the
+        # last sync and made a few at a time over the following month
+        self.remote_spends = 0
+        self.spend_rate = 0.0
+        self.spend_credit = 0.0
+
+        # [firm] of every employee in another shard, with {roster entry: index}
+        self.remote_staff = []
+        self.remote_codes = []
+        self.remote_slots = {}
+        self.revenue_credit = 0.0
+
+        # Employees of every firm as lists while a month runs in batched
+        # parts, instead of the roster
+        self.staffs = None
+        self.outboxes = [copy.deepcopy(dict(OUTBOX, **ANSWERS))
+                         for shard in range(self.shards)]
+
+    def remote_code(self, shard, id):
+        '''
+        Roster entry of an employee of another shard. Always negative.
+        '''
+        return -1 - (id * self.shards + shard)
+
+    def remote_actor(self, code):
+        '''
+        (shard, local id) of a remote roster entry
+        '''
+        code = -1 - int(code)
+        return code % self.shards, code // self.shards
+
+    def pick_shard(self, bounds):
+        '''
+        Random shard, with probability proportional to its step of the
+        cumulative bounds
+        '''
+        value = random.random() * bounds[-1]
+        for shard, bound in enumerate(bounds):
+            if value < bound:
+                return shard
+        return self.shard
+
+    def employer_shard(self):
+        '''
+        Shard of a new employer, weighted by the potential employer coins of
+        every shard: this shard's current ones, the others' at the last sync
+        '''
+        weights = self.weights.copy()
+        weights[self.shard] = self.employer_index.total
+        if weights.sum() <= 0:
+            return self.shard
+        return self.pick_shard(np.cumsum(weights).tolist())
+
+    def hiring_rule(self, id):
+        '''
+        Randomly employ someone, in any shard. A hire by another shard is
+        requested at the next sync, and the actor counts as employed until
+        it is answered.
+        '''
+        if self.employer[id] >= 0 or self.firm_size[id] > 0:
+            return
+
+        shard = self.employer_shard()
+        if shard == self.shard:
+            return super().hiring_rule(id)
+
+        self.employer[id] = self.N + id
+        self.remote_employer[id] = (shard, None)
+        self.index_actor(id)
+        self.outboxes[shard]['hires'].append(id)
+
+    def spend(self, id):
+        '''
+        Expenditure of actor id into the market
+        '''
+        exp = self.random_expenditure(id)
+        self.coins[id] -= exp
+        self.index_actor(id)
+        self.market_value += exp
+
+    def expenditure_rule(self, id):
+        '''
+        Random actor expenses, by an actor of any shard. The spend of
+        another shard's actor is made there during the month after the
+        next sync.
+        '''
+        self.spend_credit += self.spend_rate
+        while self.spend_credit >= 1 and self.remote_spends > 0:
+            self.spend_credit -= 1
+            self.remote_spends -= 1
+            self.spend(self.select_actor())
+
+        shard = self.pick_shard(self.population_bounds)
+        if shard == self.shard:
+            return super().expenditure_rule(id)
+
+        self.outboxes[shard]['spends'] += 1
+
+    def add_remote(self, firm, code):
+        self.remote_slots[code] = len(self.remote_staff)
+        self.remote_staff.append(firm)
+        self.remote_codes.append(code)
+
+    def remove_remote(self, code):
+        '''
+        Swap-remove an employee in another shard
+        '''
+        slot = self.remote_slots.pop(code)
+        firm = self.remote_staff.pop()
+        moved = self.remote_codes.pop()
+        if moved != code:
+            self.remote_staff[slot] = firm
+            self.remote_codes[slot] = moved
+            self.remote_slots[moved] = slot
+
+    def remote_revenue(self):
+        '''
+        Revenue draws due at this step for random employees in other
+        shards, len(remote_staff) per N steps. Returns their revenue.
+        '''
+        revenue = 0
+        self.revenue_credit += len(self.remote_staff) / self.N
+        while self.revenue_credit >= 1:
+            self.revenue_credit -= 1
+            if not self.remote_staff:
+                break
+            firm = self.remote_staff[int(random.random() * len(self.remote_staff))]
+            random_revenue = self.random_revenue()
+            self.add_coins(firm, random_revenue)
+            self.index_actor(firm)
+            self.market_value -= random_revenue
+            revenue += random_revenue
+        return revenue
+
+    def market_sample_rule(self, id):
+        '''
+        Random firm revenue M1, plus the revenue drawn at this step for
+        employees in other shards. An actor employed in another shard draws
+        nothing here. Returns Revenue.
+        '''
+        revenue = self.remote_revenue()
+        if self.employer[id] >= self.N:
+            return revenue
+        return revenue + super().market_sample_rule(id)
+
+    def firing_rule(self, id):
+        '''
+        Fire based on max money. Employees in other shards are told at the
+        next sync. Returns if firm is bankrupt.
+        '''
+        size = self.firm_size[id]
+        if size == 0:
+            return False
+
+        u = math.ceil(size - (self.coins[id] / self.wage_avg))
+        if u <= 0:
+            return False
+
+        for employee in self.roster.fire(id, u):
+            if employee >= 0:
+                self.employer[employee] = -1
+                self.index_actor(employee)
+            else:
+                self.remove_remote(employee)
+                (shard, local) = self.remote_actor(employee)
+                self.outboxes[shard]['fired'].append(local)
+
+        return bool(self.firm_size[id] == 0)
+
+    def wage_payment_rule(self, id):
+        '''
+        Pay wages to all employees. Wages of employees in other shards are
+        sent at the next sync. Return total wage bill
+        '''
+        employees = self.roster.employees(id)
+        if employees is None:
+            return 0
+
+        wages = payroll(float(self.coins[id]), len(employees), self.random_wage())
+        local = employees >= 0
+        self.coins[employees[local]] += wages[local]
+        self.yearly_income[employees[local]] += wages[local]
+
+        if not local.all():
+            for code, wage in zip(employees[~local].tolist(),
+                                  wages[~local].tolist()):
+                (shard, employee) = self.remote_actor(code)
+                self.outboxes[shard]['wages'].append((employee, wage))
+
+        wage_bill = int(wages.sum())
+        self.coins[id] -= wage_bill
+        self.index_actor(id)
+
+        return wage_bill
+
+    def batched_month(self, steps=None):
+        '''
+        ArrayWorld.batched_month for steps steps (default N), with the
+        cross-shard hires, spends, revenue draws, firings and wages of the
+        rule methods. Returns [firm demises, revenue, wage bill].
+        '''
+        N = self.N
+        steps = N if steps is None else steps
+        wage_avg = self.wage_avg
+        batch_size = self.payroll_batch_size
+        index = self.employer_index
+        update = index.update
+        find = index.find
+
+        coins = self.coins.tolist()
+        income = self.yearly_income.tolist()
+        employer = self.employer.tolist()
+        size = self.firm_size.tolist()
+        if self.staffs is None:
+            self.staffs = {firm: self.roster.employees(firm).tolist()
+                           for firm in self.roster.buffers}
+        staffs = self.staffs
+        market_value = self.market_value
+
+        # Other shards' potential employer coins as of the last sync, and
+        # the actors of every shard
+        others = self.weights.copy()
+        others[self.shard] = 0
+        remote_weight = float(others.sum())
+        weight_bounds = np.cumsum(others).tolist()
+        population_bounds = self.population_bounds
+        population = population_bounds[-1]
+        (here, shards) = (self.shard, self.shards)
+        outboxes = self.outboxes
+        remote_employer = self.remote_employer
+        remote_staff = self.remote_staff
+        remote_actor = self.remote_actor
+        remove_remote = self.remove_remote
+
+        picks = normal_ints(0, N - 1, size=3 * steps).tolist()
+        (actors, partners) = (picks[:steps], picks[steps:2 * steps])
+        spenders = iter(picks[2 * steps:])
+        wages = iter(normal_ints(self.wa, self.wb, size=steps).tolist())
+        hire_uniforms = np.random.random(steps).tolist()
+        spend_shards = np.searchsorted(population_bounds,
+                                       np.random.random(steps) * population,
+                                       side='right').tolist()
+        staff_uniforms = iter(np.random.random(steps).tolist())
+        draw = pre_drawn_normal_int(5 * steps)
+
+        remote_spends = self.remote_spends
+        spend_rate = self.spend_rate
+        spend_credit = self.spend_credit
+        revenue_credit = self.revenue_credit
+
+        firm_demise_counter = 0
+        revenue_counter = 0
+        total_wage_bill = 0
+
+        for step in range(steps):
+            id = actors[step]
+
+            # Hiring, by an employer of any shard
+            if employer[id] < 0 and size[id] == 0:
+                value = hire_uniforms[step] * (index.total + remote_weight)
+                if value < index.total:
+                    boss = find(value)
+                    if boss is not None and boss != id and coins[boss] > wage_avg:
+                        staff = staffs.get(boss)
+                        if staff is None:
+                            staffs[boss] = [id]
+                        else:
+                            staff.append(id)
+                        size[boss] += 1
+                        employer[id] = boss
+                        update(id, 0)
+                elif remote_weight > 0:
+                    shard = bisect_right(weight_bounds, value - index.total)
+                    if shard < shards:
+                        employer[id] = N + id
+                        remote_employer[id] = (shard, None)
+                        outboxes[shard]['hires'].append(id)
+                        update(id, 0)
+
+            # Spends of other shards' steps due by now
+            spend_credit += spend_rate
+            while spend_credit >= 1 and remote_spends:
+                spend_credit -= 1
+                remote_spends -= 1
+                b = next(spenders, None)
+                if b is None:
+                    b = normal_int(0, N - 1)
+                if coins[b] > 0:
+                    exp = draw(0, math.floor(coins[b]))
+                    coins[b] -= exp
+                    market_value += exp
+                update(b, coins[b] if employer[b] < 0 or size[b] > 0 else 0)
+
+            # Expenditure, by an actor of any shard
+            shard = spend_shards[step]
+            if shard == here:
+                b = partners[step]
+                while b == id:
+                    b = normal_int(0, N - 1)
+                if coins[b] > 0:
+                    exp = draw(0, math.floor(coins[b]))
+                    coins[b] -= exp
+                    market_value += exp
+                update(b, coins[b] if employer[b] < 0 or size[b] > 0 else 0)
+            else:
+                outboxes[shard]['spends'] += 1
+
+            # Revenue drawn for employees in other shards
+            revenue_credit += len(remote_staff) / N
+            while revenue_credit >= 1 and remote_staff:
+                revenue_credit -= 1
+                u = next(staff_uniforms, None)
+                if u is None:
+                    u = random.random()
+                boss = remote_staff[int(u * len(remote_staff))]
+                revenue = draw(0, market_value)
+                coins[boss] += revenue
+                income[boss] += revenue
+                update(boss, coins[boss])
+                market_value -= revenue
+                revenue_counter += revenue
+
+            # Market sample, unless employed in another shard
+            boss = employer[id]
+            if 0 <= boss < N:
+                revenue = draw(0, market_value)
+                coins[boss] += revenue
+                income[boss] += revenue
+                update(boss, coins[boss] if employer[boss] < 0 or size[boss] > 0 else 0)
+                market_value -= revenue
+                revenue_counter += revenue
+
+            if size[id] == 0:
+                continue
+            staff = staffs[id]
+
+            # Firing, told to other shards at the next sync
+            u = math.ceil(size[id] - coins[id] / wage_avg)
+            if u > 0:
+                for i in range(min(u, size[id])):
+                    slot = draw(0, len(staff) - 1)
+                    fired = staff[slot]
+                    staff[slot] = staff[-1]
+                    staff.pop()
+                    if fired >= 0:
+                        employer[fired] = -1
+                        update(fired, coins[fired])
+                    else:
+                        remove_remote(fired)
+                        (shard, local) = remote_actor(fired)
+                        outboxes[shard]['fired'].append(local)
+                size[id] = len(staff)
+                if not staff:
+                    del staffs[id]
+                    firm_demise_counter += 1
+                    continue
+
+            # Wage payment, sent to other shards at the next sync
+            wage = next(wages, None)
+            if wage is None:
+                wage = self.random_wage()
+            if len(staff) >= batch_size:
+                paid = payroll(coins[id], len(staff), wage).tolist()
+            else:
+                paid = []
+                left = coins[id]
+                for i in staff:
+                    if left - wage < 0:
+                        wage = draw(0, math.floor(left)) if left > 0 else 0
+                    left -= wage
+                    paid.append(wage)
+
+            for i, wage in zip(staff, paid):
+                if i >= 0:
+                    coins[i] += wage
+                    income[i] += wage
+                else:
+                    (shard, local) = remote_actor(i)
+                    outboxes[shard]['wages'].append((local, wage))
+            wage_bill = sum(paid)
+            coins[id] -= wage_bill
+            update(id, coins[id])
+            total_wage_bill += wage_bill
+
+        self.coins[:] = coins
+        self.yearly_income[:] = income
+        self.employer[:] = employer
+        self.firm_size[:] = size
+        self.market_value = market_value
+        self.remote_spends = remote_spends
+        self.spend_credit = spend_credit
+        self.revenue_credit = revenue_credit
+
+        return [firm_demise_counter, revenue_counter, total_wage_bill]
+
+    def close_staffs(self):
+        '''
+        Move the employee lists of batched parts back into the roster
+        '''
+        if self.staffs is not None:
+            self.roster.buffers = {firm: np.array(staff, dtype=np.int64)
+                                   for firm, staff in self.staffs.items()}
+            self.staffs = None
+
+    def add_employee(self, firm, code):
+        '''
+        Add an employee to a firm, in the roster or in the lists of batched
+        parts
+        '''
+        if self.staffs is None:
+            self.roster.add(firm, code)
+            return
+
+        staff = self.staffs.get(firm)
+        if staff is None:
+            self.staffs[firm] = [code]
+        else:
+            staff.append(code)
+        self.firm_size[firm] += 1
+
+    def one_month_rule(self):
+        '''
+        Excecute simulation N times, with a sync after every part of the
+        month when sync_interval is a fraction of a month, or at the end of
+        every sync_interval months. There is always a sync at the end of a
+        year, so that no wages are in transit when the years are merged.
+        '''
+        syncs = max(1, round(1 / self.sync_interval))
+        steps = np.linspace(0, self.N, syncs + 1).astype(int)
+
+        firm_demise_counter = 0
+        revenue_counter = 0
+        total_wage_bill = 0
+
+        for part in np.diff(steps).tolist():
+            if self.batched_months:
+                [firm_demises, revenue, wage_bill] = self.batched_month(part)
+                firm_demise_counter += firm_demises
+                revenue_counter += revenue
+                total_wage_bill += wage_bill
+            else:
+                for i in range(part):
+                    [firm_demise, revenue, wage_bill] = self.simulation_rule()
+
+                    revenue_counter += revenue
+                    total_wage_bill += wage_bill
+
+                    if firm_demise:
+                        firm_demise_counter += 1
+
+            if syncs > 1:
+                self.sync()
+
+        self.close_staffs()
+        self.rebuild_employer_index()
+        self.analyzer.firm_size_measure_arrays(self.firm_size)
+
+        self.months += 1
+        if syncs == 1 and (self.months % round(self.sync_interval) == 0 or
+                           self.months % 12 == 0):
+            self.sync()
+
+        return [firm_demise_counter, revenue_counter, total_wage_bill]
+
+    def exchange(self, empty):
+        '''
+        Send the outbox entries named in empty to every other shard, and
+        reset them to empty. Returns the received (shard, entries) in shard
+        order.
+        '''
+        for shard, inbox in enumerate(self.inboxes):
+            if shard != self.shard:
+                outbox = self.outboxes[shard]
+                inbox.put((self.shard, {key: outbox[key] for key in empty}))
+                outbox.update(copy.deepcopy(empty))
+        self.barrier.wait()
+
+        received = sorted((self.inboxes[self.shard].get()
+                           for shard in range(self.shards - 1)),
+                          key=lambda message: message[0])
+
+        # Nobody sends again before everyone has received
+        self.barrier.wait()
+        return received
+
+    def sync(self):
+        '''
+        Settle the cross-shard steps since the last sync, then pool the
+        market values and publish the potential employer coins
+        '''
+        received = self.exchange(OUTBOX)
+        for shard, entries in received:
+            for (employee, wage) in entries['wages']:
+                self.add_coins(employee, wage)
+                self.index_actor(employee)
+            for employee in entries['fired']:
+                del self.remote_employer[employee]
+                self.employer[employee] = -1
+                self.index_actor(employee)
+            self.remote_spends += entries['spends']
+
+        self.spend_rate = self.remote_spends / (self.N * self.sync_interval)
+        self.spend_credit = 0.0
+
+        # Hires once the coins have arrived, as hiring_rule would
+        for shard, entries in received:
+            for employee in entries['hires']:
+                employer = self.select_employer()
+                if employer is not None and self.coins[employer] > self.wage_avg:
+                    code = self.remote_code(shard, employee)
+                    self.add_employee(employer, code)
+                    self.add_remote(employer, code)
+                    self.index_actor(employer)
+                    self.outboxes[shard]['hired'].append((employee, employer))
+                else:
+                    self.outboxes[shard]['rejected'].append(employee)
+
+        for shard, entries in self.exchange(ANSWERS):
+            for (employee, employer) in entries['hired']:
+                self.remote_employer[employee] = (shard, employer)
+            for employee in entries['rejected']:
+                del self.remote_employer[employee]
+                self.employer[employee] = -1
+                self.index_actor(employee)
+
+        self.sync_market()
+
+    def sync_market(self):
+        '''
+        Pool market values in shared memory and take this shard's share,
+        and publish this shard's potential employer coins
+        '''
+        self.market[self.shard] = self.market_value
+        self.employed[self.shard] = self.firm_size.sum()
+        self.weights[self.shard] = self.employer_index.total
+        self.barrier.wait()
+
+        shares = market_shares(int(self.market.sum()), self.employed)
+        self.market_value = int(shares[self.shard])
+
+        # Nobody writes again before everyone has read
+        self.barrier.wait()
+
+
+def run_shard(shard, N, M, wa, wb, seed, market, employed, weights,
+              populations, inboxes, barrier, sync_interval, history, connection):
+    '''
+    Worker process: run years on request, answering with the new history
+    '''
+    try:
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+
+        market = np.frombuffer(market, dtype=np.float64)
+        employed = np.frombuffer(employed, dtype=np.float64)
+        weights = np.frombuffer(weights, dtype=np.float64)
+        world = ShardWorld(shard, N, M, wa, wb, market, employed, weights,
+                           populations, inboxes, barrier, sync_interval, history)
+        analyzer = world.analyzer
+
+        while True:
+            command, years = connection.recv()
+            if command == 'stop':
+                break
+
+            (year, month) = (len(analyzer.class_measures),
+                             len(analyzer.firm_demises))
+            start = time.process_time()
+            for i in range(years):
+                world.one_year_rule()
+            seconds = time.process_time() - start
+
+            connection.send(('ok', {
+                'class_measures': analyzer.class_measures[year:],
+                'revenues': analyzer.revenues[year:],
+                'wage_bills': analyzer.wage_bills[year:],
+                'firm_size_counts': analyzer.firm_size_counts[month:],
+                'firm_demises': analyzer.firm_demises[month:],
+                'rows': analyzer.rows,
+                'coins': world.coins,
+                'market_value': world.market_value,
+                'seconds': seconds,
+            }))
+            analyzer.rows = []
+
+    except Exception:
+        barrier.abort()
+        connection.send(('error', traceback.format_exc()))
+
+
+class ShardedWorld:
+    def __init__(self, N, M, wa=None, wb=None, shards=None, partition='random',
+                 sync_interval=0.25, seed=0, history=True, analyzer=None):
+        '''
+        N actors split into shards worker processes (default: one per CPU).
+        Shards sync every sync_interval months, a whole number of months or
+        a fraction 1 / k of a month. history=False keeps
+        only yearly and monthly series, not per actor rows.
+        '''
+        self.N = N
+        self.Money = M
+        self.shards = shards or os.cpu_count() or 1
+        self.sync_interval = sync_interval
+        self.history = history
+        self.analyzer = Analyzer(N) if analyzer is None else analyzer
+
+        # CPU seconds of the yearly runs of every shard
+        self.shard_seconds = np.zeros(self.shards)
+
+        self.parts = partition_actors(N, self.shards, partition, seed)
+        self.coins = np.full(N, M / N, dtype=np.float64)
+        self.market_value = 0
+
+        context = multiprocessing.get_context()
+        populations = [len(ids) for ids in self.parts]
+        market = context.RawArray('d', self.shards)
+        employed = context.RawArray('d', self.shards)
+        weights = context.RawArray('d', [M * n / N for n in populations])
+        inboxes = [context.Queue() for shard in range(self.shards)]
+        barrier = context.Barrier(self.shards)
+
+        self.connections = []
+        self.workers = []
+        seeds = replica_seeds(seed, self.shards)
+        for shard, ids in enumerate(self.parts):
+            (parent, child) = context.Pipe()
+            worker = context.Process(target=run_shard, daemon=True, args=(
+                shard, len(ids), M * len(ids) / N, wa, wb, seeds[shard],
+                market, employed, weights, populations, inboxes, barrier,
+                sync_interval, history, child))
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Stop the worker processes
+        '''
+        for connection in self.connections:
+            try:
+                connection.send(('stop', 0))
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.join()
+        self.connections = []
+        self.workers = []
+
+    def run_sim(self, years, verbose=True):
+        '''
+        Run all shards for years and merge their history into the analyzer
+        '''
+        if verbose:
+            print(f'Starting sharded simulation for {years} years '
+                  f'on {self.shards} shards')
+        for connection in self.connections:
+            connection.send(('run', years))
+
+        results = []
+        for connection in self.connections:
+            status, result = connection.recv()
+            if status == 'error':
+                self.close()
+                raise RuntimeError(f'shard failed:\n{result}')
+            results.append(result)
+
+        self.merge(results)
+
+        if verbose:
+            print('Doing futher analysis (GDP, ...)')
+        self.analyzer.gdp_growth_measures()
+
+    def merge(self, results):
+        '''
+        Fold the shards' new years into the analyzer, in global actor order
+        '''
+        analyzer = self.analyzer
+
+        for ids, result in zip(self.parts, results):
+            self.coins[ids] = result['coins']
+        self.market_value = sum(r['market_value'] for r in results)
+        self.shard_seconds += [r['seconds'] for r in results]
+
+        for counts in zip(*(r['firm_size_counts'] for r in results)):
+            total = np.zeros(max(len(c) for c in counts), dtype=np.int64)
+            for c in counts:
+                total[:len(c)] += c
+            analyzer.firm_size_counts.append(total)
+        for demises in zip(*(r['firm_demises'] for r in results)):
+            analyzer.firm_demise_measure(sum(demises))
+
+        years = len(results[0]['revenues'])
+        if self.history:
+            analyzer.reserve(analyzer.years + years)
+
+        for year in range(years):
+            analyzer.add_yearly_revenue(sum(r['revenues'][year] for r in results))
+            analyzer.add_yearly_wage_bill(
+                sum(r['wage_bills'][year] for r in results))
+
+            if not self.history:
+                analyzer.class_measures.append(
+                    np.sum([r['class_measures'][year] for r in results],
+                           axis=0).tolist())
+                continue
+
+            labels = np.zeros(self.N, dtype=np.int8)
+            incomes = np.zeros(self.N)
+            wealths = np.zeros(self.N)
+            for ids, result in zip(self.parts, results):
+                (labels[ids], incomes[ids], wealths[ids]) = result['rows'][year]
+            analyzer.store_classes(labels)
+            analyzer.store_incomes_and_wealths(incomes, wealths)
+
+
+def engine_statistics(analyzer, wealths, N, seconds):
+    '''
+    Equilibrium statistics of a run, averaged over its second half
+    '''
+    half = len(analyzer.class_measures) // 2
+    classes = np.asarray(analyzer.class_measures[half:], dtype=np.float64)
+    revenues = np.asarray(analyzer.revenues[half:], dtype=np.float64)
+    wages = np.asarray(analyzer.wage_bills[half:], dtype=np.float64)
+    sizes = analyzer.firm_size_distribution()
+    firms = max(sizes.sum(), 1)
+    months = max(len(analyzer.firm_demises), 1)
+
+    wealths = np.sort(wealths)
+    top = wealths[int(0.9 * len(wealths)):].sum() / max(wealths.sum(), 1)
+
+    return {
+        'unemployed_share': float(classes[:, UNEMPLOYED].mean() / N),
+        'worker_share': float(classes[:, WORKER].mean() / N),
+        'capitalist_share': float(classes[:, CAPITALIST].mean() / N),
+        'wage_share': float((wages / np.where(revenues > 0, revenues, 1)).mean()),
+        'revenue_per_actor': float(revenues.mean() / N),
+        'mean_firm_size': float(np.dot(np.arange(len(sizes)), sizes) / firms),
+        'firm_demises_per_month': float(sum(analyzer.firm_demises) / months),
+        'wealth_gini': gini(wealths),
+        'top_decile_wealth_share': float(top),
+        'seconds': seconds,
+    }
+
+
+def compare_engines(N, M, years, shards=None, partition='random',
+                    sync_interval=0.25, seed=0, wa=None, wb=None):
+    '''
+    Run the single-process ArrayWorld and a ShardedWorld with the same
+    parameters. Returns their statistics, sharded minus single, and the
+    speedup of sharding: the CPU seconds of the single run over those of
+    the slowest shard, which is the wall time with a core per shard.
+    '''
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    world = run_world(N, M, years, seed, 'array', wa, wb)
+    single = engine_statistics(world.analyzer, world.coins, N,
+                               time.perf_counter() - start)
+    single['cpu_seconds'] = time.process_time() - cpu_start
+
+    start = time.perf_counter()
+    with ShardedWorld(N, M, wa, wb, shards, partition, sync_interval, seed,
+                      history=False) as sharded_world:
+        sharded_world.run_sim(years, verbose=False)
+    sharded = engine_statistics(sharded_world.analyzer, sharded_world.coins, N,
+                                time.perf_counter() - start)
+    sharded['cpu_seconds'] = float(sharded_world.shard_seconds.max())
+
+    return {
+        'single': single,
+        'sharded': sharded,
+        'difference': {k: sharded[k] - single[k] for k in single},
+        'speedup': single['cpu_seconds'] / sharded['cpu_seconds'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the sharded and single-process engines.')
+    parser.add_argument('--N', type=int, default=100_000)
+    parser.add_argument('--M', type=int, default=None,
+                        help='total money (default 100 per actor)')
+    parser.add_argument('--years', type=int, default=20)
+    parser.add_argument('--shards', type=int, default=None)
+    parser.add_argument('--partition', choices=PARTITIONS, default='random')
+    parser.add_argument('--sync-interval', type=float, default=0.25,
+                        help='months between syncs, or a fraction of a month '
+                             'for several syncs a month')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    M = 100 * args.N if args.M is None else args.M
+    report = compare_engines(args.N, M, args.years, args.shards, args.partition,
+                             args.sync_interval, args.seed)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
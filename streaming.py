@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Constant-memory Analyzer for long runs.
+
+StreamingAnalyzer keeps no per-year, per-actor history. Each year it folds
+incomes and wealths into fixed histograms and t-digest quantile sketches,
+and records Gini, entropy and class counts as yearly summary numbers. Memory
+does not grow with N x years.
+"""
+
+# External (matplotlib is imported only to plot)
+import numpy as np
+
+# Built-int
+import math
+
+# Froms
+from main import Analyzer, entropy, UNEMPLOYED, WORKER, CAPITALIST
+
+
+CLASSES = {
+    'unemployed': UNEMPLOYED,
+    'worker': WORKER,
+    'capitalist': CAPITALIST,
+}
+
+
+def log_bins(lo=0.1, hi=1e9, per_decade=20):
+    '''
+    Bin edges [0, lo, ..., hi] spaced evenly in log scale
+    '''
+    decades = math.log10(hi / lo)
+    return np.concatenate(([0], np.logspace(
+        math.log10(lo), math.log10(hi), int(decades * per_decade) + 1)))
+
+
+def linear_bins(hi, classes=100):
+    '''
+    Bin edges as used by entropy_analysis: classes steps up to hi
+    '''
+    return np.arange(0, math.ceil(hi) + 1, math.ceil(hi / classes))
+
+
+def gini(values):
+    '''
+    Gini coefficient of non-negative values
+    '''
+    x = np.sort(values)
+    n = len(x)
+    total = x.sum()
+    if n == 0 or total == 0:
+        return 0.0
+    return float(2 * np.dot(np.arange(1, n + 1), x) / (n * total) - (n + 1) / n)
+
+
+class Histogram:
+    def __init__(self, edges):
+        '''
+        Counts on fixed bin edges. The last bin holds everything from the last edge up.
+        '''
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges), dtype=np.int64)
+        self.underflow = 0
+
+    def add(self, values):
+        index = np.searchsorted(self.edges, values, side='right') - 1
+        below = index < 0
+        self.underflow += int(np.count_nonzero(below))
+        self.counts += np.bincount(index[~below], minlength=len(self.counts))
+
+    @property
+    def total(self):
+        return int(self.counts.sum()) + self.underflow
+
+    def ccdf(self):
+        '''
+        Bin edges and the number of values at or above each edge
+        '''
+        return self.edges, np.cumsum(self.counts[::-1])[::-1]
+
+
+class TDigest:
+    def __init__(self, compression=200):
+        '''
+        Mergeable quantile sketch with at most about compression centroids
+        '''
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+
+    def add(self, values):
+        '''
+        Merge a batch of values, then recompress centroids on the k1 scale
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        means = np.concatenate((self.means, values))
+        weights = np.concatenate((self.weights, np.ones(len(values))))
+        order = np.argsort(means, kind='stable')
+        means = means[order]
+        weights = weights[order]
+
+        # Quantile at the middle of every centroid, mapped to k1 scale
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / cumulative[-1]
+        k = self.compression * (np.arcsin(2 * q - 1) / np.pi + 0.5)
+        group = np.minimum(k.astype(np.int64), self.compression - 1)
+
+        w = np.bincount(group, weights)
+        m = np.bincount(group, weights * means)
+        keep = w > 0
+        self.weights = w[keep]
+        self.means = m[keep] / self.weights
+
+    def quantile(self, q):
+        '''
+        Approximate quantile(s), interpolating between centroid midpoints
+        '''
+        if len(self.weights) == 0:
+            return np.full(np.shape(q), np.nan)
+
+        cumulative = np.cumsum(self.weights)
+        midpoints = (cumulative - self.weights / 2) / cumulative[-1]
+        return np.interp(q, midpoints, self.means)
+
+
+class NotKept:
+    def __init__(self, name):
+        '''
+        Stand-in for per-actor history that a StreamingAnalyzer does not keep
+        '''
+        self.name = name
+
+    def error(self):
+        return ValueError(f'{self.name} is not kept in streaming mode, use '
+                          'ccdf, quantile or the yearly summaries')
+
+    def __len__(self):
+        raise self.error()
+
+    def __getitem__(self, index):
+        raise self.error()
+
+    def __iter__(self):
+        raise self.error()
+
+
+class StreamingAnalyzer(Analyzer):
+    def __init__(self, N=None, wealth_bins=None, income_bins=None,
+                 entropy_caps=(1000, 2000, 5000), compression=200):
+        '''
+        Analyzer that keeps sketches instead of per-actor history.
+        Entropy is tracked for each of entropy_caps. A cap of 0, the max
+        wealth of the whole history in Analyzer.entropy_analysis, is not
+        known until the run ends, so caps must be given explicitly.
+        '''
+        if 0 in entropy_caps:
+            raise ValueError('streaming entropy needs explicit wealth caps: '
+                             'the max wealth of the history is not known yet')
+        super().__init__()
+        self.N = N
+
+        wealth_bins = log_bins() if wealth_bins is None else wealth_bins
+        income_bins = log_bins() if income_bins is None else income_bins
+
+        self.histograms = {'wealths': {}, 'incomes': {}}
+        self.digests = {'wealths': {}, 'incomes': {}}
+        for klass in [None, *CLASSES]:
+            self.histograms['wealths'][klass] = Histogram(wealth_bins)
+            self.histograms['incomes'][klass] = Histogram(income_bins)
+            self.digests['wealths'][klass] = TDigest(compression)
+            self.digests['incomes'][klass] = TDigest(compression)
+
+        # Per actor totals over all years, for aggregated CCDFs
+        self.income_totals = None
+        self.wealth_totals = None
+        self.labels = None
+
+        # Per year summary numbers
+        self.wealth_gini = []
+        self.income_gini = []
+        self.entropies = {cap: [] for cap in entropy_caps}
+
+        # Entropy binned up to each year's own max wealth, for year_entropy
+        self.year_entropies = []
+
+        self.capitalist_incomes = NotKept('capitalist_incomes')
+        self.capitalist_wealths = NotKept('capitalist_wealths')
+        self.worker_incomes = NotKept('worker_incomes')
+        self.worker_wealths = NotKept('worker_wealths')
+
+    def reserve(self, years):
+        '''
+        Nothing to preallocate
+        '''
+
+    def store_classes(self, labels):
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.count_classes(self.labels)
+
+    def store_incomes_and_wealths(self, incomes, wealths):
+        incomes = np.asarray(incomes, dtype=np.float64)
+        wealths = np.asarray(wealths, dtype=np.float64)
+
+        if self.income_totals is None:
+            self.N = len(incomes)
+            self.income_totals = np.zeros(self.N)
+            self.wealth_totals = np.zeros(self.N)
+        self.income_totals += incomes
+        self.wealth_totals += wealths
+
+        for name, values in [('incomes', incomes), ('wealths', wealths)]:
+            self.histograms[name][None].add(values)
+            self.digests[name][None].add(values)
+
+            if self.labels is None:
+                continue
+            for klass, label in CLASSES.items():
+                selected = values[self.labels == label]
+                self.histograms[name][klass].add(selected)
+                self.digests[name][klass].add(selected)
+
+        self.wealth_gini.append(gini(wealths))
+        self.income_gini.append(gini(incomes))
+
+        for cap, series in [(0, self.year_entropies), *self.entropies.items()]:
+            bins = linear_bins(max(wealths.max(), 1) if cap == 0 else cap)
+            (h, _) = np.histogram(wealths, bins=bins)
+            series.append(entropy(self.N, len(bins) - 1, h))
+
+        self.years += 1
+
+    def firm_size_measure(self, actors):
+        super().firm_size_measure(actors)
+        self.merge_firm_sizes()
+
+    def firm_size_measure_arrays(self, firm_size):
+        super().firm_size_measure_arrays(firm_size)
+        self.merge_firm_sizes()
+
+    def merge_firm_sizes(self):
+        '''
+        Fold the month just measured into one running firm size histogram
+        '''
+        if len(self.firm_size_counts) < 2:
+            return
+
+        counts = self.firm_size_counts.pop()
+        total = self.firm_size_counts[0]
+        if len(counts) > len(total):
+            counts[:len(total)] += total
+            total = counts
+        else:
+            total[:len(counts)] += counts
+        self.firm_size_counts[0] = total
+
+    def ccdf(self, metric='incomes', klass=None, years=None, bins=None):
+        '''
+        Bin edges and counts at or above each edge, pooled over all years.
+        klass is None, 'unemployed', 'worker' or 'capitalist'. Year ranges
+        and other bins are not kept: the sketches pool all years on the
+        bins given at construction.
+        '''
+        if years is not None:
+            raise NotKept('ccdf per year range').error()
+        if bins is not None:
+            raise NotKept(f'ccdf on bins {bins!r}').error()
+        return self.histograms[metric][klass].ccdf()
+
+    def distribution_values(self, metric='incomes', klass=None, years=None):
+        raise NotKept('distribution_values').error()
+
+    def wealth_histograms(self, wealth_cap=0, classes=100):
+        raise NotKept('wealth_histograms').error()
+
+    def commonwealth_series(self, N, classes, wealth_cap=0, mc=None):
+        raise NotKept('commonwealth_series').error()
+
+    def disaggregated_income_analysis_per_year(self, years, step):
+        raise NotKept('disaggregated_income_analysis_per_year').error()
+
+    def quantile(self, q, metric='incomes', klass=None):
+        '''
+        Approximate quantile(s) of a metric pooled over all years
+        '''
+        return self.digests[metric][klass].quantile(q)
+
+    def entropy_analysis(self, N, wealth_cap=0, plot=False):
+        '''
+        Entropy per year with bins up to wealth_cap, one of entropy_caps
+        '''
+        if wealth_cap not in self.entropies:
+            raise ValueError(
+                f'entropy for wealth_cap={wealth_cap} was not tracked, '
+                f'use one of {list(self.entropies)}')
+
+        entropy_evolution = list(self.entropies[wealth_cap])
+        if plot:
+            import matplotlib.pyplot as plt
+            plt.plot(range(len(entropy_evolution)), entropy_evolution)
+            plt.show()
+
+        return entropy_evolution
+
+    def year_entropy(self, wealth_cap=0, classes=100):
+        if wealth_cap == 0:
+            return self.year_entropies[-1]
+        if wealth_cap not in self.entropies:
+            raise ValueError(
+                f'entropy for wealth_cap={wealth_cap} was not tracked, '
+                f'use one of {list(self.entropies)}')
+        return self.entropies[wealth_cap][-1]
+
+    def aggregated_analysis(self, totals, metric):
+        import matplotlib.pyplot as plt
+
+        figure, axis = plt.subplots(1, 2)
+
+        # Plot ccdf of per actor totals in log-log scale
+        values = np.sort(totals)
+        axis[0].set_xscale('log')
+        axis[0].set_yscale('log')
+        axis[0].plot(values, len(values) - np.arange(len(values)), c='green')
+
+        # Plot ccdf by class in log-log scale
+        axis[1].set_xscale('log')
+        axis[1].set_yscale('log')
+        for klass, c in [('capitalist', 'green'), ('worker', 'blue')]:
+            edges, counts = self.ccdf(metric, klass)
+            axis[1].plot(edges, counts, c=c)
+
+        plt.show()
+
+    def aggregated_income_analysis(self):
+        self.aggregated_analysis(self.income_totals, 'incomes')
+
+    def aggregated_wealth_analysis(self):
+        self.aggregated_analysis(self.wealth_totals, 'wealths')
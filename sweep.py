@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps over N, M, wage bounds wa/wb and the commonwealth constant mc.
+
+Every run is stored in an on-disk cache keyed by a hash of its parameters,
+seed, length and the source of the model and engine, so finished runs are
+never repeated and an interrupted sweep resumes where it stopped.
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import hashlib
+import json
+import os
+import sys
+
+# Froms
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import product
+from ensemble import ENGINES, compact_results, run_world
+import ensemble
+import main
+
+
+DEFAULTS = {
+    'N': 1_000,
+    'M': 100_000,
+    'wa': main.MaterialWorld.wa,
+    'wb': main.MaterialWorld.wb,
+    'mc': main.mc,
+}
+
+# Commonwealth wealth classes
+CLASSES = 20
+
+
+def code_version(engine='material'):
+    '''
+    Hash of the source of the model, the engine's module and the code that
+    runs it, so cached runs expire when any of them changes
+    '''
+    modules = [main, ensemble, sys.modules[__name__],
+               sys.modules[ENGINES[engine].__module__]]
+
+    digest = hashlib.sha256()
+    for file in sorted({module.__file__ for module in modules}):
+        with open(file, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def grid_points(grid):
+    '''
+    Every combination of a {name: values} grid, completed with defaults
+    '''
+    names = list(grid)
+    points = []
+    for values in product(*(grid[name] for name in names)):
+        params = dict(DEFAULTS)
+        params.update(zip(names, values))
+        points.append(params)
+    return points
+
+
+def run_key(params, seed, years, engine, version):
+    '''
+    Content address of one run
+    '''
+    content = json.dumps({'params': params, 'seed': seed, 'years': years,
+                          'engine': engine, 'version': version}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def run_point(params, seed, years, engine):
+    '''
+    Run one grid point. Returns compact results plus the commonwealth series.
+    '''
+    world = run_world(params['N'], params['M'], years, seed, engine,
+                      params['wa'], params['wb'])
+
+    results = compact_results(world.analyzer)
+    results['commonwealths'] = np.asarray(world.analyzer.commonwealth_series(
+        params['N'], CLASSES, mc=params['mc']))
+    return results
+
+
+class ResultCache:
+    def __init__(self, path='.sweep-cache'):
+        '''
+        Directory of .npz run results named by run key
+        '''
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.file(key))
+
+    def load(self, key):
+        with np.load(self.file(key)) as data:
+            return {name: data[name] for name in data.files}
+
+    def store(self, key, results):
+        '''
+        Write atomically, so an interrupted sweep never leaves a partial entry
+        '''
+        tmp = self.file(key) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, **results)
+        os.replace(tmp, self.file(key))
+
+
+def sweep(grid, seeds, years, engine='material', cache='.sweep-cache', processes=None):
+    '''
+    Run every grid point for every seed, skipping cached runs.
+    Yields (params, seed, results) as runs finish, cached ones first.
+    '''
+    if not isinstance(cache, ResultCache):
+        cache = ResultCache(cache)
+    version = code_version(engine)
+
+    pending = {}
+    for params in grid_points(grid):
+        for seed in seeds:
+            key = run_key(params, seed, years, engine, version)
+            if key in cache:
+                yield params, seed, cache.load(key)
+            else:
+                pending[key] = (params, seed)
+
+    if not pending:
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(run_point, params, seed, years, engine): key
+                   for key, (params, seed) in pending.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            results = future.result()
+            cache.store(key, results)
+
+            params, seed = pending[key]
+            yield params, seed, results
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Analyzer history storage and the analyses derived from it.
+
+    python -m pytest test_analyzer.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import random
+
+# Froms
+from main import (Analyzer, DerivedCache, MaterialWorld, ArrayWorld,
+                  EquilibriumDetector, UNEMPLOYED, WORKER, CAPITALIST,
+                  entropy, commonwealth_function)
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def synthetic_years(analyzer, years, N, seed=0):
+    '''
+    Store years of random classes, incomes and wealths. Returns them.
+    '''
+    rng = np.random.default_rng(seed)
+    history = []
+    for year in range(years):
+        labels = rng.integers(0, 3, N).astype(np.int8)
+        incomes = rng.lognormal(6, 1, N)
+        wealths = rng.lognormal(4, 1, N)
+        analyzer.store_classes(labels)
+        analyzer.store_incomes_and_wealths(incomes, wealths)
+        history.append((labels, incomes, wealths))
+    return history
+
+
+def test_history_grows_past_reserved_rows():
+    analyzer = Analyzer()
+    history = synthetic_years(analyzer, 7, 50)
+
+    assert analyzer.N == 50 and analyzer.years == 7
+    assert len(analyzer.incomes) >= 7
+    assert analyzer.actor_wealths.shape == (7, 50)
+    for year, (labels, incomes, wealths) in enumerate(history):
+        np.testing.assert_array_equal(analyzer.actor_classes[year], labels)
+        np.testing.assert_array_equal(analyzer.actor_incomes[year], incomes)
+        np.testing.assert_array_equal(analyzer.capitalist_wealths[year],
+                                      wealths[labels == CAPITALIST])
+        np.testing.assert_array_equal(analyzer.worker_incomes[year],
+                                      incomes[labels == WORKER])
+        assert analyzer.class_measures[year][:3] == [
+            int(np.sum(labels == label))
+            for label in (UNEMPLOYED, WORKER, CAPITALIST)]
+    assert len(analyzer.capitalist_incomes) == 7
+
+
+def test_firm_sizes_rebuilt_from_monthly_counts():
+    seeded(0)
+    world = MaterialWorld(100, 10_000)
+    sizes = []
+    for month in range(3):
+        world.one_month_rule()
+        sizes += [len(a.employees) for a in world.actors if a.is_employer()]
+
+    analyzer = world.analyzer
+    assert sorted(analyzer.firm_sizes.tolist()) == sorted(sizes)
+    assert analyzer.firm_size_distribution().sum() == len(sizes)
+
+
+@pytest.mark.parametrize('wealth_cap', [0, 150])
+def test_histograms_match_numpy(wealth_cap):
+    analyzer = Analyzer()
+    history = synthetic_years(analyzer, 5, 400, seed=1)
+    (edges, counts, sums) = analyzer.wealth_histograms(wealth_cap, 100)
+
+    for year, (_, _, wealths) in enumerate(history):
+        (reference, _) = np.histogram(wealths, bins=edges)
+        np.testing.assert_array_equal(counts[year], reference)
+        assert analyzer.entropy_analysis(400, wealth_cap)[year] == pytest.approx(
+            entropy(400, 100, reference))
+
+        # Capped wealths fall out of the commonwealth like out of the bins
+        inside = wealths[wealths <= edges[-1]]
+        np.testing.assert_allclose(sums[year].sum(), inside.sum())
+        assert analyzer.commonwealth_series(400, 100, wealth_cap)[year] == \
+            pytest.approx(commonwealth_function(400, 100, reference, inside))
+
+
+class YearlySeries:
+    '''
+    The yearly measures an EquilibriumDetector reads, from given series
+    '''
+    def __init__(self):
+        self.class_measures = []
+        self.revenues = []
+        self.wage_bills = []
+        self.entropies = []
+
+    def add(self, shares, entropy, wage_share):
+        self.class_measures.append([int(1000 * s) for s in shares] + [0])
+        self.revenues.append(1000.0)
+        self.wage_bills.append(1000.0 * wage_share)
+        self.entropies.append(entropy)
+
+    def year_entropy(self):
+        return self.entropies[-1]
+
+
+def test_detector_finds_stationary_series_not_trends():
+    rng = np.random.default_rng(2)
+    stationary, trend = YearlySeries(), YearlySeries()
+    still = EquilibriumDetector(samples=10, window=10)
+    rising = EquilibriumDetector(samples=10, window=10)
+
+    for year in range(60):
+        noise = rng.normal(0, 0.01, 3)
+        stationary.add([0.1 + noise[0], 0.8, 0.1], 500 + noise[1], 0.6 + noise[2])
+        still.observe(stationary)
+        trend.add([0.1, 0.8, 0.1], 500 + 10 * year + noise[1], 0.6)
+        rising.observe(trend)
+
+    assert still.converged and still.burn_in == 10
+    assert still.equilibrium_years == 50
+    assert rising.burn_in is None and not rising.converged
+
+
+def test_run_stops_once_converged():
+    seeded(3)
+    world = ArrayWorld(100, 10_000)
+    detector = EquilibriumDetector(samples=5, window=5, z=3.0, rtol=0.05)
+    burn_in = world.run_sim(300, verbose=False, convergence=detector)
+
+    years = len(world.analyzer.class_measures)
+    assert burn_in is not None and burn_in == detector.burn_in
+    assert years < 300 and years == burn_in + 5
+
+
+def test_derived_results_cached_until_a_new_year():
+    analyzer = Analyzer()
+    synthetic_years(analyzer, 3, 200)
+    first = analyzer.wealth_histograms(0, 100)
+    assert analyzer.wealth_histograms(0, 100) is first
+    assert analyzer.derived.hits == 1 and analyzer.derived.misses == 1
+
+    # A new year invalidates everything derived from the old history
+    synthetic_years(analyzer, 1, 200, seed=5)
+    (_, counts, _) = analyzer.wealth_histograms(0, 100)
+    assert counts.shape[0] == 4 and analyzer.derived.misses == 2
+
+
+def test_derived_cache_bounded_least_recently_used():
+    cache = DerivedCache(maxsize=2, max_bytes=1000)
+    cache.get('a', lambda: np.zeros(10))
+    cache.get('b', lambda: np.zeros(10))
+    cache.get('a', lambda: None)
+    cache.get('c', lambda: np.zeros(10))
+    assert list(cache.entries) == ['a', 'c']
+
+    # A large result evicts older ones, but is itself kept
+    cache.get('d', lambda: np.zeros(200))
+    assert list(cache.entries) == ['d'] and cache.nbytes == 1600
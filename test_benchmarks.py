@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the benchmark runner.
+
+    python -m pytest test_benchmarks.py
+"""
+
+# External
+import pytest
+
+# Froms
+import benchmarks
+from benchmarks import compare
+
+
+def results(seconds, noise=None):
+    return {'results': seconds, 'noise': noise or {}}
+
+
+def test_compare_flags_slowdowns_beyond_threshold():
+    baseline = results({'a': 1.0, 'b': 1.0, 'c': 1.0})
+    current = results({'a': 1.4, 'b': 1.6, 'c': 0.5, 'new': 9.0})
+    assert [name for name, ratio, limit in
+            compare(current, baseline, 1.5)] == ['b']
+
+
+def test_compare_widens_threshold_for_noisy_benchmarks():
+    baseline = results({'a': 1.0}, {'a': 0.3})
+    assert compare(results({'a': 1.8}), baseline, 1.5) == []
+    assert len(compare(results({'a': 2.0}), baseline, 1.5)) == 1
+
+
+def test_missing_baseline_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmarks, 'run', lambda *args: pytest.fail('ran'))
+    assert benchmarks.main(['--baseline', str(tmp_path / 'none.json'),
+                            '--output', str(tmp_path / 'out.json')]) != 0
+
+
+def test_saved_baseline_passes(tmp_path):
+    (baseline, output) = (str(tmp_path / 'base.json'), str(tmp_path / 'out.json'))
+    options = ['--sizes', '100', '--repeat', '1', '--year-repeat', '1',
+               '--baseline', baseline, '--output', output]
+    assert benchmarks.main(options + ['--save-baseline']) == 0
+    assert benchmarks.main(options + ['--threshold', '1000']) == 0
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoint snapshots and the warm-start library.
+
+    python -m pytest test_checkpoint.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import random
+
+# Froms
+from main import MaterialWorld, ArrayWorld
+import checkpoint
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+@pytest.mark.parametrize('engine', [MaterialWorld, ArrayWorld])
+def test_checkpoint_round_trip(engine, tmp_path):
+    seeded(3)
+    world = engine(200, 20_000)
+    world.run_sim(1, verbose=False)
+
+    path = str(tmp_path / 'snapshot.npz')
+    checkpoint.save(world, path)
+    world.run_sim(1, verbose=False)
+
+    restored = checkpoint.load(path)
+    restored.run_sim(1, verbose=False)
+
+    assert restored.market_value == world.market_value
+    assert restored.analyzer.class_measures == world.analyzer.class_measures
+    assert restored.analyzer.revenues == world.analyzer.revenues
+    if engine is MaterialWorld:
+        assert ([a.coins for a in restored.actors] ==
+                [a.coins for a in world.actors])
+    else:
+        np.testing.assert_array_equal(restored.coins, world.coins)
+        np.testing.assert_array_equal(restored.employer, world.employer)
+
+
+def test_warm_start_is_keyed_by_burn_in_and_leap_size(tmp_path):
+    library = checkpoint.SnapshotLibrary(str(tmp_path))
+    seeded(4)
+    short = library.warm_start(100, 10_000, 'ArrayWorld', burn_in=1)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # A longer burn-in is not served the short one
+    longer = library.warm_start(100, 10_000, 'ArrayWorld', burn_in=2)
+    assert len(list(tmp_path.iterdir())) == 2
+    again = library.warm_start(100, 10_000, 'ArrayWorld', burn_in=2)
+    assert len(list(tmp_path.iterdir())) == 2
+    np.testing.assert_array_equal(again.coins, longer.coins)
+    assert not np.array_equal(short.coins, longer.coins)
+
+    library.warm_start(600, 60_000, 'LeapingWorld', burn_in=1)
+    leaping = library.warm_start(600, 60_000, 'LeapingWorld', burn_in=1,
+                                 leap_size=600)
+    assert leaping.leap_size == 600
+    assert len(list(tmp_path.iterdir())) == 4
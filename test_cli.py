@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Headless runs from the command line.
+
+    python -m pytest test_cli.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import json
+import subprocess
+import sys
+
+# Froms
+import cli
+
+
+def run(tmp_path, capsys, *argv):
+    output = tmp_path / 'run.npz'
+    assert cli.main(['--output', str(output), '--quiet', *argv]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    with np.load(output) as results:
+        return summary, dict(results)
+
+
+def test_headless_run_writes_results(tmp_path, capsys):
+    (summary, results) = run(tmp_path, capsys, '--N', '100', '--M', '10000',
+                             '--years', '3', '--engine', 'array', '--seed', '4')
+
+    assert summary['years'] == 3
+    assert results['class_measures'].shape == (3, 4)
+    assert (results['class_measures'][:, :3].sum(axis=1) == 100).all()
+    assert len(results['revenues']) == 3
+    assert results['final_wealths'].shape == (100,)
+
+    # Seeded runs repeat exactly
+    (_, again) = run(tmp_path, capsys, '--N', '100', '--M', '10000',
+                     '--years', '3', '--engine', 'array', '--seed', '4')
+    for name, series in results.items():
+        np.testing.assert_array_equal(again[name], series)
+
+
+def test_invalid_combinations_rejected():
+    with pytest.raises(SystemExit):
+        cli.parse_args(['--engine', 'array', '--audit', '10'])
+    with pytest.raises(SystemExit):
+        cli.parse_args(['--engine', 'meanfield', '--analyzer', 'streaming'])
+
+
+def test_model_imports_without_plotting_libraries():
+    code = ('import sys, main, cli\n'
+            'print(sorted(m for m in ("matplotlib", "pandas") if m in sys.modules))')
+    loaded = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                            text=True, check=True).stdout
+    assert loaded.strip() == '[]'
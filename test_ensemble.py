@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Seeded ensembles across a process pool.
+
+    python -m pytest test_ensemble.py
+"""
+
+# External
+import numpy as np
+
+# Froms
+from ensemble import Ensemble, replica_seeds, run_replica, results_analyzer
+
+
+def test_replica_seeds_are_distinct_and_reproducible():
+    seeds = replica_seeds(0, 8)
+    assert len(set(seeds)) == 8
+    assert seeds == replica_seeds(0, 8)
+    assert seeds != replica_seeds(1, 8)
+
+
+def test_pool_runs_match_serial_replicas():
+    ensemble = Ensemble().run(100, 10_000, 3, replicas=3, seed=5,
+                              engine='array', processes=2)
+    serial = {s: run_replica(100, 10_000, 3, s, 'array')
+              for s in replica_seeds(5, 3)}
+
+    assert sorted(r['seed'] for r in ensemble.replicas) == sorted(serial)
+    for results in ensemble.replicas:
+        expected = serial[results['seed']]
+        np.testing.assert_array_equal(results['class_measures'],
+                                      expected['class_measures'])
+        np.testing.assert_array_equal(results['final_wealths'],
+                                      expected['final_wealths'])
+
+    assert ensemble.stacked('revenues').shape == (3, 3)
+    (low, median, high) = ensemble.band('revenues')
+    assert (low <= median).all() and (median <= high).all()
+    assert ensemble.class_share_band().shape == (3, 3, 4)
+    assert ensemble.firm_size_distribution().sum() == sum(
+        r['firm_size_counts'].sum() for r in ensemble.replicas)
+
+
+def test_results_analyzer_restores_series():
+    results = run_replica(100, 10_000, 3, 1, 'array')
+    analyzer = results_analyzer(results)
+    assert analyzer.N == 100
+    np.testing.assert_array_equal(analyzer.class_measures,
+                                  results['class_measures'])
+    np.testing.assert_allclose(analyzer.wage_shares, results['wage_shares'])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+The binary event log and its replay.
+
+    python -m pytest test_events.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import random
+
+# Froms
+from main import MaterialWorld
+from events import EventLog, Replayer
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def test_event_replay_round_trip(tmp_path):
+    seeded(4)
+    world = MaterialWorld(200, 20_000)
+    world.enable_events(str(tmp_path))
+    world.run_sim(1, verbose=False)
+    world.events.close()
+
+    replayed = Replayer(str(tmp_path)).world_at(month=12)
+
+    assert replayed.market_value == pytest.approx(world.market_value)
+    for actor, copy in zip(world.actors, replayed.actors):
+        assert copy.coins == pytest.approx(actor.coins)
+        assert copy.employer == actor.employer
+        assert sorted(copy.employees) == sorted(actor.employees)
+
+
+def test_replay_mid_year(tmp_path):
+    seeded(7)
+    world = MaterialWorld(150, 15_000)
+    world.enable_events(str(tmp_path))
+    world.run_sim(1, verbose=False)
+    world.events.close()
+
+    seeded(7)
+    live = MaterialWorld(150, 15_000)
+    for month in range(5):
+        live.one_month_rule()
+
+    replayed = Replayer(str(tmp_path)).world_at(month=5)
+    assert replayed.market_value == pytest.approx(live.market_value)
+    assert ([a.coins for a in replayed.actors] ==
+            pytest.approx([a.coins for a in live.actors]))
+
+    log = EventLog(str(tmp_path))
+    assert log.last_month == 12
+    assert len(log.of_kind('month')) == 12
+    assert len(log.of_kind('month', 0, 5)) == 5
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized leaps of LeapingWorld against their sequential definitions.
+
+    python -m pytest test_leaping.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import math
+import random
+
+# Froms
+from leaping import (LeapingWorld, market_replay, payrolls, MIN_LEAP_SIZE)
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def sequential_market(market, spent, fractions):
+    '''
+    Revenues of the market replayed step by step
+    '''
+    revenues = []
+    for s, f in zip(spent.tolist(), fractions.tolist()):
+        market += s
+        revenue = math.floor(f * market + 0.5)
+        market -= revenue
+        revenues.append(revenue)
+    return np.array(revenues), market
+
+
+def test_market_replay_matches_sequential():
+    seeded(3)
+    spent = np.random.randint(0, 200, size=500).astype(np.float64)
+    fractions = np.random.random(500)
+    fractions[np.random.random(500) < 0.3] = 0
+    fractions[7] = 1.0
+
+    (revenues, left) = market_replay(1_000, spent, fractions)
+    (expected, expected_left) = sequential_market(1_000, spent, fractions)
+
+    assert (revenues >= 0).all() and left >= 0
+    assert revenues.sum() + left == 1_000 + spent.sum()
+    assert np.abs(np.cumsum(revenues) - np.cumsum(expected)).max() <= 2
+    assert abs(left - expected_left) <= 2
+
+
+def test_payrolls_pay_in_rank_order():
+    seeded(4)
+    coins = np.array([1_000.0, 150.0, 0.0, 95.0])
+    wages = np.array([50, 60, 40, 30])
+    groups = np.repeat(np.arange(4), [10, 5, 3, 4])
+    ranks = np.concatenate([np.arange(n) for n in [10, 5, 3, 4]])
+
+    amounts = payrolls(coins, wages, groups, ranks)
+    bills = np.bincount(groups, amounts, minlength=4)
+
+    assert (amounts[groups == 0] == 50).all()
+    assert amounts[groups == 1].tolist()[:2] == [60, 60]
+    assert (amounts[groups == 2] == 0).all()
+    assert amounts[groups == 3].tolist()[:3] == [30, 30, 30]
+    assert (bills <= coins).all()
+
+
+def test_leaping_conserves_money_and_employment():
+    seeded(1)
+    world = LeapingWorld(2_000, 200_000, leap_size=MIN_LEAP_SIZE)
+    for month in range(6):
+        world.one_month_rule()
+
+    assert world.coins.sum() + world.market_value == pytest.approx(200_000)
+    employed = world.employer >= 0
+    assert np.count_nonzero(employed) == world.firm_size.sum()
+    assert (np.bincount(world.employer[employed], minlength=world.N) ==
+            world.firm_size).all()
+    for firm in world.roster.buffers:
+        assert (world.employer[world.roster.employees(firm)] == firm).all()
+
+
+def test_leaps_below_the_minimum_are_refused():
+    with pytest.raises(ValueError):
+        LeapingWorld(10_000, 1_000_000, leap_size=MIN_LEAP_SIZE - 1)
+    assert LeapingWorld(100, 10_000).leap_size == 100
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+The mean-field engine against the agent engines.
+
+    python -m pytest test_meanfield.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import random
+
+# Froms
+from main import ArrayWorld
+from meanfield import MeanFieldWorld
+
+
+def class_fractions(world, years):
+    '''
+    Mean class fractions of the second half of a run
+    '''
+    world.run_sim(years, verbose=False)
+    measures = np.asarray(world.analyzer.class_measures[years // 2:], dtype=float)
+    return measures[:, :3].mean(axis=0) / world.N
+
+
+# Money per actor from scarce to far past the CLI default of 100000 / 300
+@pytest.mark.parametrize('N, M', [(1000, 50_000), (1000, 100_000),
+                                  (300, 100_000), (1000, 500_000),
+                                  (1000, 1_000_000)])
+def test_class_fractions_match_array_world(N, M):
+    random.seed(0)
+    np.random.seed(0)
+    agents = class_fractions(ArrayWorld(N, M), 24)
+    mean_field = class_fractions(MeanFieldWorld(N, M), 24)
+
+    np.testing.assert_allclose(mean_field, agents, atol=0.07)
+
+
+def test_money_is_conserved():
+    world = MeanFieldWorld(1000, 500_000)
+    world.run_sim(3, verbose=False)
+    assert world.money + world.market_value == pytest.approx(500)
+    assert world.unemployed.min() >= 0 and world.workers.min() >= 0
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Invariants of the model's data structures and persistence.
+
+    python -m pytest test_model.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import math
+import pickle
+import random
+
+# Froms
+from main import (ArrayWorld, MaterialWorld, FirmRoster, FenwickTree, payroll,
+                  normal_int, normal_ints)
+from random import normalvariate
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def check_roster(roster):
+    '''
+    Every id's slots are exactly the positions it holds
+    '''
+    positions = {}
+    for slot, id in enumerate(roster.ids):
+        positions.setdefault(id, []).append(slot)
+    assert {id: sorted(slots) for id, slots in roster.slots.items()} == positions
+
+
+def test_roster_duplicate_ids():
+    roster = FirmRoster()
+    for id in [1, 2, 1, 3, 1]:
+        roster.add(id)
+    check_roster(roster)
+
+    roster.remove(1)
+    check_roster(roster)
+    assert sorted(roster) == [1, 1, 2, 3]
+
+    roster.remove_at(roster.slots[1][0])
+    check_roster(roster)
+    assert sorted(roster) == [1, 2, 3]
+
+    roster.remove(1)
+    check_roster(roster)
+    assert 1 not in roster
+    assert sorted(roster) == [2, 3]
+
+
+def test_roster_fire():
+    seeded(0)
+    roster = FirmRoster()
+    for id in [4, 5, 4, 6, 7, 4]:
+        roster.add(id)
+
+    slots = []
+    fired = roster.fire(4, slots)
+    check_roster(roster)
+    assert len(fired) == len(slots) == 4
+    assert sorted(fired + list(roster)) == [4, 4, 4, 5, 6, 7]
+
+    assert len(roster.fire(10)) == 2
+    assert len(roster) == 0 and not roster.slots
+
+
+def test_batched_month_conserves_money_and_employment():
+    seeded(1)
+    world = ArrayWorld(300, 30_000)
+    for month in range(6):
+        world.one_month_rule()
+
+    assert world.coins.sum() + world.market_value == pytest.approx(30_000)
+    for firm in range(world.N):
+        employees = world.roster.employees(firm)
+        if employees is None:
+            assert world.firm_size[firm] == 0
+        else:
+            assert len(employees) == world.firm_size[firm]
+            assert (world.employer[employees] == firm).all()
+    assert np.count_nonzero(world.employer >= 0) == world.firm_size.sum()
+
+
+def list_normal_choice(lst):
+    '''
+    The original normal_choice, which needs the whole list
+    '''
+    mean = (len(lst) - 1) / 2
+    stddev = len(lst) / 6
+    while True:
+        index = int(normalvariate(mean, stddev) + 0.5)
+        if 0 <= index < len(lst):
+            return lst[index]
+
+
+@pytest.mark.parametrize('lo, hi', [(0, 0), (0, 1), (10, 90), (-5, 1000)])
+def test_normal_int_matches_list_choice(lo, hi):
+    seeded(5)
+    draws = [normal_int(lo, hi) for i in range(500)]
+    seeded(5)
+    assert draws == [list_normal_choice(list(range(lo, hi + 1)))
+                     for i in range(500)]
+
+
+def test_normal_ints_distribution():
+    seeded(6)
+    lo = np.array([0, 10, 100])
+    hi = np.array([0, 90, 100_000])
+    draws = normal_ints(lo, hi, size=(20_000, 3))
+
+    assert (draws >= lo).all() and (draws <= hi).all()
+    assert (draws[:, 0] == 0).all()
+    np.testing.assert_allclose(draws.mean(axis=0), (lo + hi) / 2, rtol=0.01)
+    np.testing.assert_allclose(draws[:, 2].std(), 100_001 / 6, rtol=0.05)
+
+
+def test_fenwick_find():
+    tree = FenwickTree([0.0, 2.0, 0.0, 3.0, 0.0])
+    assert tree.total == 5.0
+    assert [tree.find(v) for v in [0.0, 1.99, 2.0, 4.99]] == [1, 1, 3, 3]
+
+    # Values at or past the total land on the last positive weight
+    assert tree.find(5.0) == 3
+    assert tree.find(100.0) == 3
+
+    tree.update(3, 0.0)
+    assert tree.find(2.5) == 1
+    tree.update(1, 0.0)
+    assert tree.sample() is None
+
+
+def test_fenwick_sample_distribution():
+    seeded(2)
+    weights = [1.0, 0.0, 3.0, 6.0]
+    tree = FenwickTree(weights)
+    counts = np.bincount([tree.sample() for i in range(20_000)], minlength=4)
+    assert counts[1] == 0
+    np.testing.assert_allclose(counts / counts.sum(), np.array(weights) / 10,
+                               atol=0.015)
+
+
+def sequential_wages(coins, n, wage):
+    '''
+    Wages of the sequential wage_payment_rule
+    '''
+    wages = []
+    for i in range(n):
+        if coins - wage < 0:
+            wage = normal_int(0, math.floor(coins)) if coins > 0 else 0
+        coins -= wage
+        wages.append(wage)
+    return wages
+
+
+@pytest.mark.parametrize('coins, n, wage', [
+    (10_000.0, 50, 60), (1_000.0, 50, 60), (123.5, 20, 90), (0.0, 5, 30),
+    (59.0, 1, 60), (5_000.0, 200, 10)])
+def test_payroll_matches_sequential_wages(coins, n, wage):
+    for seed in range(5):
+        seeded(seed)
+        batched = payroll(coins, n, wage).tolist()
+        seeded(seed)
+        assert batched == sequential_wages(coins, n, wage)
+
+
+def test_ledger_conserves_money():
+    seeded(7)
+    world = MaterialWorld(200, 20_000)
+    ledger = world.enable_ledger(audit_every=50)
+    for month in range(3):
+        world.one_month_rule()
+
+    # A deep audit after each of the five rules of every 50th step
+    assert ledger.violation is None and ledger.steps == 600
+    assert ledger.audits == 5 * 12
+    assert ledger.actor_money + ledger.market_value == pytest.approx(20_000)
+    assert ledger.balances == [actor.coins for actor in world.actors]
+
+    # Actors stay plain Actors that pickle with their ledger
+    actor = pickle.loads(pickle.dumps(world.actors[0]))
+    assert type(actor) is type(world.actors[1])
+    assert actor.ledger.balances == ledger.balances
+
+
+def test_ledger_catches_coins_changed_outside_it():
+    seeded(8)
+    world = MaterialWorld(100, 10_000)
+    ledger = world.enable_ledger(audit_every=1, strict=False)
+    world.actors[5].coins += 1
+    world.simulation_rule()
+
+    assert ledger.violation['actor'] == 5
+    assert 'outside the ledger' in ledger.violation['message']
+    with pytest.raises(RuntimeError):
+        world.enable_ledger(audit_every=1)
+        world.actors[5].coins -= 1
+        world.simulation_rule()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Per-rule instrumentation of the simulation worlds.
+
+    python -m pytest test_profiling.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import random
+
+# Froms
+from main import MaterialWorld, ArrayWorld
+from leaping import LeapingWorld
+from profiling import RuleProfiler, RULES
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+@pytest.mark.parametrize('World', [MaterialWorld, ArrayWorld])
+def test_profiler_counts_every_rule_of_every_step(World):
+    seeded(0)
+    world = World(100, 10_000)
+    months = []
+    profiler = RuleProfiler(callback=lambda month, p: months.append(month))
+    profiler.attach(world)
+    for month in range(2):
+        world.one_month_rule()
+
+    report = profiler.report()
+    assert report['steps'] == 200 and len(months) == 2
+    for name in RULES:
+        assert report['rules'][name]['calls'] == 200
+
+    # Detached, the world runs its plain class methods again
+    profiler.detach()
+    assert 'one_month_rule' not in vars(world)
+    world.one_month_rule()
+    assert profiler.report()['steps'] == 200
+
+
+def test_profiler_rejects_leaping_world():
+    world = LeapingWorld(100, 10_000)
+    with pytest.raises(TypeError):
+        RuleProfiler().attach(world)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Figure data of Analyzer histories and their headless rendering.
+
+    python -m pytest test_report.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import random
+
+# Froms
+from main import ArrayWorld
+from ensemble import compact_results
+from report import figure_data, load_analyzer, render_figure
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+@pytest.fixture(scope='module')
+def world():
+    seeded(0)
+    world = ArrayWorld(100, 10_000)
+    world.run_sim(4, verbose=False)
+    return world
+
+
+def test_figures_of_a_full_history(world):
+    figures = {f['name']: f for f in figure_data(world.analyzer, step=2)}
+    assert set(figures) == {
+        'incomes_ccdf', 'wealths_ccdf', 'incomes_ccdf_per_year', 'entropy',
+        'commonwealth', 'class_sizes', 'shares', 'firm_demises', 'recessions',
+        'gdp_growth'}
+
+    # One entropy line per cap, the same as the analysis itself
+    lines = figures['entropy']['panels'][0]['lines']
+    assert len(lines) == 4
+    np.testing.assert_allclose(lines[1]['y'],
+                               world.analyzer.entropy_analysis(100, 1000))
+    assert len(figures['incomes_ccdf_per_year']['panels'][0]['lines']) == 2
+    assert figures['class_sizes']['panels'][0]['counts'].sum() == 4
+
+
+def test_results_file_has_only_series_figures(world, tmp_path):
+    path = tmp_path / 'results.npz'
+    np.savez_compressed(path, **compact_results(world.analyzer))
+    analyzer = load_analyzer(str(path))
+
+    names = [f['name'] for f in figure_data(analyzer)]
+    assert names == ['class_sizes', 'shares', 'firm_demises', 'recessions',
+                     'gdp_growth']
+
+
+def test_render_figure_writes_an_image(world, tmp_path):
+    pytest.importorskip('matplotlib')
+    figure = figure_data(world.analyzer)[0]
+    path = render_figure(figure, str(tmp_path / 'ccdf.png'))
+    with open(path, 'rb') as f:
+        assert f.read(8) == b'\x89PNG\r\n\x1a\n'
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Live metrics of the simulation service, without the HTTP server.
+
+    python -m pytest test_service.py
+"""
+
+# External
+import pytest
+
+# Built-int
+import asyncio
+import queue
+
+# Froms
+import service
+
+
+def test_worker_sends_every_year_then_end(monkeypatch):
+    events = queue.Queue()
+    monkeypatch.setattr(service, 'worker_events', events)
+    service.run_simulation(7, 100, 10_000, 3, 'array', seed=2)
+
+    messages = []
+    while not events.empty():
+        messages.append(events.get())
+    assert all(id == 7 for id, event in messages)
+
+    years = [event for id, event in messages[:-1]]
+    assert [event['year'] for event in years] == [0, 1, 2]
+    assert all(event['event'] == 'year' and sum(event['class_measures'][:3]) == 100
+               for event in years)
+    assert years[1]['gdp_growth'] == pytest.approx(
+        years[1]['revenue'] / years[0]['revenue'] - 1)
+    assert messages[-1][1] == {'event': 'end', 'status': 'done'}
+
+
+def test_slow_subscribers_keep_the_latest_events():
+    async def scenario():
+        simulation = service.Simulation(1, 100, 10, queue_size=3)
+        early = simulation.subscribe()
+        for year in range(5):
+            simulation.publish({'event': 'year', 'year': year})
+        late = simulation.subscribe()
+        simulation.end('done')
+        simulation.end('failed')
+
+        drained = []
+        for subscriber in (early, late):
+            events = []
+            while not subscriber.empty():
+                events.append(subscriber.get_nowait())
+            drained.append(events)
+        return simulation, drained
+
+    (simulation, (early, late)) = asyncio.run(scenario())
+
+    # Full queues drop their oldest events, and the end arrives once
+    assert [e.get('year') for e in early] == [3, 4, None]
+    assert [e.get('year') for e in late] == [3, 4, None]
+    assert early[-1] == {'event': 'end', 'status': 'done'}
+    assert simulation.status == 'done' and not simulation.subscribers
+    assert len(simulation.history) == 5
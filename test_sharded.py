@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Money and employment across the shards of a ShardedWorld.
+
+    python -m pytest test_sharded.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Built-int
+import random
+
+# Froms
+from sharded import ShardedWorld, market_shares
+
+
+def seeded(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def test_market_shares_add_up():
+    shares = market_shares(1001, np.array([3.0, 0.0, 5.0, 2.0]))
+    assert shares.sum() == 1001
+    assert shares[1] == 0
+
+
+@pytest.mark.parametrize('sync_interval', [0.25, 1, 5])
+def test_money_is_conserved(sync_interval):
+    seeded(2)
+    with ShardedWorld(1000, 100_000, shards=3, sync_interval=sync_interval,
+                      history=False) as world:
+        for year in range(2):
+            world.run_sim(1, verbose=False)
+            # Wages in transit are flushed at the end of every year
+            assert world.coins.sum() + world.market_value == pytest.approx(100_000)
+
+    classes = np.array(world.analyzer.class_measures)
+    assert (classes.sum(axis=1) == 1000).all()
+    assert classes[-1][2] > 0
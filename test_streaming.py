@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+StreamingAnalyzer sketches against the full Analyzer history.
+
+    python -m pytest test_streaming.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Froms
+from main import Analyzer
+from streaming import StreamingAnalyzer, gini
+
+
+N = 2_000
+
+
+def fill(analyzers, years=8, seed=0):
+    '''
+    Same log-normal years of wealth, with a growing tail, in every analyzer
+    '''
+    rng = np.random.default_rng(seed)
+    for year in range(years):
+        labels = rng.integers(0, 3, N)
+        incomes = rng.lognormal(6, 1, N)
+        wealths = rng.lognormal(4, 0.5 + 0.1 * year, N)
+        for analyzer in analyzers:
+            analyzer.store_classes(labels)
+            analyzer.store_incomes_and_wealths(incomes, wealths)
+    return analyzers
+
+
+@pytest.mark.parametrize('cap', [1000, 2000, 5000])
+def test_entropy_matches_full_analyzer(cap):
+    (full, streaming) = fill([Analyzer(N), StreamingAnalyzer(N)])
+    np.testing.assert_allclose(streaming.entropy_analysis(N, cap),
+                               full.entropy_analysis(N, cap))
+    assert streaming.year_entropy(cap) == pytest.approx(full.year_entropy(cap))
+
+
+def test_entropy_needs_explicit_cap():
+    (full, streaming) = fill([Analyzer(N), StreamingAnalyzer(N)])
+    with pytest.raises(ValueError):
+        streaming.entropy_analysis(N)
+    with pytest.raises(ValueError):
+        StreamingAnalyzer(N, entropy_caps=(0, 1000))
+
+    # The yearly entropy of the equilibrium detector bins by the year's max
+    assert streaming.year_entropy() == pytest.approx(full.year_entropy())
+
+
+def test_sketches_match_history():
+    (full, streaming) = fill([Analyzer(N), StreamingAnalyzer(N)])
+    wealths = full.distribution_values('wealths', 'worker')
+
+    median = streaming.quantile(0.5, 'wealths', 'worker')
+    assert median == pytest.approx(np.median(wealths), rel=0.02)
+    assert streaming.histograms['wealths']['worker'].total == len(wealths)
+    assert streaming.wealth_gini[-1] == pytest.approx(
+        gini(np.asarray(full.actor_wealths[-1])))
+    assert streaming.class_measures == full.class_measures
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps and their content-addressed result cache.
+
+    python -m pytest test_sweep.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Froms
+import sweep
+from sweep import DEFAULTS, grid_points, run_key, code_version
+
+
+GRID = {'N': [50, 80], 'wb': [80]}
+
+
+def run(cache):
+    return {(params['N'], seed): results for params, seed, results in
+            sweep.sweep(GRID, [0, 1], 2, 'array', cache, processes=2)}
+
+
+def test_grid_points_complete_defaults():
+    points = grid_points(GRID)
+    assert [p['N'] for p in points] == [50, 80]
+    assert all(p['wb'] == 80 and p['M'] == DEFAULTS['M'] for p in points)
+
+
+def test_run_key_covers_every_input():
+    version = code_version('array')
+    key = run_key(DEFAULTS, 0, 10, 'array', version)
+    assert key == run_key(dict(DEFAULTS), 0, 10, 'array', version)
+    assert len({key,
+                run_key(dict(DEFAULTS, mc=2), 0, 10, 'array', version),
+                run_key(DEFAULTS, 1, 10, 'array', version),
+                run_key(DEFAULTS, 0, 11, 'array', version),
+                run_key(DEFAULTS, 0, 10, 'material', version),
+                run_key(DEFAULTS, 0, 10, 'array', 'other')}) == 6
+
+
+def test_sweep_resumes_from_cache(tmp_path, monkeypatch):
+    first = run(str(tmp_path))
+    assert len(first) == 4 and len(list(tmp_path.glob('*.npz'))) == 4
+
+    # Everything is cached now, so no run may start
+    monkeypatch.setattr(sweep, 'ProcessPoolExecutor',
+                        lambda **options: pytest.fail('ran a cached point'))
+    second = run(str(tmp_path))
+    assert second.keys() == first.keys()
+    for point, results in first.items():
+        for name, values in results.items():
+            np.testing.assert_array_equal(second[point][name], values)
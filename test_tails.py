@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Power-law tail fits on synthetic data with a known tail.
+
+    python -m pytest test_tails.py
+"""
+
+# External
+import numpy as np
+import pytest
+
+# Froms
+from tails import fit_tail, bootstrap
+
+
+def pareto_tailed(n, xmin, alpha, seed):
+    '''
+    Log-normal body below xmin with a Pareto tail P(X >= x) = (x / xmin)^(1 - alpha)
+    above it, holding a fifth of the values
+    '''
+    rng = np.random.default_rng(seed)
+    body = rng.lognormal(np.log(xmin) - 1, 0.5, 4 * n // 5)
+    body = body[body < xmin]
+    tail = xmin * (1 - rng.random(n // 5)) ** (-1 / (alpha - 1))
+    return np.concatenate([body, tail])
+
+
+@pytest.mark.parametrize('alpha', [2.0, 2.5, 3.5])
+def test_fit_recovers_pareto_tail(alpha):
+    values = pareto_tailed(50_000, 100.0, alpha, seed=1)
+    fit = fit_tail(values)
+
+    # Any xmin inside the tail fits it, but not one down in the body
+    assert fit.alpha == pytest.approx(alpha, abs=0.1)
+    assert 90 <= fit.xmin <= 500 and fit.n_tail >= 1000
+    assert fit.ks < 0.02
+
+    # Non-positive values are ignored
+    assert fit_tail(np.r_[values, -values, 0.0]).alpha == fit.alpha
+
+
+def test_bootstrap_interval_covers_the_exponent():
+    values = pareto_tailed(10_000, 100.0, 2.5, seed=2)
+    result = bootstrap(values, replicas=8, seed=3, processes=1, candidates=100)
+
+    assert len(result['alphas']) == 8
+    (lo, hi) = result['alpha']
+    assert lo <= 2.5 + 0.1 and hi >= 2.5 - 0.1 and lo <= hi
+    assert bootstrap(values, replicas=8, seed=3, processes=1,
+                     candidates=100)['alpha'] == (lo, hi)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Per-year actor traces on disk.
+
+TraceAnalyzer appends every actor's coins, yearly income, employer id and
+class label to one raw column file per field as the run goes, instead of
+keeping them in RAM. TraceReader memory-maps those files, so Analyzer
+methods can slice years or actors of runs larger than memory, including
+runs that crashed half way.
+"""
+
+# External
+import numpy as np
+
+# Built-int
+import json
+import os
+
+# Froms
+from main import Analyzer
+
+
+# Column files of a trace: field -> dtype
+FIELDS = {
+    'coins': np.float64,
+    'incomes': np.float64,
+    'employer': np.int64,
+    'classes': np.int8,
+}
+
+
+class TraceWriter:
+    def __init__(self, path, N):
+        '''
+        New column files in directory path, one row of N values per year.
+        A trace already in the directory is overwritten.
+        '''
+        self.path = path
+        self.N = N
+        os.makedirs(path, exist_ok=True)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'N': N}, f)
+
+        self.files = {field: open(os.path.join(path, field + '.bin'), 'wb')
+                      for field in FIELDS}
+
+    def append(self, coins, incomes, employer, classes):
+        '''
+        Write one year and flush it, so a crash keeps every finished year
+        '''
+        row = {'coins': coins, 'incomes': incomes,
+               'employer': employer, 'classes': classes}
+        for field, dtype in FIELDS.items():
+            self.files[field].write(
+                np.ascontiguousarray(row[field], dtype=dtype).tobytes())
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TraceReader:
+    def __init__(self, path):
+        '''
+        Memory-mapped years x N views of a trace. Only complete years are mapped.
+        '''
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.N = json.load(f)['N']
+
+        files = {field: os.path.join(path, field + '.bin') for field in FIELDS}
+        self.years = min(os.path.getsize(files[field]) //
+                         (self.N * np.dtype(dtype).itemsize)
+                         for field, dtype in FIELDS.items())
+
+        for field, dtype in FIELDS.items():
+            if self.years == 0:
+                data = np.zeros((0, self.N), dtype=dtype)
+            else:
+                data = np.memmap(files[field], dtype=dtype, mode='r',
+                                 shape=(self.years, self.N))
+            setattr(self, field, data)
+
+    def analyzer(self, years=slice(None), actors=slice(None)):
+        '''
+        Analyzer over a slice of years and actors, reading the trace lazily.
+        Only the yearly class counts are computed up front.
+        '''
+        analyzer = Analyzer()
+        analyzer.incomes = self.incomes[years, actors]
+        analyzer.wealths = self.coins[years, actors]
+        analyzer.classes = self.classes[years, actors]
+        analyzer.N = analyzer.incomes.shape[1]
+        analyzer.years = len(analyzer.incomes)
+
+        for labels in analyzer.classes:
+            analyzer.count_classes(labels)
+
+        return analyzer
+
+
+class TraceAnalyzer(Analyzer):
+    def __init__(self, path, N=None):
+        '''
+        Analyzer that writes per-actor history to a trace directory instead of RAM
+        '''
+        super().__init__()
+        self.path = path
+        self.N = N
+        self.writer = None
+        self.reader = None
+        self.employer_row = None
+        self.labels = None
+
+    def reserve(self, years):
+        '''
+        Nothing to preallocate
+        '''
+
+    def class_size_measure(self, actors):
+        self.employer_row = [actor.employer if actor.is_employed() else -1
+                             for actor in actors]
+        super().class_size_measure(actors)
+
+    def class_size_measure_arrays(self, employer, firm_size, coins, yearly_income):
+        self.employer_row = employer
+        super().class_size_measure_arrays(employer, firm_size, coins, yearly_income)
+
+    def store_classes(self, labels):
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.count_classes(self.labels)
+
+    def store_incomes_and_wealths(self, incomes, wealths):
+        if self.writer is None:
+            self.N = len(incomes)
+            self.writer = TraceWriter(self.path, self.N)
+
+        self.writer.append(wealths, incomes, self.employer_row, self.labels)
+        self.years += 1
+
+    def trace(self):
+        '''
+        Reader over the years written so far
+        '''
+        if self.reader is None or self.reader.years != self.years:
+            self.reader = TraceReader(self.path)
+        return self.reader
+
+    @property
+    def actor_incomes(self):
+        return self.trace().incomes
+
+    @property
+    def actor_wealths(self):
+        return self.trace().coins
+
+    @property
+    def actor_classes(self):
+        return self.trace().classes
+
+    @property
+    def actor_employers(self):
+        return self.trace().employer
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()